@@ -0,0 +1,137 @@
+"""Benchmarks correlate_performance against the original row-loop implementation.
+
+Usage: python benchmarks/bench_correlation.py [--years 5] [--creatives 10000] [--flights 20000]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.processing import correlate_performance
+
+def make_synthetic_inputs(out_dir, years=5, creatives=10000, flights=20000, max_links=4, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = [f"{i:011d}"[-11:].replace('0', 'A', 1) for i in range(creatives)]
+    days = pd.date_range("2021-01-01", periods=int(365.25 * years), freq="D")
+
+    perf = pd.DataFrame({'day': days.strftime("%Y-%m-%d"),
+                         'PerformanceMetric': [f"{v:.1f}%" for v in rng.uniform(5, 25, len(days))]})
+    analysis = pd.DataFrame({'video_id': ids,
+                             'tom': rng.choice(['Emocional', 'Racional', 'Emocional/Racional'], creatives),
+                             'foco': rng.choice(['Produto', 'Marca'], creatives)})
+
+    starts = rng.integers(0, len(days) - 1, flights)
+    lengths = rng.integers(1, 31, flights)
+    ends = np.minimum(starts + lengths, len(days) - 1)
+    sched = {'Início': days[starts].strftime("%d/%m/%Y"), 'Fim': days[ends].strftime("%d/%m/%Y")}
+    for k in range(max_links):
+        picks = rng.integers(0, creatives, flights)
+        urls = np.array([f"https://www.youtube.com/watch?v={ids[p]}" for p in picks], dtype=object)
+        urls[rng.random(flights) < k * 0.2] = None
+        sched[f'Link {k + 1}'] = urls
+
+    paths = {name: os.path.join(out_dir, f"{name}.csv") for name in ['perf', 'sched', 'analysis']}
+    perf.to_csv(paths['perf'], index=False)
+    pd.DataFrame(sched).to_csv(paths['sched'], index=False)
+    analysis.to_csv(paths['analysis'], index=False)
+    return paths
+
+def reference_correlate_performance(performance_csv, schedule_csv, analysis_csv, output_csv):
+    # Original iterrows/while-loop implementation kept as the baseline (only the
+    # PerformanceMetric dtype check is updated for pandas' string dtype)
+    df_perf = pd.read_csv(performance_csv)
+    df_sched = pd.read_csv(schedule_csv)
+    df_analysis = pd.read_csv(analysis_csv)
+    df_perf['day'] = pd.to_datetime(df_perf['day'])
+    if 'PerformanceMetric' in df_perf.columns and not pd.api.types.is_numeric_dtype(df_perf['PerformanceMetric']):
+        df_perf['PerformanceMetric'] = df_perf['PerformanceMetric'].str.rstrip('%').astype(float)
+    daily_creatives = {}
+
+    def get_vid(url):
+        if not isinstance(url, str): return None
+        m = re.search(r'(?:v=|\/)([0-9A-Za-z_-]{11})', url)
+        return m.group(1) if m else None
+
+    creative_lookup = df_analysis.set_index('video_id').to_dict('index')
+    link_cols = [c for c in df_sched.columns if 'Link' in c]
+    for _, row in df_sched.iterrows():
+        try:
+            start = pd.to_datetime(row['Início'], format="%d/%m/%Y")
+            end = pd.to_datetime(row['Fim'], format="%d/%m/%Y")
+        except: continue
+        ids = []
+        for c in link_cols:
+            vid = get_vid(row.get(c))
+            if vid: ids.append(vid)
+        curr = start
+        while curr <= end:
+            if curr not in daily_creatives: daily_creatives[curr] = set()
+            daily_creatives[curr].update(ids)
+            curr += timedelta(days=1)
+
+    mix_rows = []
+    for date, ids in daily_creatives.items():
+        if not ids: continue
+        stats = {'emotional': 0, 'rational': 0, 'product': 0, 'brand': 0, 'total': len(ids)}
+        for vid in ids:
+            attrs = creative_lookup.get(vid, {})
+            tone = str(attrs.get('tom', '')).lower()
+            focus = str(attrs.get('foco', '')).lower()
+            if 'emocional' in tone: stats['emotional'] += 1
+            if 'racional' in tone: stats['rational'] += 1
+            if 'produto' in focus: stats['product'] += 1
+            if 'marca' in focus or 'brand' in focus: stats['brand'] += 1
+        mix_rows.append({
+            'day': date,
+            'active_creatives_count': stats['total'],
+            'mix_emotional_pct': (stats['emotional']/stats['total'])*100,
+            'mix_rational_pct': (stats['rational']/stats['total'])*100,
+            'mix_product_pct': (stats['product']/stats['total'])*100,
+            'mix_brand_pct': (stats['brand']/stats['total'])*100,
+            'active_video_ids': ",".join(list(ids))
+        })
+    final_df = pd.merge(df_perf, pd.DataFrame(mix_rows), on='day', how='inner')
+    final_df.to_csv(output_csv, index=False)
+    return final_df
+
+def _normalized(csv_path):
+    # active_video_ids came from a set in the original, so compare them order-insensitively
+    df = pd.read_csv(csv_path)
+    df['active_video_ids'] = df['active_video_ids'].map(lambda s: ",".join(sorted(s.split(","))))
+    return df
+
+def main():
+    parser = argparse.ArgumentParser(description="correlate_performance benchmark")
+    parser.add_argument("--years", type=float, default=5)
+    parser.add_argument("--creatives", type=int, default=10000)
+    parser.add_argument("--flights", type=int, default=20000)
+    parser.add_argument("--skip-reference", action="store_true", help="Only time the vectorized implementation")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_synthetic_inputs(tmp, args.years, args.creatives, args.flights)
+        out_new, out_ref = os.path.join(tmp, "new.csv"), os.path.join(tmp, "ref.csv")
+
+        t0 = time.perf_counter()
+        correlate_performance(paths['perf'], paths['sched'], paths['analysis'], out_new)
+        t_new = time.perf_counter() - t0
+        print(f"vectorized: {t_new:.2f}s")
+        if args.skip_reference: return
+
+        t0 = time.perf_counter()
+        reference_correlate_performance(paths['perf'], paths['sched'], paths['analysis'], out_ref)
+        t_ref = time.perf_counter() - t0
+        print(f"reference:  {t_ref:.2f}s  (speedup x{t_ref / t_new:.1f})")
+
+        pd.testing.assert_frame_equal(_normalized(out_new), _normalized(out_ref))
+        print("outputs identical")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""Benchmarks get_top_bottom_insights with permutation significance on synthetic data.
+
+Usage: python benchmarks/bench_insights.py [--years 5] [--creatives 10000] [--permutations 5000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.processing import correlate_performance, get_top_bottom_insights
+from bench_correlation import make_synthetic_inputs
+
+def main():
+    parser = argparse.ArgumentParser(description="get_top_bottom_insights benchmark")
+    parser.add_argument("--years", type=float, default=5)
+    parser.add_argument("--creatives", type=int, default=10000)
+    parser.add_argument("--flights", type=int, default=20000)
+    parser.add_argument("--permutations", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_synthetic_inputs(tmp, args.years, args.creatives, args.flights)
+        mix_csv = os.path.join(tmp, "mix.csv")
+        correlate_performance(paths['perf'], paths['sched'], paths['analysis'], mix_csv)
+
+        for permutations in (0, args.permutations):
+            t0 = time.perf_counter()
+            insights = get_top_bottom_insights(mix_csv, paths['analysis'], n_permutations=permutations, seed=0)
+            print(f"permutations={permutations}: {time.perf_counter() - t0:.2f}s  top={insights['top_performers'][0]}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+"""Offline end-to-end benchmark of src.acquisition, src.analysis, src.batch, src.file_registry, src.pipeline,
+src.fingerprint, src.processing, src.drivers, src.service, src.visualization, src.reporting and src.runner on
+synthetic brands, with fake yt-dlp and Gemini backends.
+
+Usage: python benchmarks/bench_pipeline.py [--tiers small medium] [--output results.json]
+                                           [--download-latency 0.05] [--generate-latency 0.1] [--error-rate 0.02]
+                                           [--compare benchmarks/results/previous.json]
+"""
+import argparse
+import contextlib
+import inspect
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import src.acquisition as acquisition
+import src.analysis as analysis
+import src.batch as batch
+import src.drivers as drivers
+import src.file_registry as file_registry
+import src.fingerprint as fingerprint
+import src.pipeline as pipeline
+import src.processing as processing
+import src.reporting as reporting
+import src.runner as runner
+import src.service as service
+import src.visualization as visualization
+from src.cache import AnalysisCache
+from src.profiling import run_profile
+from src.report_prompt import build_prompt_data
+from fakes import FakeGeminiBackend, fake_yt_dlp
+from synthetic import TIERS, make_brand, make_clip, make_delivery, make_fingerprints
+
+MODULES = [acquisition, analysis, batch, fingerprint, processing, drivers, visualization, reporting]
+RESULTS_DIR = Path(__file__).parent / "results"
+UNLIMITED = 1e12  # rate limits are not what these benchmarks measure
+
+class Bench:
+    def __init__(self, tier, repeat, verbose):
+        self.tier = tier
+        self.repeat = repeat
+        self.verbose = verbose
+        self.cases = []
+        self.timed = set()
+
+    def case(self, module, label, fn, setup=None, covers=()):
+        # `covers` names the other public functions this case exercises
+        runs = []
+        for _ in range(self.repeat):
+            if setup: setup()
+            out = contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+            with out:
+                start = time.perf_counter()
+                fn()
+                runs.append(time.perf_counter() - start)
+        name = label.split("[")[0]
+        self.timed.update((f"{module.__name__}.{n}" for n in (name, *covers)))
+        self.cases.append({"module": module.__name__, "case": label, "min_s": round(min(runs), 4),
+                           "median_s": round(statistics.median(runs), 4), "runs": len(runs)})
+        print(f"  {self.tier:<7} {label:<45} {min(runs):9.3f}s")
+
+def _reset(*paths):
+    # Directories are emptied rather than removed: VideoStore keeps one instance per directory
+    def setup():
+        for p in paths:
+            if os.path.isdir(p):
+                for child in Path(p).iterdir():
+                    shutil.rmtree(child) if child.is_dir() else child.unlink()
+            elif os.path.exists(p):
+                os.remove(p)
+    return setup
+
+@contextlib.contextmanager
+def _patched(patches):
+    # Temporarily replaces module attributes, e.g. to point config-default cache paths into the tier's root
+    saved = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    for module, name, value in patches:
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for module, name, value in saved:
+            setattr(module, name, value)
+
+def run_tier(tier, params, args, root):
+    bench = Bench(tier, args.repeat, args.verbose)
+    brand = make_brand(os.path.join(root, "inputs"), seed=args.seed, **params)
+    urls = [line.strip() for line in open(brand['urls']) if line.strip()]
+    videos_dir = os.path.join(root, "videos")
+    acquisition.yt_dlp = fake_yt_dlp(latency=args.download_latency, error_rate=args.error_rate,
+                                     video_bytes=args.video_kb * 1024)
+    backend_opts = dict(upload_latency=args.upload_latency, processing_time=args.processing_time,
+                        generate_latency=args.generate_latency, error_rate=args.error_rate,
+                        invalid_json_rate=args.invalid_json_rate, seed=args.seed)
+    run_profile.reset()
+
+    # src.acquisition
+    bench.case(acquisition, "get_video_id", lambda: [acquisition.get_video_id(u) for u in urls])
+    bench.case(acquisition, "download_video", lambda: acquisition.download_video(urls[0], os.path.join(root, "single")),
+               setup=_reset(os.path.join(root, "single")))
+    downloaded = {}
+    def download():
+        downloaded.update(acquisition.download_videos(urls, videos_dir, workers=args.download_workers,
+                                                      host_rate=UNLIMITED)[0])
+    bench.case(acquisition, "download_videos[cold]", download, setup=_reset(videos_dir),
+               covers=("download_with_retry", "download_video"))
+    bench.case(acquisition, "download_videos[cached]", download)
+    metrics_cache, metrics_json = os.path.join(root, "metrics_cache.json"), os.path.join(root, "metrics.json")
+    fetch = lambda: acquisition.fetch_metrics(urls, output_file=metrics_json, cache_path=metrics_cache,
+                                              workers=args.download_workers)
+    bench.case(acquisition, "fetch_metrics[cold]", fetch, setup=_reset(metrics_cache, metrics_json))
+    bench.case(acquisition, "fetch_metrics[cached]", fetch)
+
+    # src.analysis
+    analysis_out = os.path.join(root, "analysis_out")
+    cache_dir = os.path.join(root, "analysis_cache")
+    jobs = [(path, url, os.path.join(analysis_out, f"{Path(path).stem}.json")) for url, path in downloaded.items()]
+    def analyze():
+        os.makedirs(analysis_out, exist_ok=True)
+        analysis.analyze_videos(jobs, backend=FakeGeminiBackend(**backend_opts), workers=args.analysis_workers,
+                                rpm=UNLIMITED, tpm=UNLIMITED, cache=AnalysisCache(cache_dir))
+    bench.case(analysis, "analyze_videos[cold]", analyze, setup=_reset(analysis_out, cache_dir),
+               covers=("upload_video", "wait_until_active", "generate_analysis", "save_analysis", "release_file",
+                       "make_limiters", "load_existing_analysis"))
+    bench.case(analysis, "analyze_videos[existing]", analyze)
+    bench.case(analysis, "analyze_video_file", lambda: analysis.analyze_video_file(
+        jobs[0][0], jobs[0][1], None, os.path.join(root, "single.json"), backend=FakeGeminiBackend(**backend_opts)),
+        setup=_reset(os.path.join(root, "single.json")))
+
+    # src.file_registry: concurrent acquires of the same bytes share one upload, and a sweep (here over a
+    # 1-byte quota) deletes no handle until it is released
+    registry_path = os.path.join(root, "gemini_files.json")
+    def share_uploads():
+        fake = FakeGeminiBackend(upload_latency=args.upload_latency)
+        registry = file_registry.FileRegistry(fake, path=registry_path, quota_bytes=1)
+        paths = list(downloaded.values())
+        with ThreadPoolExecutor(max_workers=max(1, args.analysis_workers)) as pool:
+            handles = list(pool.map(registry.acquire, paths[:1] * 8 + paths[1:]))
+        assert fake.calls["upload"] == len(paths), f"{fake.calls['upload']} uploads for {len(paths)} files"
+        assert registry.sweep() == 0, "a held handle was swept"
+        for handle in handles:
+            registry.release(handle.name)
+        assert registry.sweep() == len(paths), "released handles over the quota were kept"
+    bench.case(file_registry, "FileRegistry[shared uploads]", share_uploads, setup=_reset(registry_path))
+
+    # src.pipeline: every streamed download ends with an analysis; the rerun reuses them without API calls
+    stream_videos, stream_analysis = os.path.join(root, "stream_videos"), os.path.join(root, "stream_analysis")
+    def stream(expect_calls):
+        def run():
+            fake = FakeGeminiBackend(upload_latency=args.upload_latency, generate_latency=args.generate_latency)
+            video_paths, _, results = pipeline.run_streaming_pipeline(
+                urls, stream_videos, stream_analysis, backend=fake, download_workers=args.download_workers,
+                analysis_workers=args.analysis_workers, host_rate=UNLIMITED, rpm=UNLIMITED, tpm=UNLIMITED)
+            assert set(results) == {Path(path).stem for path in video_paths.values()}, "streamed videos left without an analysis"
+            assert expect_calls or fake.calls == {"upload": 0, "generate": 0}, f"rerun made API calls: {fake.calls}"
+        return run
+    bench.case(pipeline, "run_streaming_pipeline[cold]", stream(True), setup=_reset(stream_videos, stream_analysis))
+    bench.case(pipeline, "run_streaming_pipeline[existing]", stream(False))
+
+    # src.batch (LocalBatchBackend stands in for the batch endpoint); one entry fails outright and three get
+    # malformed JSON (a list, a string, a syntax error), so all four must come back on the resubmitted batch
+    batch_out = os.path.join(root, "batch_out")
+    batch_jobs = [(path, url, os.path.join(batch_out, Path(out).name)) for path, url, out in jobs]
+    def run_batch():
+        os.makedirs(batch_out, exist_ok=True)
+        fake = FakeGeminiBackend(upload_latency=args.upload_latency, generate_latency=args.generate_latency,
+                                 malformed=["[]", '"text"', "{not json"])
+        local = batch.LocalBatchBackend(fake, fail_keys=[batch_jobs[-1][2]])
+        results = batch.run_batch_analysis(batch_jobs, fake, local, workers=args.analysis_workers)
+        assert all(data is not None for data in results.values()), "batch entries left without an analysis"
+        assert len(local.submitted) == 2, f"expected one resubmission, got {len(local.submitted) - 1}"
+    bench.case(batch, "run_batch_analysis", run_batch, setup=_reset(batch_out))
+
+    # src.fingerprint
+    if shutil.which("ffmpeg"):
+        clip = make_clip(os.path.join(root, "clip.mp4"), seconds=30)
+        bench.case(fingerprint, "fingerprint_video", lambda: fingerprint.fingerprint_video(clip))
+    rng = np.random.default_rng(args.seed)
+    thumbs = rng.integers(0, 256, (120, 8, 9)).astype(np.uint8)
+    pcm = (rng.standard_normal(60 * fingerprint.FINGERPRINT_AUDIO_RATE) * 3000).astype(np.int16)
+    bench.case(fingerprint, "dhash", lambda: fingerprint.dhash(thumbs))
+    bench.case(fingerprint, "audio_fingerprint", lambda: fingerprint.audio_fingerprint(pcm))
+    fingerprints = make_fingerprints(params["creatives"], seed=args.seed)
+    bench.case(fingerprint, "candidate_pairs",
+               lambda: fingerprint.candidate_pairs([fp["frames"] for fp in fingerprints.values()]))
+    bench.case(fingerprint, "find_duplicates", lambda: fingerprint.find_duplicates(fingerprints),
+               covers=("frame_similarity", "audio_similarity"))
+    duplicates_csv = os.path.join(root, "duplicates.csv")
+    bench.case(fingerprint, "write_duplicates", lambda: fingerprint.write_duplicates(
+        fingerprint.find_duplicates(fingerprints), duplicates_csv))
+    bench.case(fingerprint, "load_duplicates", lambda: fingerprint.load_duplicates(duplicates_csv))
+    # Every third downloaded video as a re-upload of the one before it
+    duplicates = {Path(job[2]).stem: {"video_id": Path(job[2]).stem, "canonical_video_id": Path(jobs[i - 1][2]).stem,
+                                      "video_similarity": "1.0", "audio_similarity": "0.95"}
+                  for i, job in enumerate(jobs) if i % 3 == 2}
+    bench.case(fingerprint, "split_duplicate_jobs", lambda: fingerprint.split_duplicate_jobs(jobs, duplicates))
+    _, inherited = fingerprint.split_duplicate_jobs(jobs, duplicates)
+    bench.case(fingerprint, "inherit_analyses", lambda: fingerprint.inherit_analyses(inherited, duplicates),
+               covers=("duplicate_similarity",))
+
+    # src.processing
+    master_csv = os.path.join(root, "master_analysis.csv")
+    master_parquet = master_csv.replace(".csv", ".parquet")
+    manifest = master_csv.replace(".csv", ".manifest.json")
+    payloads = [(Path(p).stem, json.load(open(p, encoding='utf-8'))) for p in Path(brand['analysis_dir']).glob("*.json")]
+    bench.case(processing, "flatten_analysis", lambda: [processing.flatten_analysis(v, d) for v, d in payloads])
+    rows = [processing.flatten_analysis(v, d) for v, d in payloads]
+    bench.case(processing, "append_analysis_rows", lambda: processing.append_analysis_rows(rows, os.path.join(root, "rows.csv")),
+               setup=_reset(os.path.join(root, "rows.csv")))
+    aggregate = lambda: processing.aggregate_results(brand['analysis_dir'], master_parquet, export_csv=master_csv)
+    bench.case(processing, "aggregate_results[cold]", aggregate, setup=_reset(master_parquet, master_csv, manifest))
+    bench.case(processing, "aggregate_results[unchanged]", aggregate)
+
+    df_sched = pd.read_csv(brand['sched'])
+    df_analysis = pd.read_csv(master_csv)
+    bench.case(processing, "load_performance", lambda: processing.load_performance(brand['perf']))
+    bench.case(processing, "schedule_flights", lambda: processing.schedule_flights(df_sched))
+    flights = processing.schedule_flights(df_sched)
+    bench.case(processing, "explode_flights", lambda: processing.explode_flights(flights))
+    bench.case(processing, "expand_schedule", lambda: processing.expand_schedule(df_sched))
+    pairs = processing.expand_schedule(df_sched)
+    bench.case(processing, "creative_indicators", lambda: processing.creative_indicators(df_analysis))
+    bench.case(processing, "compute_daily_mix", lambda: processing.compute_daily_mix(pairs, df_analysis))
+    delivery_csv = make_delivery(brand['sched'], os.path.join(root, "delivery.csv"), seed=args.seed)
+    bench.case(processing, "load_delivery", lambda: processing.load_delivery(delivery_csv))
+    bench.case(processing, "schedule_weights", lambda: processing.schedule_weights(pairs))
+    weights = processing.schedule_weights(pairs)
+    delivery = processing.load_delivery(delivery_csv)
+    bench.case(processing, "weighted_daily_mix", lambda: processing.weighted_daily_mix(delivery, df_analysis))
+    bench.case(processing, "scheduled_delivery", lambda: processing.scheduled_delivery(delivery, weights))
+    mix_csv = os.path.join(root, "creative_mix_performance.csv")
+    state_dir = os.path.join(root, processing.MIX_STATE_DIRNAME)
+    correlate = lambda incremental: processing.correlate_performance(brand['perf'], brand['sched'], master_csv,
+                                                                     mix_csv, incremental=incremental)
+    bench.case(processing, "correlate_performance[full]", lambda: correlate(False))
+    bench.case(processing, "update_daily_mix[cold]", lambda: processing.update_daily_mix(df_sched, df_analysis, state_dir),
+               setup=_reset(state_dir))
+    bench.case(processing, "correlate_performance[incremental-unchanged]", lambda: correlate(True),
+               covers=("update_daily_mix",))
+    mix = correlate(False)
+    bench.case(processing, "get_portfolio_summary", lambda: processing.get_portfolio_summary(master_csv))
+    bench.case(processing, "incidence_matrix", lambda: processing.incidence_matrix(mix['active_video_ids']))
+    matrix, _ = processing.incidence_matrix(mix['active_video_ids'])
+    observed = np.zeros(matrix.shape[1], dtype=np.float32)
+    bench.case(processing, "permutation_pvalues", lambda: processing.permutation_pvalues(
+        matrix, 20, observed, args.permutations, seed=args.seed))
+    bench.case(processing, "get_top_bottom_insights[no-permutations]",
+               lambda: processing.get_top_bottom_insights(mix, master_csv), covers=("net_scores",))
+    bench.case(processing, f"get_top_bottom_insights[{args.permutations}-permutations]",
+               lambda: processing.get_top_bottom_insights(mix, master_csv, n_permutations=args.permutations, seed=args.seed))
+
+    # src.drivers
+    features = drivers.attribute_features(df_analysis)
+    calendar = pd.date_range(pairs['day'].min(), pairs['day'].max(), freq='D')
+    bench.case(drivers, "attribute_features", lambda: drivers.attribute_features(df_analysis))
+    bench.case(drivers, "daily_feature_mix", lambda: drivers.daily_feature_mix(weights, features, calendar))
+    feature_mix = drivers.daily_feature_mix(weights, features, calendar)
+    kpi = np.random.default_rng(args.seed).random(len(calendar))
+    bench.case(drivers, "adstock", lambda: drivers.adstock(feature_mix, [0.3, 0.6, 0.8]))
+    bench.case(drivers, "lagged_correlations", lambda: drivers.lagged_correlations(feature_mix, kpi))
+    bench.case(drivers, "driver_table", lambda: drivers.driver_table(feature_mix, features, kpi))
+    bench.case(drivers, "correlate_drivers", lambda: drivers.correlate_drivers(
+        brand['perf'], brand['sched'], master_csv, os.path.join(root, "creative_drivers.csv")))
+
+    # src.service (root holds a brand's master, mix, drivers and metrics; not in MODULES since serve() blocks)
+    bench.case(service, "BrandIndex", lambda: service.BrandIndex(root))
+    index = service.BrandIndex(root)
+    attribute = {"tom": [df_analysis['tom'].dropna().iloc[0]]}
+    period = {"start": [str(calendar[len(calendar) // 4].date())], "end": [str(calendar[len(calendar) // 2].date())]}
+    bench.case(service, "BrandIndex.summary", lambda: index.summary({**attribute, **period}))
+    bench.case(service, "BrandIndex.insights", lambda: index.insights({**attribute, **period}))
+    bench.case(service, "BrandIndex.videos", lambda: index.videos({**attribute, **period}))
+    bench.case(service, "BrandIndex.mix_rows", lambda: index.mix_rows(period))
+    server = service.make_server(root, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/insights?n=20"
+    bench.case(service, "make_server[GET /insights]", lambda: urllib.request.urlopen(url).read())
+    server.shutdown()
+    server.server_close()
+
+    # src.visualization
+    viz_dir = os.path.join(root, "visualizations")
+    visualize = lambda: visualization.generate_visualizations(mix, viz_dir, analysis=master_csv)
+    bench.case(visualization, "generate_visualizations[cold]", visualize, setup=_reset(viz_dir))
+    bench.case(visualization, "generate_visualizations[unchanged]", visualize)
+    bench.case(visualization, "load_charts", lambda: visualization.load_charts(viz_dir))
+
+    # src.reporting
+    insights = processing.get_top_bottom_insights(mix, master_csv)
+    summary = processing.get_portfolio_summary(master_csv)
+    metrics = json.load(open(metrics_json, encoding='utf-8'))
+    report_cache = os.path.join(root, "report_sections")
+    report = lambda: reporting.generate_html_report(insights, summary, mix, metrics, brand['analysis_dir'], viz_dir,
+                                                    os.path.join(root, "final_report.html"), None,
+                                                    backend=FakeGeminiBackend(**backend_opts), cache_dir=report_cache)
+    bench.case(reporting, "build_prompt_data", lambda: build_prompt_data(summary, mix, insights, []))
+    bench.case(reporting, "generate_html_report[cold]", report, setup=_reset(report_cache),
+               covers=("section_prompts", "generate_narratives", "render_report"))
+    bench.case(reporting, "generate_html_report[cached]", report)
+
+    profile = run_profile.summary()
+
+    # src.runner (after the summary: run_brands resets the run profile). A manifest brand end to end, then a
+    # rerun that skips every stage without API calls; its caches go under root instead of the config paths
+    runner_out, runner_cache = os.path.join(root, "runner"), Path(root) / "runner_cache"
+    entries = [{"brand": "bench", "urls": brand['urls'], "perf": brand['perf'], "sched": brand['sched']}]
+    isolated = [(runner, "AnalysisCache", partial(AnalysisCache, runner_cache / "analysis")),
+                (runner, "FileRegistry", partial(file_registry.FileRegistry, path=runner_cache / "gemini_files.json")),
+                (acquisition, "fetch_metrics", partial(acquisition.fetch_metrics, cache_path=runner_cache / "metrics.json")),
+                (reporting, "generate_html_report", partial(reporting.generate_html_report,
+                                                            cache_dir=runner_cache / "report_sections"))]
+    def run_brands(expect_calls):
+        def run():
+            fake = FakeGeminiBackend(upload_latency=args.upload_latency, generate_latency=args.generate_latency)
+            with _patched(isolated):
+                reports = runner.run_brands(entries, api_key="bench", backend=fake, output_dir=runner_out,
+                                            download_workers=args.download_workers,
+                                            analysis_workers=args.analysis_workers, host_rate=UNLIMITED,
+                                            rpm=UNLIMITED, tpm=UNLIMITED, permutations=args.permutations)
+            assert reports["bench"], "manifest brand has no report"
+            assert expect_calls or fake.calls == {"upload": 0, "generate": 0}, f"rerun made API calls: {fake.calls}"
+        return run
+    bench.case(runner, "run_brands[cold]", run_brands(True), setup=_reset(runner_out, str(runner_cache)))
+    bench.case(runner, "run_brands[fresh]", run_brands(False))
+    return {"params": params, "cases": bench.cases, "api": profile["api"], "tokens": profile["tokens"],
+            "bytes": profile["bytes"]}, bench.timed
+
+def _untimed(timed):
+    names = []
+    for module in MODULES:
+        for name, fn in inspect.getmembers(module, inspect.isfunction):
+            if fn.__module__ == module.__name__ and not name.startswith("_") and f"{module.__name__}.{name}" not in timed:
+                names.append(f"{module.__name__}.{name}")
+    return names
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path, threshold):
+    baseline = json.load(open(baseline_path, encoding='utf-8'))
+    regressions = []
+    for tier, data in results["tiers"].items():
+        before = {c["case"]: c for c in baseline.get("tiers", {}).get(tier, {}).get("cases", [])}
+        for case in data["cases"]:
+            old = before.get(case["case"])
+            if not old or old["min_s"] <= 0: continue
+            ratio = case["min_s"] / old["min_s"]
+            # Sub-10ms cases are too noisy to flag
+            if ratio > threshold and case["min_s"] - old["min_s"] > 0.01:
+                regressions.append(f"{tier} {case['case']}: {old['min_s']:.3f}s -> {case['min_s']:.3f}s (x{ratio:.2f})")
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('meta', {}).get('commit')}):")
+    print("\n".join(f"  REGRESSION {r}" for r in regressions) or "  no regressions")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end offline pipeline benchmark")
+    parser.add_argument("--tiers", nargs="+", default=["small", "medium"], choices=list(TIERS))
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case (min and median are reported)")
+    parser.add_argument("--download-latency", type=float, default=0.05, help="Seconds per fake yt-dlp call")
+    parser.add_argument("--upload-latency", type=float, default=0.05)
+    parser.add_argument("--processing-time", type=float, default=0.0, help="Seconds a fake upload stays PROCESSING")
+    parser.add_argument("--generate-latency", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake calls failing with a 429")
+    parser.add_argument("--invalid-json-rate", type=float, default=0.0)
+    parser.add_argument("--video-kb", type=int, default=64)
+    parser.add_argument("--download-workers", type=int, default=acquisition.DOWNLOAD_WORKERS)
+    parser.add_argument("--analysis-workers", type=int, default=analysis.ANALYSIS_WORKERS)
+    parser.add_argument("--permutations", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Results JSON (default: benchmarks/results/bench-<timestamp>.json)")
+    parser.add_argument("--compare", help="Earlier results JSON; exits non-zero on regressions")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio counted as a regression")
+    parser.add_argument("--verbose", action="store_true", help="Show pipeline output")
+    args = parser.parse_args()
+
+    options = {k: v for k, v in vars(args).items() if k not in ("output", "compare", "verbose")}
+    results = {"meta": {"commit": _git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+                        "cpus": os.cpu_count(), "options": options},
+               "tiers": {}}
+    timed = set()
+    cwd = os.getcwd()
+    for tier in args.tiers:
+        with tempfile.TemporaryDirectory() as root:
+            os.chdir(root)  # keeps anything written relative to the working directory out of the repo
+            try:
+                results["tiers"][tier], covered = run_tier(tier, TIERS[tier], args, root)
+            finally:
+                os.chdir(cwd)
+        timed |= covered
+    results["untimed"] = _untimed(timed)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2), encoding='utf-8')
+    print(f"\nResults: {output}")
+    if results["untimed"]: print(f"Not benchmarked: {', '.join(results['untimed'])}")
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
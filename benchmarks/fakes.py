@@ -0,0 +1,147 @@
+"""Offline stand-ins for yt_dlp and the Gemini backend with configurable latency and error rates."""
+import json
+import os
+import random
+import threading
+import time
+import types
+
+class TransientError(Exception):
+    """Looks like a 429 to src.throttling.is_transient_error."""
+    code = 429
+
+class FakeYoutubeDL:
+    """Drop-in for yt_dlp.YoutubeDL: writes `video_bytes` random bytes per download."""
+
+    def __init__(self, opts=None, latency=0.05, error_rate=0.0, video_bytes=64 * 1024, seed=None):
+        self.opts = opts or {}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.video_bytes = video_bytes
+        self.rng = random.Random(seed)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url, download=True):
+        time.sleep(self.latency)
+        if self.rng.random() < self.error_rate:
+            raise TransientError(f"HTTP Error 429: fake yt-dlp failure for {url}")
+        video_id = url[-11:]
+        info = {"id": video_id, "title": f"Creative {video_id}", "duration": 30,
+                "view_count": self.rng.randint(0, 10 ** 6), "like_count": self.rng.randint(0, 10 ** 4),
+                "comment_count": self.rng.randint(0, 10 ** 3)}
+        if download and not self.opts.get("skip_download"):
+            path = self.opts["outtmpl"] % {"ext": "mp4"}
+            with open(path, "wb") as f:
+                f.write(video_id.encode() + os.urandom(self.video_bytes))
+            info["requested_downloads"] = [{"filepath": path}]
+        return info
+
+def fake_yt_dlp(latency=0.05, error_rate=0.0, video_bytes=64 * 1024):
+    """Module-like object to assign to src.acquisition.yt_dlp."""
+    def factory(opts=None):
+        return FakeYoutubeDL(opts, latency=latency, error_rate=error_rate, video_bytes=video_bytes)
+    return types.SimpleNamespace(YoutubeDL=factory)
+
+class _State:
+    def __init__(self, name):
+        self.name = name
+
+class _File:
+    def __init__(self, name, ready_at):
+        self.name = name
+        self.uri = f"https://fake/{name}"
+        self.mime_type = "video/mp4"
+        self.ready_at = ready_at
+
+    @property
+    def state(self):
+        return _State("ACTIVE" if time.monotonic() >= self.ready_at else "PROCESSING")
+
+class _Usage:
+    def __init__(self, prompt, response):
+        self.prompt_token_count = prompt
+        self.candidates_token_count = response
+        self.total_token_count = prompt + response
+
+class _Response:
+    def __init__(self, text, prompt_tokens):
+        self.text = text
+        self.usage_metadata = _Usage(prompt_tokens, len(text) // 4)
+
+class FakeGeminiBackend:
+    """GeminiBackend look-alike; video prompts get a random valid analysis, text prompts an HTML fragment.
+
+    `malformed` texts (e.g. "[]", "{not json") answer the first video prompts, in order.
+    """
+
+    def __init__(self, upload_latency=0.05, processing_time=0.0, generate_latency=0.1, error_rate=0.0,
+                 invalid_json_rate=0.0, seed=None, malformed=()):
+        self.upload_latency = upload_latency
+        self.processing_time = processing_time
+        self.generate_latency = generate_latency
+        self.error_rate = error_rate
+        self.invalid_json_rate = invalid_json_rate
+        self.malformed = list(malformed)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.files = {}
+        self.calls = {"upload": 0, "generate": 0}
+
+    def _maybe_fail(self, what):
+        with self.lock:
+            failed = self.rng.random() < self.error_rate
+        if failed: raise TransientError(f"429 Resource has been exhausted ({what})")
+
+    def upload_file(self, path):
+        time.sleep(self.upload_latency)
+        self._maybe_fail("upload")
+        with self.lock:
+            self.calls["upload"] += 1
+            name = f"files/{len(self.files)}"
+            self.files[name] = _File(name, time.monotonic() + self.processing_time)
+        return self.files[name]
+
+    def get_file(self, name):
+        return self.files[name]
+
+    def delete_file(self, name):
+        with self.lock:
+            self.files.pop(name, None)
+
+    def generate_content(self, contents, generation_config=None):
+        time.sleep(self.generate_latency)
+        self._maybe_fail("generate")
+        with self.lock:
+            self.calls["generate"] += 1
+            invalid = self.rng.random() < self.invalid_json_rate
+            rng = random.Random(self.rng.random())
+            scripted = self.malformed.pop(0) if self.malformed and not isinstance(contents, str) else None
+        if isinstance(contents, str):
+            return _Response("<p>Narrativa sintética.</p>", len(contents) // 4)
+        if scripted is not None:
+            return _Response(scripted, 1000)
+        if invalid:
+            return _Response("{not json", 1000)
+        return _Response(json.dumps(synthetic_analysis(rng), ensure_ascii=False), 1000)
+
+def synthetic_analysis(rng, text_words=120):
+    words = ["marca", "produto", "sabor", "momento", "amigos", "gelo", "copo", "festa", "refrescante", "close"]
+    text = lambda: " ".join(rng.choice(words) for _ in range(text_words))
+    return {
+        "metadata": {},
+        "analise_visual": text(), "transcricao": text(), "atencao": text(), "branding": text(),
+        "conexao": text(), "direcao": text(),
+        "ocasiao_consumo": rng.choice(["Almoço", "Jantar", "Festa", "Lanche", "Esporte"]),
+        "ritual_sensorial": rng.choice(["Gelo no copo", "Abrir lata", "Nenhum"]),
+        "variante_produto": rng.choice(["Original", "Zero"]),
+        "gancho_promocional": rng.choice(["Preço", "Nenhum"]),
+        "cenario": rng.choice(["Casa", "Restaurante", "Rua", "Estádio"]),
+        "foco": rng.choice(["Produto", "Marca"]),
+        "tom": rng.choice(["Racional", "Emocional"]),
+        "abcd_score": {k: rng.randint(0, 10) for k in ("attention", "branding", "connection", "direction")}
+    }
@@ -0,0 +1,97 @@
+"""Synthetic brand inputs: URL list, analysis JSONs, daily KPI, flight schedule and delivery CSVs,
+plus video clips and fingerprints for near-duplicate detection."""
+import json
+import os
+import random
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+from bench_correlation import make_synthetic_inputs
+from fakes import synthetic_analysis
+from src.processing import expand_schedule
+
+TIERS = {
+    "small": {"creatives": 20, "years": 0.5, "flights": 200},
+    "medium": {"creatives": 200, "years": 2, "flights": 2000},
+    "large": {"creatives": 2000, "years": 5, "flights": 20000},
+}
+
+def make_brand(out_dir, creatives, years, flights, seed=0):
+    """Writes a brand's inputs under out_dir and returns their paths.
+
+    `analysis/` holds one Gemini-style JSON per creative whose foco/tom match the
+    schedule generator's attributes, so correlations and Net Scores are non-trivial.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = make_synthetic_inputs(out_dir, years, creatives, flights, seed=seed)
+    attributes = pd.read_csv(paths['analysis'])
+    urls = [f"https://www.youtube.com/watch?v={vid}" for vid in attributes['video_id']]
+    paths['urls'] = os.path.join(out_dir, "urls.txt")
+    with open(paths['urls'], 'w') as f:
+        f.write("\n".join(urls) + "\n")
+
+    paths['analysis_dir'] = os.path.join(out_dir, "analysis")
+    os.makedirs(paths['analysis_dir'], exist_ok=True)
+    rng = random.Random(seed)
+    for url, row in zip(urls, attributes.itertuples()):
+        data = synthetic_analysis(rng)
+        data.update(metadata={"url": url}, foco=row.foco, tom=row.tom)
+        with open(os.path.join(paths['analysis_dir'], f"{row.video_id}.json"), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+    return paths
+
+def make_delivery(schedule_csv, out_csv, rows_per_day=3, seed=0):
+    """Writes a delivery CSV (day, link, spend, impressions) for every scheduled creative-day.
+
+    Each creative-day is split over `rows_per_day` rows (one per placement), which
+    load_delivery sums back together.
+    """
+    pairs = expand_schedule(pd.read_csv(schedule_csv))
+    rows = pairs.loc[pairs.index.repeat(rows_per_day)]
+    rng = np.random.default_rng(seed)
+    impressions = rng.integers(100, 10_000, len(rows))
+    pd.DataFrame({
+        'day': rows['day'].dt.strftime('%Y-%m-%d').to_numpy(),
+        'link': "https://www.youtube.com/watch?v=" + rows['video_id'].astype(str).to_numpy(),
+        'spend': (impressions * rng.uniform(0.002, 0.02, len(rows))).round(2),
+        'impressions': impressions,
+    }).to_csv(out_csv, index=False)
+    return out_csv
+
+def make_fingerprints(creatives, copies=3, seed=0):
+    """{video_id: fingerprint} for `creatives` spots plus up to `copies` near-duplicates of a third of them.
+
+    Copies are re-encodes (a few flipped bits per frame hash, 5% audio bit errors)
+    or cutdowns (the first half); every spot ends on the same brand end card.
+    """
+    rng = np.random.default_rng(seed)
+    end_card = rng.integers(0, 2 ** 63, 6, dtype=np.uint64)
+    flip = lambda h, bits, n: h ^ (np.uint64(1) << rng.integers(0, bits, (n, len(h)), dtype=np.uint64)).sum(
+        axis=0, dtype=np.uint64)
+    fingerprints = {}
+    for i in range(creatives):
+        seconds = int(rng.choice([15, 30, 60]))
+        frames = np.concatenate([rng.integers(0, 2 ** 63, 2 * seconds - 6, dtype=np.uint64), end_card])
+        audio = rng.integers(0, 2 ** 32, int(seconds * 10.8), dtype=np.uint32)
+        fingerprints[f"S{i:010d}"] = {"duration": float(seconds), "frames": frames, "audio": audio}
+        for c in range(copies if i % 3 == 0 else 0):
+            cut = c % 2 == 1
+            n_frames, n_audio = (len(frames) // 2, len(audio) // 2) if cut else (len(frames), len(audio))
+            noise = rng.random((len(audio), 32)) < 0.05
+            fingerprints[f"D{i:07d}c{c:02d}"] = {
+                "duration": seconds / 2 if cut else float(seconds),
+                "frames": flip(frames, 64, 2)[:n_frames],
+                "audio": (audio ^ (noise.astype(np.uint32) << np.arange(32, dtype=np.uint32)).sum(
+                    axis=1, dtype=np.uint32))[:n_audio]}
+    return fingerprints
+
+def make_clip(out_path, seconds=30, ffmpeg="ffmpeg"):
+    """Renders a 360p test-pattern clip with a stepped two-tone soundtrack (needs ffmpeg)."""
+    audio = ("aevalsrc=0.4*sin(2*PI*(220+110*mod(floor(t*2)\\,7))*t)+0.2*sin(2*PI*(660+50*mod(floor(t*3)\\,5))*t)"
+             f":s=44100:d={seconds}")
+    subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-f", "lavfi", "-i",
+                    f"testsrc2=size=640x360:rate=25:duration={seconds}", "-f", "lavfi", "-i", audio, "-shortest",
+                    "-c:v", "libx264", "-preset", "veryfast", "-c:a", "aac", str(out_path)], check=True)
+    return str(out_path)
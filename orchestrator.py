@@ -1,99 +1,144 @@
 import os
+import sys
 import argparse
-from pathlib import Path
-from dotenv import load_dotenv
 
-from src.acquisition import download_video, fetch_metrics
-from src.analysis import analyze_video_file
-from src.processing import aggregate_json_to_csv, correlate_performance, get_portfolio_summary, get_top_bottom_insights
-from src.reporting import generate_html_report
-from src.visualization import generate_visualizations
-from src.config import OUTPUT_DIR
+from src import stages
+from src.config import OUTPUT_DIR, DOWNLOAD_WORKERS, ANALYSIS_WORKERS, INSIGHT_PERMUTATIONS, SERVICE_HOST, SERVICE_PORT
+from src.profiling import run_profile
 
-def main():
+COMMANDS = stages.STAGES + ["all", "serve"]
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Creative Ad Analyzer Orchestrator")
-    parser.add_argument("--brand", required=True, help="Brand name (e.g., Coca-Cola)")
-    parser.add_argument("--urls", required=True, help="Path to text file with YouTube URLs")
-    parser.add_argument("--perf", help="Path to daily performance CSV")
-    parser.add_argument("--sched", help="Path to schedule CSV")
-    parser.add_argument("--cookies", help="Path to cookies.txt for yt-dlp")
-    
-    args = parser.parse_args()
-    load_dotenv()
-    
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print("Error: GEMINI_API_KEY not found in environment.")
-        return
+    commands = parser.add_subparsers(dest="command", metavar="command", required=True)
 
-    # Setup directories
-    brand_dir = OUTPUT_DIR / args.brand
-    videos_dir = brand_dir / "videos"
-    analysis_dir = brand_dir / "analysis"
-    viz_dir = brand_dir / "visualizations"
-    
-    for d in [videos_dir, analysis_dir, viz_dir]:
-        d.mkdir(parents=True, exist_ok=True)
+    brand = argparse.ArgumentParser(add_help=False)
+    brand.add_argument("--brand", help="Brand name (e.g., Coca-Cola)")
+    brand.add_argument("--force", action="store_true", help="Run even if the stage's inputs are unchanged")
+    urls = argparse.ArgumentParser(add_help=False)
+    urls.add_argument("--urls", help="Path to text file with YouTube URLs (defaults to the last one used)")
+    download = argparse.ArgumentParser(add_help=False)
+    download.add_argument("--cookies", help="Path to cookies.txt for yt-dlp")
+    download.add_argument("--download-workers", type=int, default=DOWNLOAD_WORKERS, help="Concurrent video downloads")
+    analysis = argparse.ArgumentParser(add_help=False)
+    analysis.add_argument("--analysis-workers", type=int, default=ANALYSIS_WORKERS, help="Concurrent Gemini uploads/analyses")
+    analysis.add_argument("--proxy", action="store_true", help="Upload compact ffmpeg proxies instead of the original files")
+    correlation = argparse.ArgumentParser(add_help=False)
+    correlation.add_argument("--perf", help="Path to daily performance CSV (defaults to the last one used)")
+    correlation.add_argument("--sched", help="Path to schedule CSV (defaults to the last one used)")
+    correlation.add_argument("--delivery", help="CSV of day, video_id/link, spend or impressions to weight the daily mix")
+    correlation.add_argument("--incremental", action="store_true", help="Recompute only days touched by schedule/analysis changes")
+    insights = argparse.ArgumentParser(add_help=False)
+    insights.add_argument("--permutations", type=int, default=INSIGHT_PERMUTATIONS, help="Shuffles for Net Score p-values (0 disables)")
 
-    # 1. Load URLs
-    with open(args.urls, 'r') as f:
-        urls = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    commands.add_parser("acquire", parents=[brand, urls, download], help="Download videos and fetch metrics")
+    commands.add_parser("fingerprint", parents=[brand, urls], help="Link near-duplicate videos to a canonical creative")
+    analyze = commands.add_parser("analyze", parents=[brand, urls, analysis], help="Gemini analysis of downloaded videos")
+    analyze.add_argument("--batch", action="store_true", help="Submit all pending analyses as one offline batch job")
+    commands.add_parser("aggregate", parents=[brand], help="Build master_analysis.parquet (and its CSV export) from the analysis JSONs")
+    commands.add_parser("correlate", parents=[brand, correlation], help="Join the daily creative mix to the KPI")
+    commands.add_parser("visualize", parents=[brand], help="Render charts")
+    commands.add_parser("report", parents=[brand, insights], help="Insights and final_report.html")
+    full = commands.add_parser("all", parents=[brand, urls, download, analysis, correlation, insights],
+                               help="Every stage in order (the default when no command is given)")
+    full.add_argument("--manifest", help="CSV of brand,urls,perf,sched[,delivery] to run every brand in one process")
+    mode = full.add_mutually_exclusive_group()
+    mode.add_argument("--stream", action="store_true", help="Overlap download, upload and analysis per video")
+    mode.add_argument("--batch", action="store_true", help="Submit all pending analyses as one offline batch job")
+    serve = commands.add_parser("serve", parents=[brand], help="Local HTTP/JSON query service over the brand's outputs")
+    serve.add_argument("--host", default=SERVICE_HOST, help="Address to bind (keep it local: there is no authentication)")
+    serve.add_argument("--port", type=int, default=SERVICE_PORT, help="Port to listen on")
+    return parser
 
-    print(f"--- Starting Pipeline for {args.brand} ({len(urls)} videos) ---")
+def api_key_from_env():
+    from dotenv import load_dotenv
+    load_dotenv()
+    return os.getenv("GEMINI_API_KEY")
 
-    # 2. Acquisition & Metrics
-    print("\n[1/5] Downloading videos and fetching metrics...")
-    metrics = fetch_metrics(urls, output_file=brand_dir / "metrics.json")
-    
-    video_paths = {}
-    for url in urls:
-        path, status = download_video(url, videos_dir, cookies_path=args.cookies)
-        if path:
-            video_paths[url] = path
-            print(f"  - {url}: {status}")
-        else:
-            print(f"  - {url}: FAILED ({status})")
+def run_manifest(args, api_key):
+    from src.runner import load_manifest, run_brands
+    results = run_brands(load_manifest(args.manifest), api_key=api_key, cookies_path=args.cookies,
+                         download_workers=args.download_workers, analysis_workers=args.analysis_workers,
+                         permutations=args.permutations, incremental=args.incremental, proxy=args.proxy,
+                         batch=args.batch, force=args.force)
+    print(f"\n--- Pipeline Complete! ---")
+    for brand, report in results.items():
+        print(f"  {brand}: {report or 'FAILED'}")
 
-    # 3. Multimodal Analysis
-    print("\n[2/5] Running Gemini Multimodal Analysis...")
-    for url, path in video_paths.items():
-        video_id = Path(path).stem
-        output_json = analysis_dir / f"{video_id}.json"
-        analyze_video_file(path, url, api_key, output_json)
+def run_all(args, brand_dir, api_key):
+    from src.runner import finish_brand
+    print(f"--- Starting Pipeline for {args.brand} ---")
+    if args.stream:
+        print("\n[1-2/5] Streaming download -> upload -> analysis...")
+        stages.stream(brand_dir, args.urls, api_key, cookies_path=args.cookies, download_workers=args.download_workers,
+                      analysis_workers=args.analysis_workers, proxy=args.proxy, force=args.force)
+    else:
+        print("\n[1/5] Downloading videos and fetching metrics...")
+        stages.acquire(brand_dir, args.urls, cookies_path=args.cookies, workers=args.download_workers, force=args.force)
+        stages.fingerprint(brand_dir, args.urls, force=args.force)
+        print("\n[2/5] Running Gemini Multimodal Analysis...")
+        stages.analyze(brand_dir, args.urls, api_key, workers=args.analysis_workers, proxy=args.proxy,
+                       batch=args.batch, force=args.force)
+    report = finish_brand(brand_dir, api_key, perf=args.perf, sched=args.sched, delivery=args.delivery,
+                          permutations=args.permutations, incremental=args.incremental, force=args.force)
+    print(f"\n--- Pipeline Complete! ---")
+    print(f"Final Report: {report}")
 
-    # 4. Data Processing
-    print("\n[3/5] Aggregating results and calculating correlations...")
-    master_csv = brand_dir / "master_analysis.csv"
-    aggregate_json_to_csv(analysis_dir, master_csv)
-    
-    correlation_data = None
-    if args.perf and args.sched:
-        mix_perf_csv = brand_dir / "creative_mix_performance.csv"
-        correlation_data = correlate_performance(args.perf, args.sched, master_csv, mix_perf_csv)
+def run_stage(args, brand_dir, api_key):
+    print(f"--- {args.command}: {args.brand} ---")
+    if args.command == "acquire":
+        result = stages.acquire(brand_dir, args.urls, cookies_path=args.cookies, workers=args.download_workers,
+                                force=args.force)
+    elif args.command == "fingerprint":
+        result = stages.fingerprint(brand_dir, args.urls, force=args.force)
+    elif args.command == "analyze":
+        result = stages.analyze(brand_dir, args.urls, api_key, workers=args.analysis_workers, proxy=args.proxy,
+                                batch=args.batch, force=args.force)
+    elif args.command == "correlate":
+        result = stages.correlate(brand_dir, perf=args.perf, sched=args.sched, delivery=args.delivery,
+                                  incremental=args.incremental, force=args.force)
+    elif args.command == "report":
+        result = stages.report(brand_dir, api_key=api_key, permutations=args.permutations, force=args.force)
+    else:
+        result = getattr(stages, args.command)(brand_dir, force=args.force)
+    print(f"Output: {result}")
 
-    # 5. Visualization
-    print("\n[4/5] Generating visualizations...")
-    if correlation_data is not None:
-        generate_visualizations(brand_dir / "creative_mix_performance.csv", viz_dir)
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] not in COMMANDS and argv[0] not in ("-h", "--help"):
+        argv = ["all"] + argv  # pre-subcommand invocations (`orchestrator.py --brand ... --urls ...`)
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    manifest = getattr(args, "manifest", None)
+    if manifest and (args.brand or args.urls or args.stream):
+        parser.error("--manifest cannot be combined with --brand, --urls or --stream")
+    if not manifest and not args.brand:
+        parser.error("--brand is required unless --manifest is given")
 
-    # 6. Reporting
-    print("\n[5/5] Synthesizing final report...")
-    portfolio_summary = get_portfolio_summary(master_csv)
-    insights = get_top_bottom_insights(brand_dir / "creative_mix_performance.csv", master_csv) if correlation_data is not None else {}
-    
-    generate_html_report(
-        insights_data=insights,
-        portfolio_summary=portfolio_summary,
-        correlation_data=correlation_data.to_dict() if correlation_data is not None else {},
-        video_metrics=metrics,
-        analysis_dir=analysis_dir,
-        viz_dir=viz_dir,
-        output_file=brand_dir / "final_report.html",
-        api_key=api_key
-    )
+    # Only stages that may call Gemini read the key (and load python-dotenv)
+    api_key = api_key_from_env() if args.command in ("analyze", "report", "all") else None
+    if args.command == "all" and not api_key:
+        print("Error: GEMINI_API_KEY not found in environment.")
+        return 1
+    if manifest:
+        run_manifest(args, api_key)
+        return 0
 
-    print(f"\n--- Pipeline Complete! ---")
-    print(f"Final Report: {brand_dir / 'final_report.html'}")
+    brand_dir = OUTPUT_DIR / args.brand
+    try:
+        if args.command == "serve":
+            from src.service import serve
+            serve(brand_dir, args.host, args.port)
+            return 0
+        if args.command == "all":
+            run_all(args, brand_dir, api_key)
+        else:
+            run_stage(args, brand_dir, api_key)
+    except stages.StageError as e:
+        print(f"Error: {e}")
+        return 1
+    print(f"Run Profile: {run_profile.write(brand_dir, labels={'brand': args.brand, 'command': args.command})}")
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
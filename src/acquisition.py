@@ -1,32 +1,35 @@
 import os
-import re
+import threading
+import time
 import yt_dlp
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-
-def get_video_id(url):
-    patterns = [
-        r'(?:v=|\/)([0-9A-Za-z_-]{11}).*',
-        r'(?:be\/)([0-9A-Za-z_-]{11}).*'
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1)
-    return None
+from .config import (DOWNLOAD_WORKERS, DOWNLOAD_HOST_RATE, DOWNLOAD_RETRIES, METRICS_WORKERS, METRICS_TTL_HOURS,
+                     METRICS_RETRIES, METRICS_CACHE_PATH)
+from .profiling import run_profile
+from .throttling import HostRateLimiter, backoff_delay
+from .video_store import VideoStore, get_video_id
 
 def download_video(video_url, output_dir, cookies_path=None):
     video_id = get_video_id(video_url)
     if not video_id:
         return None, "Invalid URL"
 
-    os.makedirs(output_dir, exist_ok=True)
+    store = VideoStore.open(output_dir)
     output_template = os.path.join(output_dir, f"{video_id}.%(ext)s")
     
-    # Check if exists
-    for f in os.listdir(output_dir):
-        if f.startswith(video_id):
-            return os.path.join(output_dir, f), "Cached"
+    # Check if exists (complete, indexed download whose checksum still matches)
+    path = store.get(video_id)
+    if path and store.verify(video_id):
+        return path, "Cached"
+    if path:
+        print(f"  {video_id}: checksum mismatch, downloading again")
+        os.remove(path)  # a corrupt file of the right size would otherwise be taken as complete by yt-dlp
+
+    # Stale fragments are dropped; recent ones are resumed by yt-dlp
+    store.clean_partials(video_id)
+    resuming = bool(store.partials(video_id))
 
     ydl_opts = {
         'format': 'bestvideo[height<=480][ext=mp4]+bestaudio[ext=m4a]/best[height<=480][ext=mp4]/best',
@@ -35,6 +38,7 @@ def download_video(video_url, output_dir, cookies_path=None):
         'no_warnings': True,
         'concurrent_fragment_downloads': 5,
         'retries': 5,
+        'continuedl': True,
         'nocheckcertificate': True,
     }
     
@@ -43,44 +47,158 @@ def download_video(video_url, output_dir, cookies_path=None):
 
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([video_url])
+            info = ydl.extract_info(video_url, download=True) or {}
             
         # Find the downloaded file
-        for f in os.listdir(output_dir):
-            if f.startswith(video_id):
-                return os.path.join(output_dir, f), "Downloaded"
-        return None, "Download Failed"
+        downloads = info.get('requested_downloads') or [{}]
+        path = downloads[0].get('filepath') or store.find_media(video_id)
+        if not path or not os.path.exists(path):
+            return None, "Download Failed"
+        path = store.add(video_id, path, duration=info.get('duration'))
+        return path, "Resumed" if resuming else "Downloaded"
     except Exception as e:
         return None, str(e)
 
-def fetch_metrics(video_urls, output_file=None):
-    metrics = {}
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
-        'ignoreerrors': True,
-        'skip_download': True,
-    }
-    
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        for url in video_urls:
-            vid = get_video_id(url)
-            if not vid: continue
+def _is_cached(video_url, output_dir):
+    video_id = get_video_id(video_url)
+    return bool(video_id) and VideoStore.open(output_dir).get(video_id) is not None
+
+def download_with_retry(video_url, output_dir, limiter, cookies_path=None, retries=DOWNLOAD_RETRIES,
+                        downloader=download_video):
+    start = time.perf_counter()
+    for attempt in range(retries + 1):
+        if not _is_cached(video_url, output_dir):
+            limiter.acquire(video_url)
+        path, status = downloader(video_url, output_dir, cookies_path=cookies_path)
+        if path or status == "Invalid URL" or attempt == retries:
+            break
+        run_profile.retry("download")
+        time.sleep(backoff_delay(attempt))
+    if path and status != "Cached":
+        run_profile.video(get_video_id(video_url), "download", time.perf_counter() - start)
+        run_profile.add_bytes("downloaded", os.path.getsize(path))
+    return path, status
+
+def download_videos(video_urls, output_dir, cookies_path=None, workers=DOWNLOAD_WORKERS,
+                    host_rate=DOWNLOAD_HOST_RATE, retries=DOWNLOAD_RETRIES, downloader=download_video, limiter=None):
+    """Downloads URLs over a bounded worker pool.
+
+    Returns ({url: path} for successful downloads, {url: status} for every URL),
+    both in input order. `downloader` has the signature of download_video; a
+    shared HostRateLimiter (`limiter`) replaces the one built from host_rate.
+    """
+    limiter = limiter or HostRateLimiter(host_rate)
+    VideoStore.open(output_dir).clean_partials()
+
+    def fetch(url):
+        return download_with_retry(url, output_dir, limiter, cookies_path=cookies_path, retries=retries,
+                                   downloader=downloader)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(fetch, url): url for url in video_urls}
+        for future in as_completed(futures):
+            url = futures[future]
             try:
-                info = ydl.extract_info(url, download=False)
-                if info:
-                    metrics[vid] = {
-                        "title": info.get('title', 'Unknown'),
-                        "url": url,
-                        "view_count": info.get('view_count', 0),
-                        "like_count": info.get('like_count', 0),
-                        "comment_count": info.get('comment_count', 0)
-                    }
+                results[url] = future.result()
             except Exception as e:
-                print(f"Failed metrics for {vid}: {e}")
-    
-    if output_file:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(metrics, f, indent=4)
-            
+                results[url] = (None, str(e))
+
+    video_paths = {url: results[url][0] for url in video_urls if results[url][0]}
+    statuses = {url: results[url][1] for url in video_urls}
+    return video_paths, statuses
+
+_thread_local = threading.local()
+
+def _default_extractor(url):
+    # YoutubeDL instances are not thread-safe, so each worker thread keeps its own
+    ydl = getattr(_thread_local, "ydl", None)
+    if ydl is None:
+        ydl = _thread_local.ydl = yt_dlp.YoutubeDL({
+            'quiet': True,
+            'no_warnings': True,
+            'skip_download': True,
+        })
+    return ydl.extract_info(url, download=False)
+
+def _load_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_json(path, data, indent=4):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=indent)
+    os.replace(tmp, path)
+
+def fetch_metrics(video_urls, output_file=None, workers=METRICS_WORKERS, ttl_hours=METRICS_TTL_HOURS,
+                  retries=METRICS_RETRIES, cache_path=METRICS_CACHE_PATH, extractor=None):
+    """Fetches title/view/like/comment counts concurrently through an on-disk TTL cache.
+
+    Counts older than `ttl_hours` are refreshed; titles never expire. Results are
+    merged into `output_file`, which is only rewritten when something changed.
+    `extractor(url) -> info dict` defaults to yt-dlp's extract_info.
+    """
+    extractor = extractor or _default_extractor
+    cache = _load_json(cache_path) if cache_path else {}
+    now = time.time()
+
+    targets = {}
+    for url in video_urls:
+        vid = get_video_id(url)
+        if vid: targets[vid] = url
+    stale = [vid for vid in targets if now - cache.get(vid, {}).get('fetched_at', 0) > ttl_hours * 3600]
+
+    def fetch(vid):
+        for attempt in range(retries + 1):
+            try:
+                start = time.perf_counter()
+                info = extractor(targets[vid])
+                run_profile.api_call("metadata", time.perf_counter() - start)
+                if info: return info
+                error = "no metadata returned"
+            except Exception as e:
+                run_profile.api_call("metadata", time.perf_counter() - start, failed=True)
+                error = e
+            if attempt < retries:
+                run_profile.retry("metadata")
+                time.sleep(backoff_delay(attempt))
+        raise RuntimeError(error)
+
+    if stale:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {pool.submit(fetch, vid): vid for vid in stale}
+            for future in as_completed(futures):
+                vid = futures[future]
+                try:
+                    info = future.result()
+                except Exception as e:
+                    print(f"Failed metrics for {vid}: {e}")
+                    continue
+                entry = cache.setdefault(vid, {})
+                entry['title'] = entry.get('title') or info.get('title', 'Unknown')
+                entry.update(view_count=info.get('view_count', 0), like_count=info.get('like_count', 0),
+                             comment_count=info.get('comment_count', 0), fetched_at=now)
+        if cache_path: _write_json(cache_path, cache)
+
+    previous = _load_json(output_file) if output_file else {}
+    metrics = dict(previous)
+    for vid, url in targets.items():
+        if vid not in cache: continue
+        entry = cache[vid]
+        metrics[vid] = {
+            "title": entry.get('title', 'Unknown'),
+            "url": url,
+            "view_count": entry.get('view_count', 0),
+            "like_count": entry.get('like_count', 0),
+            "comment_count": entry.get('comment_count', 0)
+        }
+
+    if output_file and metrics != previous:
+        _write_json(output_file, metrics)
+    print(f"  Metrics: {len(stale)} refreshed, {len(targets) - len(stale)} from cache")
     return metrics
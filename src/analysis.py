@@ -1,46 +1,227 @@
 import os
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import google.generativeai as genai
-from .config import ANALYSIS_SYSTEM_PROMPT, GEMINI_MODEL_NAME
+from .config import (ANALYSIS_SYSTEM_PROMPT, GEMINI_MODEL_NAME, GENERATION_CONFIG, ANALYSIS_WORKERS,
+                     GEMINI_RPM, GEMINI_TPM, GEMINI_RETRIES, JSON_RETRIES, TOKENS_PER_VIDEO_MB,
+                     POLL_MIN_INTERVAL, POLL_MAX_INTERVAL)
+from .cache import analysis_key
+from .profiling import run_profile, video_id_from_path
+from .throttling import RateLimiter, call_with_backoff
 
-def analyze_video_file(video_path, video_url, api_key, output_path):
-    if os.path.exists(output_path):
-        return json.load(open(output_path, 'r', encoding='utf-8'))
-
-    genai.configure(api_key=api_key)
-    
-    uploaded_file = None
-    try:
-        print(f"Uploading {video_path}...")
-        uploaded_file = genai.upload_file(path=video_path)
-        
-        while uploaded_file.state.name == "PROCESSING":
-            time.sleep(2)
-            uploaded_file = genai.get_file(uploaded_file.name)
-            
-        if uploaded_file.state.name == "FAILED":
-            raise ValueError("Gemini processing failed")
-
-        print(f"Analyzing...")
-        model = genai.GenerativeModel(GEMINI_MODEL_NAME)
-        response = model.generate_content(
-            [uploaded_file, ANALYSIS_SYSTEM_PROMPT],
-            generation_config={"response_mime_type": "application/json", "temperature": 0.2}
-        )
-        
-        data = json.loads(response.text)
-        data["metadata"]["url"] = video_url
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
-            
-        return data
-
-    except Exception as e:
-        print(f"Analysis error: {e}")
+class GeminiBackend:
+    """google.generativeai configured once and shared by every worker thread."""
+
+    def __init__(self, api_key, model_name=GEMINI_MODEL_NAME):
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    def upload_file(self, path):
+        return genai.upload_file(path=path)
+
+    def get_file(self, name):
+        return genai.get_file(name)
+
+    def delete_file(self, name):
+        genai.delete_file(name)
+
+    def generate_content(self, contents, generation_config=None):
+        return self.model.generate_content(contents, generation_config=generation_config)
+
+def _estimate_tokens(video_path):
+    try: size_mb = os.path.getsize(video_path) / (1024 * 1024)
+    except OSError: size_mb = 0
+    return int(size_mb * TOKENS_PER_VIDEO_MB) + len(ANALYSIS_SYSTEM_PROMPT) // 4
+
+def _usage_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", 0) or 0
+
+def _write_analysis(data, video_url, output_path, key):
+    data.setdefault("metadata", {}).update(url=video_url, analysis_key=key)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+    return data
+
+def load_existing_analysis(video_path, video_url, output_path, cache=None):
+    """Returns an up-to-date analysis without any API call, or None if one is needed.
+
+    The output JSON is reused only if it was produced from the same video bytes,
+    prompt, model and generation config; otherwise the shared cache is consulted.
+    """
+    if not os.path.exists(video_path):
+        if os.path.exists(output_path):
+            return json.load(open(output_path, 'r', encoding='utf-8'))
         return None
-    finally:
-        if uploaded_file:
-            try: genai.delete_file(uploaded_file.name)
-            except: pass
+    key = analysis_key(video_path)
+    if os.path.exists(output_path):
+        try:
+            data = json.load(open(output_path, 'r', encoding='utf-8'))
+            if data.get("metadata", {}).get("analysis_key") == key: return data
+        except ValueError:
+            pass
+    if cache is not None:
+        data = cache.get(key, video_path)
+        if data is not None:
+            return _write_analysis(data, video_url, output_path, key)
+    return None
+
+def make_limiters(rpm=GEMINI_RPM, tpm=GEMINI_TPM):
+    return RateLimiter(rpm, per=60.0), RateLimiter(tpm, per=60.0)
+
+def upload_video(backend, video_path, retries=GEMINI_RETRIES, registry=None):
+    if registry is not None:
+        return registry.acquire(video_path, retries=retries)
+    print(f"Uploading {video_path}...")
+    start = time.perf_counter()
+    uploaded_file = call_with_backoff(lambda: backend.upload_file(video_path), retries=retries, name="upload")
+    run_profile.video(video_id_from_path(video_path), "upload", time.perf_counter() - start)
+    run_profile.add_bytes("uploaded", os.path.getsize(video_path))
+    return uploaded_file
+
+def wait_until_active(backend, uploaded_file, video_path=None):
+    delay = POLL_MIN_INTERVAL
+    start = time.perf_counter()
+    while uploaded_file.state.name == "PROCESSING":
+        time.sleep(delay)
+        delay = min(POLL_MAX_INTERVAL, delay * 1.5)
+        uploaded_file = call_with_backoff(lambda: backend.get_file(uploaded_file.name), retries=0, name="get_file")
+    if video_path: run_profile.video(video_id_from_path(video_path), "processing", time.perf_counter() - start)
+    if uploaded_file.state.name == "FAILED":
+        raise ValueError("Gemini processing failed")
+    return uploaded_file
+
+def generate_analysis(backend, uploaded_file, video_path, video_url, output_path, limiters, retries=GEMINI_RETRIES,
+                      cache=None):
+    rpm_limiter, tpm_limiter = limiters
+    estimate = _estimate_tokens(video_path)
+
+    def call():
+        rpm_limiter.acquire()
+        tpm_limiter.acquire(estimate)
+        return backend.generate_content([uploaded_file, ANALYSIS_SYSTEM_PROMPT], generation_config=GENERATION_CONFIG)
+
+    # Invalid JSON is re-asked on the same uploaded file instead of re-uploading
+    start = time.perf_counter()
+    for attempt in range(JSON_RETRIES + 1):
+        response = call_with_backoff(call, retries=retries, base=2.0, name="generate")
+        run_profile.add_usage("generate", response)
+        tpm_limiter.consume(max(0, _usage_tokens(response) - estimate))
+        try:
+            data = json.loads(response.text)
+            break
+        except ValueError:
+            if attempt == JSON_RETRIES: raise
+            run_profile.retry("invalid_json")
+            print(f"Invalid JSON for {video_path}, retrying ({attempt + 1}/{JSON_RETRIES})...")
+    run_profile.video(video_id_from_path(video_path), "generate", time.perf_counter() - start)
+    return save_analysis(data, video_path, video_url, output_path, cache=cache)
+
+def save_analysis(data, video_path, video_url, output_path, cache=None):
+    key = analysis_key(video_path)
+    data = _write_analysis(data, video_url, output_path, key)
+    if cache is not None: cache.put(key, data)
+    return data
+
+def release_file(backend, uploaded_file, registry=None, failed=False):
+    # Registered handles stay alive for reuse unless Gemini could not process them
+    if registry is not None:
+        registry.release(uploaded_file.name)
+        if failed: registry.forget(uploaded_file.name)
+        return
+    try: backend.delete_file(uploaded_file.name)
+    except Exception: pass
+
+def analyze_videos(jobs, api_key=None, backend=None, workers=ANALYSIS_WORKERS, rpm=GEMINI_RPM, tpm=GEMINI_TPM,
+                   retries=GEMINI_RETRIES, cache=None, registry=None, limiters=None):
+    """Analyzes (video_path, video_url, output_path) jobs with uploads and generations in flight concurrently.
+
+    `limiters` (from make_limiters) lets several callers share one RPM/TPM budget.
+    Returns {str(output_path): data}; failed videos map to None.
+    """
+    results = {}
+    todo = []
+    for video_path, video_url, output_path in jobs:
+        data = load_existing_analysis(video_path, video_url, output_path, cache=cache)
+        if data is not None:
+            results[str(output_path)] = data
+        else:
+            todo.append((video_path, video_url, output_path))
+    if not todo: return results
+
+    backend = backend or GeminiBackend(api_key)
+    limiters = limiters or make_limiters(rpm, tpm)
+
+    def upload(job):
+        return upload_video(backend, job[0], retries=retries, registry=registry)
+
+    def generate(job, uploaded_file):
+        return generate_analysis(backend, uploaded_file, job[0], job[1], job[2], limiters, retries=retries,
+                                 cache=cache)
+
+    uploads, generations = {}, {}
+    polling_since = {}
+    pending = {}  # output path -> [job, file, next poll time, poll delay]; registry handles may be shared
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as upload_pool, \
+         ThreadPoolExecutor(max_workers=max(1, workers)) as generate_pool:
+        for job in todo:
+            uploads[upload_pool.submit(upload, job)] = job
+
+        while uploads or pending or generations:
+            for future in [f for f in uploads if f.done()]:
+                job = uploads.pop(future)
+                try:
+                    uploaded_file = future.result()
+                    pending[str(job[2])] = [job, uploaded_file, time.monotonic(), POLL_MIN_INTERVAL]
+                    polling_since[str(job[2])] = time.perf_counter()
+                except Exception as e:
+                    print(f"Upload error ({job[0]}): {e}")
+                    results[str(job[2])] = None
+
+            # One sweep over every pending file that is due; each backs off independently
+            now = time.monotonic()
+            for key, entry in list(pending.items()):
+                job, uploaded_file, due, delay = entry
+                if uploaded_file.state.name == "PROCESSING":
+                    if due > now: continue
+                    try: uploaded_file = call_with_backoff(lambda: backend.get_file(uploaded_file.name), retries=0,
+                                                           name="get_file")
+                    except Exception as e: print(f"Polling error ({uploaded_file.name}): {e}")
+                if uploaded_file.state.name == "PROCESSING":
+                    entry[1:] = [uploaded_file, now + delay, min(POLL_MAX_INTERVAL, delay * 1.5)]
+                    continue
+                del pending[key]
+                run_profile.video(video_id_from_path(job[0]), "processing", time.perf_counter() - polling_since.pop(key))
+                if uploaded_file.state.name == "FAILED":
+                    print(f"Analysis error ({job[0]}): Gemini processing failed")
+                    results[str(job[2])] = None
+                    release_file(backend, uploaded_file, registry, failed=True)
+                else:
+                    print(f"Analyzing {job[0]}...")
+                    generations[generate_pool.submit(generate, job, uploaded_file)] = (job, uploaded_file)
+
+            for future in [f for f in generations if f.done()]:
+                job, uploaded_file = generations.pop(future)
+                try:
+                    results[str(job[2])] = future.result()
+                except Exception as e:
+                    print(f"Analysis error ({job[0]}): {e}")
+                    results[str(job[2])] = None
+                finally:
+                    release_file(backend, uploaded_file, registry)
+
+            timeout = None
+            if pending:
+                timeout = max(0.0, min(e[2] for e in pending.values()) - time.monotonic())
+            in_flight = list(uploads) + list(generations)
+            if in_flight:
+                wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            elif timeout:
+                time.sleep(timeout)
+
+    return results
+
+def analyze_video_file(video_path, video_url, api_key, output_path, backend=None, cache=None, registry=None):
+    return analyze_videos([(video_path, video_url, output_path)], api_key=api_key, backend=backend,
+                          workers=1, cache=cache, registry=registry).get(str(output_path))
@@ -0,0 +1,168 @@
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from .analysis import load_existing_analysis, upload_video, wait_until_active, release_file, save_analysis
+from .config import (ANALYSIS_SYSTEM_PROMPT, GEMINI_MODEL_NAME, GENERATION_CONFIG, GEMINI_API_BASE, ANALYSIS_WORKERS,
+                     GEMINI_RETRIES, BATCH_POLL_MIN_INTERVAL, BATCH_POLL_MAX_INTERVAL, BATCH_MAX_RESUBMITS)
+from .throttling import call_with_backoff
+
+TERMINAL_STATES = ("SUCCEEDED", "FAILED", "CANCELLED", "EXPIRED")
+
+def _generation_config():
+    camel = {"response_mime_type": "responseMimeType"}
+    return {camel.get(k, k): v for k, v in GENERATION_CONFIG.items()}
+
+class GeminiBatchBackend:
+    """Gemini Batch API (batchGenerateContent) with inline requests over REST."""
+
+    def __init__(self, api_key, model_name=GEMINI_MODEL_NAME, base_url=GEMINI_API_BASE):
+        self.model_name = model_name
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        self.session.headers.update({"x-goog-api-key": api_key, "Content-Type": "application/json"})
+
+    def submit(self, requests_by_key):
+        """requests_by_key: {key: (file_uri, mime_type)}. Returns the batch name."""
+        inlined = [{
+            "request": {
+                "contents": [{"role": "user", "parts": [
+                    {"file_data": {"file_uri": uri, "mime_type": mime}},
+                    {"text": ANALYSIS_SYSTEM_PROMPT}
+                ]}],
+                "generationConfig": _generation_config()
+            },
+            "metadata": {"key": key}
+        } for key, (uri, mime) in requests_by_key.items()]
+        body = {"batch": {"display_name": f"creative-analysis-{uuid.uuid4().hex[:8]}",
+                          "input_config": {"requests": {"requests": inlined}}}}
+        response = self.session.post(f"{self.base_url}/models/{self.model_name}:batchGenerateContent", json=body)
+        response.raise_for_status()
+        return response.json()["name"]
+
+    def get(self, name):
+        """Returns (state, {key: (text or None, error or None)}); results are empty until terminal."""
+        response = self.session.get(f"{self.base_url}/{name}")
+        response.raise_for_status()
+        job = response.json()
+        meta = job.get("metadata", {})
+        state = meta.get("state") or job.get("state", "")
+        output = job.get("response") or meta.get("output") or {}
+        results = {}
+        for item in output.get("inlinedResponses", {}).get("inlinedResponses", []):
+            key = item.get("metadata", {}).get("key")
+            if "error" in item:
+                results[key] = (None, item["error"].get("message", str(item["error"])))
+                continue
+            try:
+                parts = item["response"]["candidates"][0]["content"]["parts"]
+                results[key] = ("".join(p.get("text", "") for p in parts), None)
+            except (KeyError, IndexError) as e:
+                results[key] = (None, f"Malformed response: {e}")
+        return state, results
+
+class LocalBatchBackend:
+    """Local stand-in for the batch endpoint: runs each request through a content backend on get().
+
+    `backend` is anything with generate_content (e.g. a fake GeminiBackend);
+    `fail_keys` lets a test fail specific requests on their first attempt.
+    """
+
+    def __init__(self, backend, fail_keys=()):
+        self.backend = backend
+        self.fail_keys = set(fail_keys)
+        self.jobs = {}
+        self.submitted = []
+
+    def submit(self, requests_by_key):
+        name = f"batches/local-{len(self.jobs)}"
+        self.jobs[name] = dict(requests_by_key)
+        self.submitted.append(name)
+        return name
+
+    def get(self, name):
+        results = {}
+        for key, (uri, _) in self.jobs[name].items():
+            if key in self.fail_keys:
+                self.fail_keys.discard(key)
+                results[key] = (None, "simulated failure")
+                continue
+            try:
+                response = self.backend.generate_content([uri, ANALYSIS_SYSTEM_PROMPT], generation_config=GENERATION_CONFIG)
+                results[key] = (response.text, None)
+            except Exception as e:
+                results[key] = (None, str(e))
+        return "BATCH_STATE_SUCCEEDED", results
+
+def _wait_for_batch(batch_backend, name):
+    delay = BATCH_POLL_MIN_INTERVAL
+    while True:
+        state, results = call_with_backoff(lambda: batch_backend.get(name), retries=GEMINI_RETRIES, name="batch_poll")
+        if any(s in state for s in TERMINAL_STATES):
+            return state, results
+        time.sleep(delay)
+        delay = min(BATCH_POLL_MAX_INTERVAL, delay * 1.5)
+
+def run_batch_analysis(jobs, backend, batch_backend, cache=None, registry=None, workers=ANALYSIS_WORKERS,
+                       max_resubmits=BATCH_MAX_RESUBMITS):
+    """Analyzes (video_path, video_url, output_path) jobs as one offline batch job.
+
+    Pending videos are uploaded, submitted together, polled as a whole and fanned
+    out into their output JSON; failed or unparseable entries are resubmitted up to
+    `max_resubmits` times. Returns {str(output_path): data or None}.
+    """
+    results, todo = {}, []
+    for video_path, video_url, output_path in jobs:
+        data = load_existing_analysis(video_path, video_url, output_path, cache=cache)
+        if data is not None:
+            results[str(output_path)] = data
+        else:
+            todo.append((video_path, video_url, output_path))
+    if not todo: return results
+
+    def upload(job):
+        uploaded_file = upload_video(backend, job[0], registry=registry)
+        try:
+            return wait_until_active(backend, uploaded_file, video_path=job[0])
+        except Exception:
+            release_file(backend, uploaded_file, registry, failed=True)
+            raise
+
+    files = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for job, future in [(job, pool.submit(upload, job)) for job in todo]:
+            try:
+                files[str(job[2])] = (job, future.result())
+            except Exception as e:
+                print(f"Upload error ({job[0]}): {e}")
+                results[str(job[2])] = None
+
+    pending = dict(files)
+    for attempt in range(max_resubmits + 1):
+        if not pending: break
+        requests_by_key = {key: (getattr(f, "uri", f.name), getattr(f, "mime_type", "video/mp4"))
+                           for key, (_, f) in pending.items()}
+        name = call_with_backoff(lambda: batch_backend.submit(requests_by_key), retries=0, name="batch_submit")
+        print(f"Submitted batch {name} with {len(pending)} videos (attempt {attempt + 1})...")
+        state, outputs = _wait_for_batch(batch_backend, name)
+        print(f"Batch {name} finished: {state}")
+
+        failed = {}
+        for key, (job, uploaded_file) in pending.items():
+            text, error = outputs.get(key, (None, "missing from batch output"))
+            try:
+                if error: raise ValueError(error)
+                data = json.loads(text)
+                if not isinstance(data, dict): raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+                results[key] = save_analysis(data, job[0], job[1], job[2], cache=cache)
+            except (ValueError, TypeError, AttributeError) as e:
+                print(f"  Batch entry failed ({job[0]}): {e}")
+                failed[key] = (job, uploaded_file)
+        pending = failed
+
+    for key, (job, uploaded_file) in files.items():
+        results.setdefault(key, None)
+        release_file(backend, uploaded_file, registry)
+    print(f"Batch analysis: {sum(1 for k in files if results[k] is not None)}/{len(files)} succeeded")
+    return results
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from .config import (ANALYSIS_SYSTEM_PROMPT, GEMINI_MODEL_NAME, GENERATION_CONFIG, ANALYSIS_CACHE_DIR,
+                     ANALYSIS_CACHE_MAX_MB, ANALYSIS_CACHE_MAX_AGE_DAYS)
+
+_hash_memo = {}
+_hash_lock = threading.Lock()
+
+def file_sha256(path, chunk_size=1 << 20):
+    # Memoized on (path, size, mtime) so a file is read at most once per process
+    st = os.stat(path)
+    memo_key = (str(path), st.st_size, st.st_mtime_ns)
+    with _hash_lock:
+        if memo_key in _hash_memo: return _hash_memo[memo_key]
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _hash_lock:
+        _hash_memo[memo_key] = digest
+    return digest
+
+def analysis_key(video_path, prompt=ANALYSIS_SYSTEM_PROMPT, model_name=GEMINI_MODEL_NAME,
+                 generation_config=GENERATION_CONFIG):
+    h = hashlib.sha256()
+    h.update(file_sha256(video_path).encode())
+    h.update(prompt.encode('utf-8'))
+    h.update(model_name.encode('utf-8'))
+    h.update(json.dumps(generation_config, sort_keys=True).encode())
+    return h.hexdigest()
+
+class AnalysisCache:
+    """Persistent analysis store keyed by video content + prompt + model + generation config."""
+
+    def __init__(self, cache_dir=ANALYSIS_CACHE_DIR, max_mb=ANALYSIS_CACHE_MAX_MB, max_age_days=ANALYSIS_CACHE_MAX_AGE_DAYS):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_mb * 1024 * 1024
+        self.max_age = max_age_days * 86400
+        self.hits = self.misses = self.bytes_saved = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key, video_path=None):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            os.utime(path)  # refresh LRU position
+        except (OSError, ValueError):
+            with self._lock: self.misses += 1
+            return None
+        saved = os.path.getsize(video_path) if video_path and os.path.exists(video_path) else 0
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += saved
+        return data
+
+    def put(self, key, data):
+        tmp = self._path(key).with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self._path(key))
+
+    def evict(self):
+        # Drop entries past max age, then least-recently-used until under the size cap
+        now = time.time()
+        entries = []
+        for path in self.cache_dir.glob("*.json"):
+            try: st = path.stat()
+            except OSError: continue
+            if self.max_age and now - st.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+            else:
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(e[1] for e in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if not self.max_bytes or total <= self.max_bytes: break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def stats(self):
+        files = list(self.cache_dir.glob("*.json"))
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / (self.hits + self.misses) if (self.hits + self.misses) else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "entries": len(files),
+            "size_bytes": sum(f.stat().st_size for f in files)
+        }
+
+    def report(self):
+        s = self.stats()
+        print(f"  Analysis cache: {s['hits']} hits, {s['misses']} misses, "
+              f"{s['bytes_saved'] / (1024 * 1024):.1f} MB of uploads saved ({s['entries']} entries)")
+        return s
@@ -65,3 +65,122 @@ A saída deve ser um JSON válido com a seguinte estrutura:
   "abcd_score": { "attention": 0-10, "branding": 0-10, "connection": 0-10, "direction": 0-10 } 
 }
 """
+
+# Acquisition
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_HOST_RATE = 2.0  # max download starts per second per host
+DOWNLOAD_RETRIES = 3
+
+# Analysis
+GENERATION_CONFIG = {"response_mime_type": "application/json", "temperature": 0.2}
+ANALYSIS_WORKERS = 8
+GEMINI_RPM = 60  # generate_content requests per minute
+GEMINI_TPM = 1_000_000  # tokens per minute
+GEMINI_RETRIES = 5
+TOKENS_PER_VIDEO_MB = 2300  # rough pre-call estimate for 480p video, reconciled with usage_metadata
+POLL_MIN_INTERVAL = 1.0
+POLL_MAX_INTERVAL = 15.0
+
+# Streaming pipeline
+STREAM_QUEUE_SIZE = 8  # max items buffered between stages (bounds videos on disk awaiting upload)
+
+# Caches (shared across brands)
+CACHE_DIR = BASE_DIR / "cache"
+ANALYSIS_CACHE_DIR = CACHE_DIR / "analysis"
+ANALYSIS_CACHE_MAX_MB = 512
+ANALYSIS_CACHE_MAX_AGE_DAYS = 180
+
+# Insights
+INSIGHT_PERMUTATIONS = 2000  # shuffles for Net Score p-values (0 disables)
+
+# Delivery weights (optional --delivery CSV: day, video_id or link, spend/impressions)
+DELIVERY_WEIGHT_COLUMNS = ["spend", "impressions"]  # first one present weights each creative-day
+DELIVERY_DATE_FORMATS = ["%Y-%m-%d", "%d/%m/%Y"]
+DELIVERY_CHUNK_ROWS = 1_000_000  # rows read per chunk; memory follows distinct (day, video) pairs
+
+# Lagged attribute drivers (creative_drivers.csv)
+DRIVER_ATTRIBUTES = ["foco", "tom", "cenario", "ocasiao_consumo", "ritual_sensorial", "variante_produto",
+                     "gancho_promocional"]  # one-hot encoded; score_* columns are averaged
+DRIVER_MAX_LAG = 28  # days between a creative airing and the KPI response
+DRIVER_ADSTOCK_DECAYS = (0.3, 0.6, 0.8)  # daily carryover rates tried besides the raw mix
+DRIVER_MIN_VIDEOS = 3  # attribute values present on fewer videos are not tested
+DRIVER_MIN_DAYS = 30  # lags with fewer KPI days are skipped
+DRIVER_REPORT_ROWS = 15  # top drivers shown in the report and sent to the narrative prompt
+
+# Aggregation
+MASTER_COLUMNS = ["video_id", "url", "foco", "tom", "cenario", "ocasiao_consumo", "ritual_sensorial",
+                  "variante_produto", "gancho_promocional", "analise_visual", "atencao",
+                  "score_attention", "score_branding", "score_connection", "score_direction",
+                  "canonical_video_id", "duplicate_similarity"]
+AGGREGATE_WORKERS = os.cpu_count() or 1
+AGGREGATE_PARALLEL_MIN_FILES = 200  # below this, parsing in-process beats pool start-up
+AGGREGATE_BATCH_ROWS = 1000  # rows per master_analysis.parquet fragment written by aggregate_results
+
+# Metrics
+METRICS_WORKERS = 8
+METRICS_TTL_HOURS = 24  # view/like counts refresh interval; titles are cached permanently
+METRICS_RETRIES = 3
+METRICS_CACHE_PATH = CACHE_DIR / "metrics.json"
+
+# Video store
+VIDEO_INDEX_NAME = "index.json"
+VIDEO_PARTIAL_MAX_AGE_HOURS = 48  # partial downloads older than this are deleted instead of resumed
+
+# Near-duplicate detection (fingerprint stage)
+FINGERPRINT_INDEX_NAME = "fingerprints.json"  # per videos dir: frame/audio fingerprints by video id
+DUPLICATES_NAME = "duplicates.csv"  # per brand: near-duplicates and the canonical they inherit from
+FINGERPRINT_FPS = 2  # frames hashed per second
+FINGERPRINT_MAX_SECONDS = 300  # only the start of longer videos is fingerprinted
+FINGERPRINT_MIN_CONTRAST = 4.0  # frames with a flatter 9x8 thumbnail (black, fades) are ignored
+FINGERPRINT_AUDIO_RATE = 5512  # Hz; mono audio is resampled before fingerprinting
+FINGERPRINT_MIN_RMS = 50.0  # quieter tracks (16-bit scale) count as silent
+FINGERPRINT_FRAME_MAX_BITS = 10  # max Hamming distance (of 64 bits) for two frames to match
+FINGERPRINT_VIDEO_THRESHOLD = 0.8  # share of the shorter video's frames that must match
+FINGERPRINT_AUDIO_THRESHOLD = 0.7  # 1 - bit error rate at the best audio alignment
+FINGERPRINT_CANDIDATE_SHARE = 0.2  # share of 16-bit hash slices two videos must have in common to be compared
+FINGERPRINT_MAX_SLICE_VIDEOS = 100  # slices found in more videos (shared end cards, logos) are not used to pair them
+FINGERPRINT_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+# Analysis proxies (optional transcoding before upload)
+PROXY_MAX_HEIGHT = 360
+PROXY_FPS = 5  # Gemini samples video at ~1 fps, so extra frames only cost upload bytes
+PROXY_AUDIO_KBPS = 48
+PROXY_CRF = 30
+TRANSCODE_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+# Gemini file handles (reused across runs until they near expiry)
+FILE_REGISTRY_PATH = CACHE_DIR / "gemini_files.json"
+FILE_TTL_HOURS = 48  # Gemini deletes uploaded files after 48h
+FILE_EXPIRY_MARGIN_MINUTES = 60
+FILE_QUOTA_BYTES = 18 * 1024 ** 3  # headroom below the 20 GB per-project storage limit
+FILE_SWEEP_INTERVAL = 300  # seconds
+JSON_RETRIES = 2  # re-asks on the same uploaded file when the response is not valid JSON
+
+# Batch mode
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+BATCH_POLL_MIN_INTERVAL = 30.0
+BATCH_POLL_MAX_INTERVAL = 600.0
+BATCH_MAX_RESUBMITS = 2
+
+# Report prompt
+REPORT_TOKEN_BUDGET = 30_000  # estimated input tokens for the report prompt data (chars / 4)
+REPORT_TEXT_MAX_CHARS = 600  # long analysis fields are truncated to this before the budget is applied
+REPORT_TEXT_MIN_CHARS = 120  # truncation stops here; further savings drop the least extreme videos
+REPORT_CACHE_DIR = CACHE_DIR / "report_sections"  # narrative fragments keyed by a hash of their prompt
+REPORT_WORKERS = 4  # narrative sections generated concurrently
+TEMPLATE_DIR = Path(__file__).parent / "templates"
+
+# Charts
+CHART_FORMAT = "svg"  # "svg" (inlined in the report) or "webp"/"png" (base64); webp needs Pillow
+CHART_WORKERS = min(3, os.cpu_count() or 1)
+CHART_MAX_POINTS = 400  # longer daily series are plotted as weekly means
+CHART_MANIFEST_NAME = "charts.json"
+
+# Query service (orchestrator.py serve)
+SERVICE_HOST = "127.0.0.1"  # local only: the service has no authentication
+SERVICE_PORT = 8765
+SERVICE_RELOAD_INTERVAL = 2.0  # seconds between checks of the brand outputs for changes
+SERVICE_MAX_ROWS = 1000  # cap on rows returned by /videos, /mix and /drivers
+
+# Stages
+STAGE_STATE_NAME = "stages.json"  # per brand: input signature of each stage's last complete run
@@ -0,0 +1,79 @@
+import os
+from pathlib import Path
+import pandas as pd
+import pyarrow.dataset as ds
+
+CATEGORICAL_COLUMNS = ["foco", "tom", "cenario", "ocasiao_consumo"]
+TEXT_COLUMNS = ["analise_visual", "atencao"]
+
+def typed_analysis(df):
+    """master_analysis with string ids and categorical low-cardinality attributes."""
+    df = df.copy()
+    if "video_id" in df: df["video_id"] = df["video_id"].astype(str)
+    for c in CATEGORICAL_COLUMNS:
+        if c in df: df[c] = df[c].astype("category")
+    return df
+
+def _columns(parquet):
+    # A single Parquet file or a directory of fragments
+    return ds.dataset(parquet, format="parquet").schema.names
+
+def _is_stale(target, source):
+    return not target.exists() or target.stat().st_mtime_ns < Path(source).stat().st_mtime_ns
+
+class AnalysisDataset:
+    """Typed, columnar view of a brand's outputs, loaded once and passed between stages.
+
+    `analysis` holds the short attribute columns of master_analysis.parquet, the
+    fragmented master table written by processing.aggregate_results (categoricals for
+    foco/tom/cenario/ocasiao_consumo); long text columns stay in Parquet until
+    text() asks for them. `mix` holds the daily creative mix joined to the KPI.
+    CSV files remain as exports only.
+    """
+
+    def __init__(self, analysis, analysis_parquet=None, mix=None):
+        self.analysis = analysis
+        self.analysis_parquet = analysis_parquet
+        self.mix = mix
+        self._text = {}
+
+    @classmethod
+    def load(cls, master, mix_csv=None):
+        """`master` is master_analysis.parquet (or its CSV export, for brands aggregated before Parquet)."""
+        parquet = Path(master).with_suffix(".parquet")
+        if not parquet.exists():
+            typed_analysis(pd.read_csv(parquet.with_suffix(".csv"))).to_parquet(parquet, index=False)
+        light = [c for c in _columns(parquet) if c not in TEXT_COLUMNS]
+        dataset = cls(typed_analysis(pd.read_parquet(parquet, columns=light)), analysis_parquet=parquet)
+        if mix_csv and os.path.exists(mix_csv):
+            dataset.mix = load_mix(mix_csv)
+        return dataset
+
+    def text(self, column):
+        """Long free-text column, aligned with `analysis`, read from Parquet on first use."""
+        if column not in self._text:
+            if column not in _columns(self.analysis_parquet): return pd.Series("", index=self.analysis.index, name=column)
+            self._text[column] = pd.read_parquet(self.analysis_parquet, columns=[column])[column]
+        return self._text[column]
+
+    def set_mix(self, mix, mix_csv=None):
+        self.mix = mix
+        if mix is not None and mix_csv:
+            mix.to_parquet(Path(mix_csv).with_suffix(".parquet"), index=False)
+        return mix
+
+def load_mix(mix_csv):
+    mix_csv = Path(mix_csv)
+    parquet = mix_csv.with_suffix(".parquet")
+    if _is_stale(parquet, mix_csv):
+        mix = pd.read_csv(mix_csv, parse_dates=["day"])
+        mix.to_parquet(parquet, index=False)
+        return mix
+    return pd.read_parquet(parquet)
+
+def as_frame(source, **read_csv_kwargs):
+    """Accepts a DataFrame, an AnalysisDataset (its analysis table), a Parquet or a CSV path."""
+    if isinstance(source, pd.DataFrame): return source
+    if isinstance(source, AnalysisDataset): return source.analysis
+    if str(source).endswith(".parquet"): return pd.read_parquet(source)
+    return pd.read_csv(source, **read_csv_kwargs)
@@ -0,0 +1,157 @@
+"""Lagged correlation of every creative attribute in the daily mix with the KPI.
+
+Each analyzed attribute becomes a feature: categorical ones are one-hot encoded
+(`cenario=Casa`) and averaged into the share of active creatives (or of the day's
+delivery, when spend/impression weights are given) carrying them; `score_*`
+columns are averaged the same way. The day x feature mix
+(plus adstock-decayed copies) is correlated with the KPI 0..DRIVER_MAX_LAG days
+later; the best lag/decay per feature gives the ranked driver table.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from .config import (DRIVER_ATTRIBUTES, DRIVER_MAX_LAG, DRIVER_ADSTOCK_DECAYS, DRIVER_MIN_VIDEOS, DRIVER_MIN_DAYS)
+from .dataset import as_frame
+from .processing import expand_schedule, load_performance, schedule_weights
+
+KPI_COLUMN = "PerformanceMetric"
+SCORE_PREFIX = "score_"
+DRIVER_COLUMNS = ["feature", "attribute", "value", "kind", "lag_days", "adstock", "correlation",
+                  "same_day_correlation", "kpi_days", "videos", "mean_mix"]
+
+def attribute_features(df_analysis, attributes=DRIVER_ATTRIBUTES, min_videos=DRIVER_MIN_VIDEOS):
+    """Video x feature float32 frame: one-hot `attribute=value` columns and score_* values.
+
+    One-hot columns carried by fewer than `min_videos` videos are dropped; missing
+    scores take the column mean.
+    """
+    df = df_analysis.drop_duplicates('video_id', keep='last').set_index('video_id')
+    df.index = df.index.astype(str)
+    parts = []
+    cats = [c for c in attributes if c in df]
+    if cats:
+        values = df[cats].astype("string").apply(lambda s: s.str.strip()).replace("", pd.NA)
+        onehot = pd.get_dummies(values, prefix_sep="=", dtype=np.float32)
+        parts.append(onehot.loc[:, onehot.sum() >= min_videos])
+    scores = [c for c in df if c.startswith(SCORE_PREFIX)]
+    if scores:
+        numeric = df[scores].apply(pd.to_numeric, errors='coerce')
+        parts.append(numeric.fillna(numeric.mean()).fillna(0).astype(np.float32))
+    return pd.concat(parts, axis=1) if parts else pd.DataFrame(index=df.index, dtype=np.float32)
+
+def daily_feature_mix(weights, features, calendar):
+    """calendar x feature mix from (day x video matrix, days, video ids) delivery weights.
+
+    Shares divide by the day's total weight (every active creative, as the daily
+    mix does); scores average over the weight of analyzed creatives. Days without
+    delivery are 0.
+    """
+    matrix, days, videos = weights
+    coo = matrix.tocoo()
+    rows = calendar.get_indexer(days)[coo.row]
+    keep = rows >= 0
+    matrix = sparse.csr_matrix((coo.data[keep], (rows[keep], coo.col[keep])), shape=(len(calendar), matrix.shape[1]))
+    cols = features.index.get_indexer(pd.Index(videos).astype(str))
+    known = np.flatnonzero(cols >= 0)
+    analyzed_matrix = matrix[:, known]
+    sums = analyzed_matrix @ features.to_numpy(dtype=np.float64)[cols[known]]
+    totals = np.asarray(matrix.sum(axis=1)).ravel()
+    analyzed = np.asarray(analyzed_matrix.sum(axis=1)).ravel()
+    is_score = features.columns.str.startswith(SCORE_PREFIX)
+    denom = np.where(is_score[None, :], analyzed[:, None], totals[:, None])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(denom > 0, sums / denom, 0.0)
+
+def adstock(mix, decays):
+    """Geometric carryover a[t] = x[t] + decay * a[t-1] for every decay at once: (days, features, decays)."""
+    decays = np.asarray(decays, dtype=np.float64)
+    out = np.empty(mix.shape + decays.shape, dtype=np.float64)
+    carry = np.zeros(mix.shape[1:] + decays.shape, dtype=np.float64)
+    for t in range(len(mix)):
+        carry = mix[t][:, None] + decays * carry
+        out[t] = carry
+    return out
+
+def lagged_correlations(X, y, max_lag=DRIVER_MAX_LAG, min_days=DRIVER_MIN_DAYS):
+    """Pearson r between X[t] (days x columns) and y[t + lag] for lag = 0..max_lag.
+
+    NaNs in y are skipped. All lags come from three (lags x days) @ (days x columns)
+    products of running sums, so the cost barely grows with the number of lags.
+    Returns (r of shape (lags, columns), KPI days per lag); lags with fewer than
+    `min_days` days and constant columns are NaN.
+    """
+    n_days = len(y)
+    valid = ~np.isnan(y)
+    y = np.where(valid, y - np.nanmean(y), 0.0) if valid.any() else np.zeros(n_days)
+    X = X - X.mean(axis=0)
+    # Row `lag` of each window matrix holds y[t + lag] (0 past the end) aligned with X[t]
+    window = np.arange(max_lag + 1)[:, None] + np.arange(n_days)[None, :]
+    V = np.concatenate([valid, np.zeros(max_lag, bool)])[window].astype(np.float64)
+    Y = np.concatenate([y, np.zeros(max_lag)])[window] * V
+    n = V.sum(axis=1)
+    sx, sxx, sxy = V @ X, V @ (X * X), Y @ X
+    sy, syy = Y.sum(axis=1), (Y * Y).sum(axis=1)
+    cov = n[:, None] * sxy - sx * sy[:, None]
+    var_x = n[:, None] * sxx - sx * sx
+    var_y = n * syy - sy * sy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = cov / np.sqrt(var_x * var_y[:, None])
+    r[(var_x <= 1e-12 * np.maximum(1.0, n[:, None] * sxx)) | (n < min_days)[:, None]] = np.nan
+    return np.clip(r, -1, 1), n.astype(int)
+
+def driver_table(mix, features, kpi, decays=DRIVER_ADSTOCK_DECAYS, max_lag=DRIVER_MAX_LAG, min_days=DRIVER_MIN_DAYS):
+    """Ranked drivers: per feature, the lag and adstock decay with the strongest KPI correlation."""
+    columns = list(features.columns)
+    stacked = np.concatenate([mix[:, :, None], adstock(mix, decays)], axis=2) if len(decays) else mix[:, :, None]
+    transforms = [0.0] + [float(d) for d in decays]
+    r, n = lagged_correlations(stacked.reshape(len(mix), -1), kpi, max_lag, min_days)
+    r = r.reshape(len(r), len(columns), len(transforms))
+    if not np.isfinite(r).any(): return pd.DataFrame(columns=DRIVER_COLUMNS)
+
+    strength = np.where(np.isfinite(r), np.abs(r), -1.0)
+    flat = strength.transpose(1, 0, 2).reshape(len(columns), -1).argmax(axis=1)
+    lag, transform = np.unravel_index(flat, (len(r), len(transforms)))
+    best = r[lag, np.arange(len(columns)), transform]
+    has_kpi = ~np.isnan(kpi)
+    table = pd.DataFrame({
+        'feature': columns,
+        'attribute': [c.split('=', 1)[0] for c in columns],
+        'value': [c.split('=', 1)[1] if '=' in c else "" for c in columns],
+        'kind': np.where(features.columns.str.startswith(SCORE_PREFIX), "score", "share"),
+        'lag_days': lag,
+        'adstock': np.asarray(transforms)[transform],
+        'correlation': best,
+        'same_day_correlation': r[0, :, 0],
+        'kpi_days': n[lag],
+        'videos': np.where(features.columns.str.startswith(SCORE_PREFIX), len(features),
+                           (features.to_numpy() > 0).sum(axis=0)),
+        'mean_mix': mix[has_kpi].mean(axis=0) if has_kpi.any() else np.nan
+    })
+    table = table[np.isfinite(table['correlation'])]
+    return table.reindex(table['correlation'].abs().sort_values(ascending=False).index).reset_index(drop=True)
+
+def correlate_drivers(performance_csv, schedule_csv, analysis_csv, output_csv=None, weights=None,
+                      decays=DRIVER_ADSTOCK_DECAYS, max_lag=DRIVER_MAX_LAG, min_days=DRIVER_MIN_DAYS):
+    """Builds the lagged driver table for one brand and writes it to output_csv.
+
+    `weights` (from processing.load_delivery) weights each creative-day by spend or
+    impressions; without it every scheduled creative counts once. The calendar runs
+    from the first active day to the last KPI day; KPI days without any active
+    creative still count (their mix is 0, adstock carries over).
+    """
+    df_perf = load_performance(performance_csv)
+    if weights is None:
+        weights = schedule_weights(expand_schedule(pd.read_csv(schedule_csv)))
+    features = attribute_features(as_frame(analysis_csv))
+    if not len(weights[1]) or df_perf.empty or features.shape[1] == 0:
+        print("  Drivers: nothing to correlate")
+        return None
+    kpi = df_perf.groupby('day')[KPI_COLUMN].mean()
+    calendar = pd.date_range(weights[1][0], max(kpi.index.max(), weights[1][-1]), freq='D')
+    mix = daily_feature_mix(weights, features, calendar)
+    table = driver_table(mix, features, kpi.reindex(calendar).to_numpy(dtype=np.float64), decays, max_lag, min_days)
+    print(f"  Drivers: {features.shape[1]} features x {max_lag + 1} lags x {len(decays) + 1} transforms "
+          f"over {len(calendar)} days")
+    if output_csv is not None:
+        table.to_csv(output_csv, index=False)
+    return table
@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+import time
+from .cache import file_sha256
+from .config import (FILE_REGISTRY_PATH, FILE_TTL_HOURS, FILE_EXPIRY_MARGIN_MINUTES, FILE_QUOTA_BYTES,
+                     FILE_SWEEP_INTERVAL, GEMINI_RETRIES)
+from .profiling import run_profile, video_id_from_path
+from .throttling import call_with_backoff
+
+class FileRegistry:
+    """Persistent map from local video sha256 to a live Gemini file handle.
+
+    acquire() reuses a handle while it is still live and uploads only when needed;
+    the sweeper deletes handles that are about to expire or that push storage past
+    the quota (least recently used first), except those acquired and not yet released.
+    """
+
+    def __init__(self, backend, path=FILE_REGISTRY_PATH, ttl_hours=FILE_TTL_HOURS,
+                 margin_minutes=FILE_EXPIRY_MARGIN_MINUTES, quota_bytes=FILE_QUOTA_BYTES):
+        self.backend = backend
+        self.path = path
+        self.ttl = ttl_hours * 3600
+        self.margin = margin_minutes * 60
+        self.quota_bytes = quota_bytes
+        self.reused = self.uploaded = 0
+        self._lock = threading.Lock()
+        self._inflight = {}  # digest -> [upload lock, callers waiting on it]
+        self._in_use = {}  # handle name -> acquires not yet released
+        self._stop = threading.Event()
+        self._sweeper = None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def _expiry(self, uploaded_file):
+        expiration = getattr(uploaded_file, "expiration_time", None)
+        try: return expiration.timestamp()
+        except AttributeError: return time.time() + self.ttl
+
+    def acquire(self, video_path, retries=GEMINI_RETRIES):
+        """Live handle for the video's bytes; pair every call with release(handle.name)."""
+        digest = file_sha256(video_path)
+        with self._lock:
+            inflight = self._inflight.setdefault(digest, [threading.Lock(), 0])
+            inflight[1] += 1
+        try:
+            with inflight[0]:  # concurrent requests for the same bytes share one upload
+                return self._acquire(digest, video_path, retries)
+        finally:
+            with self._lock:
+                inflight[1] -= 1
+                if not inflight[1]: del self._inflight[digest]
+
+    def _acquire(self, digest, video_path, retries):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry and entry["expires_at"] - self.margin > time.time():
+                self._in_use[entry["name"]] = self._in_use.get(entry["name"], 0) + 1  # sweep() now skips it
+            else:
+                entry = None
+        if entry:
+            try:
+                uploaded_file = self.backend.get_file(entry["name"])
+                if uploaded_file.state.name != "FAILED":
+                    with self._lock:
+                        entry["last_used"] = time.time()
+                        self.reused += 1
+                        self._save()
+                    return uploaded_file
+            except Exception:
+                pass
+            self.release(entry["name"])
+            self.forget(entry["name"])
+
+        size = os.path.getsize(video_path)
+        self.sweep(extra_bytes=size)
+        print(f"Uploading {video_path}...")
+        start = time.perf_counter()
+        uploaded_file = call_with_backoff(lambda: self.backend.upload_file(video_path), retries=retries,
+                                          name="upload")
+        run_profile.video(video_id_from_path(video_path), "upload", time.perf_counter() - start)
+        run_profile.add_bytes("uploaded", size)
+        with self._lock:
+            self._entries[digest] = {"name": uploaded_file.name, "size": size,
+                                     "expires_at": self._expiry(uploaded_file), "last_used": time.time()}
+            self._in_use[uploaded_file.name] = self._in_use.get(uploaded_file.name, 0) + 1
+            self.uploaded += 1
+            self._save()
+        return uploaded_file
+
+    def release(self, name):
+        """Ends one acquire() of a handle; sweep() may delete it again once no caller holds it."""
+        with self._lock:
+            count = self._in_use.get(name, 0) - 1
+            if count > 0: self._in_use[name] = count
+            else: self._in_use.pop(name, None)
+
+    def forget(self, name):
+        """Deletes a handle remotely and drops it (e.g. after Gemini failed to process it)."""
+        with self._lock:
+            for digest, entry in list(self._entries.items()):
+                if entry["name"] == name: del self._entries[digest]
+            self._save()
+        try: self.backend.delete_file(name)
+        except Exception: pass
+
+    def sweep(self, extra_bytes=0):
+        # Handles held by a generation or a pending batch job are never deleted (nor counted as evictable)
+        now = time.time()
+        with self._lock:
+            held = {d for d, e in self._entries.items() if e["name"] in self._in_use}
+            doomed = [d for d, e in self._entries.items() if e["expires_at"] - self.margin <= now and d not in held]
+            live = sorted((e["last_used"], d) for d, e in self._entries.items() if d not in doomed and d not in held)
+            used = sum(e["size"] for d, e in self._entries.items() if d not in doomed) + extra_bytes
+            for _, digest in live:
+                if not self.quota_bytes or used <= self.quota_bytes: break
+                doomed.append(digest)
+                used -= self._entries[digest]["size"]
+            names = [self._entries.pop(d)["name"] for d in doomed]
+            if names: self._save()
+        for name in names:
+            try: self.backend.delete_file(name)
+            except Exception: pass
+        return len(names)
+
+    def start_sweeper(self, interval=FILE_SWEEP_INTERVAL):
+        def run():
+            while not self._stop.wait(interval):
+                self.sweep()
+        self._sweeper = threading.Thread(target=run, daemon=True)
+        self._sweeper.start()
+
+    def stop(self):
+        self._stop.set()
+        print(f"  File handles: {self.reused} reused, {self.uploaded} uploaded, {len(self._entries)} live")
@@ -0,0 +1,338 @@
+"""Near-duplicate creatives (cutdowns, re-edits, regional copies) found from local fingerprints.
+
+Each download gets a 64-bit difference hash per sampled frame (9x8 grayscale,
+flat frames dropped) and a 32-bit sub-band energy fingerprint every ~93 ms of
+audio, both decoded with ffmpeg and kept in {videos_dir}/fingerprints.json.
+Candidate pairs share 16-bit slices of their frame hashes (one sparse product
+over the whole catalog); each candidate is then verified frame by frame and on
+the best audio alignment before it is linked to a canonical creative.
+"""
+import csv
+import json
+import os
+import shutil
+import subprocess
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+from scipy import sparse
+from .config import (FINGERPRINT_FPS, FINGERPRINT_MAX_SECONDS, FINGERPRINT_MIN_CONTRAST, FINGERPRINT_AUDIO_RATE,
+                     FINGERPRINT_MIN_RMS, FINGERPRINT_FRAME_MAX_BITS, FINGERPRINT_VIDEO_THRESHOLD,
+                     FINGERPRINT_AUDIO_THRESHOLD, FINGERPRINT_CANDIDATE_SHARE,
+                     FINGERPRINT_MAX_SLICE_VIDEOS, FINGERPRINT_WORKERS)
+
+DUPLICATE_COLUMNS = ["video_id", "canonical_video_id", "video_similarity", "audio_similarity"]
+AUDIO_FRAME = 2048  # samples per spectrum (~0.37 s at 5512 Hz)
+AUDIO_HOP = 512
+AUDIO_BANDS = np.geomspace(300, 2000, 34)  # 33 log-spaced bands -> 32 energy-difference bits
+BAND_BITS = 16  # candidate keys: the four 16-bit slices of every frame hash
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _popcount(x):
+    # Set bits per element of an unsigned integer array, summed over its trailing byte axis
+    x = np.ascontiguousarray(x)
+    return _POPCOUNT[x.view(np.uint8)].reshape(x.shape + (x.dtype.itemsize,)).sum(axis=-1, dtype=np.int64)
+
+def dhash(frames):
+    """64-bit difference hashes of (n, 8, 9) grayscale frames; frames with pixel std below
+    FINGERPRINT_MIN_CONTRAST (black, fades, flat slates) are dropped."""
+    frames = np.asarray(frames, dtype=np.float32).reshape(-1, 8, 9)
+    frames = frames[frames.reshape(-1, 72).std(axis=1) >= FINGERPRINT_MIN_CONTRAST]
+    bits = (frames[:, :, :-1] > frames[:, :, 1:]).reshape(len(frames), 64)
+    return (bits.astype(np.uint64) << np.arange(64, dtype=np.uint64)).sum(axis=1, dtype=np.uint64)
+
+def audio_fingerprint(samples, rate=FINGERPRINT_AUDIO_RATE):
+    """32-bit sub-fingerprints: signs of band-energy differences between adjacent bands and frames.
+
+    Silent tracks (RMS below FINGERPRINT_MIN_RMS) give an empty fingerprint.
+    """
+    x = np.asarray(samples, dtype=np.float32)
+    if len(x) < AUDIO_FRAME + 2 * AUDIO_HOP or np.sqrt(np.mean(x * x)) < FINGERPRINT_MIN_RMS:
+        return np.zeros(0, dtype=np.uint32)
+    windows = np.lib.stride_tricks.sliding_window_view(x, AUDIO_FRAME)[::AUDIO_HOP] * np.hanning(AUDIO_FRAME)
+    power = np.abs(np.fft.rfft(windows, axis=1)) ** 2
+    edges = np.searchsorted(np.fft.rfftfreq(AUDIO_FRAME, 1 / rate), AUDIO_BANDS)
+    energy = np.add.reduceat(power[:, :edges[-1]], edges[:-1], axis=1)
+    diff = energy[:, :-1] - energy[:, 1:]
+    bits = (diff[1:] - diff[:-1]) > 0
+    return (bits.astype(np.uint32) << np.arange(32, dtype=np.uint32)).sum(axis=1, dtype=np.uint32)
+
+def _decode(cmd):
+    try:
+        return subprocess.run(cmd, check=True, capture_output=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return b""
+
+def fingerprint_video(video_path, fps=FINGERPRINT_FPS, max_seconds=FINGERPRINT_MAX_SECONDS, ffmpeg="ffmpeg"):
+    """Decodes sampled frames and mono audio with ffmpeg. Returns {"duration", "frames", "audio"}."""
+    base = [ffmpeg, "-loglevel", "error", "-t", str(max_seconds), "-i", str(video_path)]
+    raw = _decode(base + ["-an", "-vf", f"fps={fps},scale=9:8:flags=area,format=gray",
+                          "-f", "rawvideo", "pipe:1"])
+    frames = np.frombuffer(raw[:len(raw) // 72 * 72], dtype=np.uint8).reshape(-1, 8, 9)
+    pcm = _decode(base + ["-vn", "-ac", "1", "-ar", str(FINGERPRINT_AUDIO_RATE), "-f", "s16le", "pipe:1"])
+    samples = np.frombuffer(pcm[:len(pcm) // 2 * 2], dtype=np.int16)
+    return {"duration": round(max(len(frames) / fps, len(samples) / FINGERPRINT_AUDIO_RATE), 2),
+            "frames": [int(h) for h in dhash(frames)],
+            "audio": [int(h) for h in audio_fingerprint(samples)]}
+
+class FingerprintIndex:
+    """Fingerprints of one videos directory, saved in fingerprints.json and kept while each
+    file's size and mtime are unchanged."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        try:
+            self.entries = json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self.entries), encoding='utf-8')
+        os.replace(tmp, self.path)
+
+    def fingerprint(self, video_id, video_path, ffmpeg="ffmpeg"):
+        """Entry of one file, computed unless its size and mtime are unchanged. Kept in memory until save()."""
+        st = os.stat(video_path)
+        stamp = [Path(video_path).name, st.st_size, st.st_mtime_ns]
+        with self._lock:
+            entry = self.entries.get(video_id)
+        if (entry or {}).get("file") == stamp: return entry
+        entry = fingerprint_video(video_path, ffmpeg=ffmpeg)
+        entry["file"] = stamp
+        with self._lock:
+            self.entries[video_id] = entry
+        return entry
+
+    def update(self, video_paths, workers=FINGERPRINT_WORKERS, ffmpeg="ffmpeg"):
+        """Fingerprints new or changed files of {video_id: path}; returns {video_id: entry}.
+
+        Returns None when ffmpeg is not available.
+        """
+        if not shutil.which(ffmpeg):
+            print("  ffmpeg not found; skipping near-duplicate detection.")
+            return None
+        stats = {vid: os.stat(path) for vid, path in video_paths.items()}
+        todo = [vid for vid, st in stats.items()
+                if (self.entries.get(vid) or {}).get("file") != [Path(video_paths[vid]).name, st.st_size, st.st_mtime_ns]]
+        if todo:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                list(pool.map(lambda vid: self.fingerprint(vid, video_paths[vid], ffmpeg), todo))
+            self.save()
+        print(f"  Fingerprints: {len(todo)} computed, {len(video_paths) - len(todo)} reused")
+        return {vid: self.entries[vid] for vid in video_paths}
+
+def frame_similarity(a, b, max_bits=FINGERPRINT_FRAME_MAX_BITS):
+    """Share of the shorter hash sequence's frames within max_bits of some frame of the other.
+
+    Order-free, so cutdowns and re-cut shots still match the full spot.
+    """
+    a, b = np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64)
+    if not len(a) or not len(b): return 0.0
+    if len(a) > len(b): a, b = b, a
+    distances = _popcount(a[:, None] ^ b[None, :])
+    return float((distances.min(axis=1) <= max_bits).mean())
+
+def audio_similarity(a, b, max_overhang=0.1):
+    """1 - bit error rate of the shorter fingerprint at its best offset within the longer one.
+
+    The shorter track may hang over either end by `max_overhang` of its length
+    (encoder padding, trimmed tails).
+    """
+    a, b = np.asarray(a, dtype=np.uint32), np.asarray(b, dtype=np.uint32)
+    if not len(a) or not len(b): return 0.0
+    if len(a) > len(b): a, b = b, a
+    pad = int(len(a) * max_overhang)
+    padded = np.concatenate([np.zeros(pad, np.uint32), b, np.zeros(pad, np.uint32)])
+    valid = np.concatenate([np.zeros(pad, bool), np.ones(len(b), bool), np.zeros(pad, bool)])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, len(a))
+    overlap = np.lib.stride_tricks.sliding_window_view(valid, len(a))
+    errors = (_popcount(windows ^ a) * overlap).sum(axis=1)
+    bits = overlap.sum(axis=1) * 32
+    return float(1 - (errors / bits).min())
+
+def _slices(hashes):
+    # Distinct 16-bit slices of a video's frame hashes, offset by band so the four bands never collide
+    h = np.asarray(hashes, dtype=np.uint64)
+    return np.unique(np.concatenate([((h >> np.uint64(band * BAND_BITS)) & np.uint64((1 << BAND_BITS) - 1))
+                                     .astype(np.int64) + (band << BAND_BITS) for band in range(64 // BAND_BITS)]))
+
+def candidate_pairs(frames, min_shared=FINGERPRINT_CANDIDATE_SHARE, max_videos=FINGERPRINT_MAX_SLICE_VIDEOS):
+    """(i, j) index pairs whose frame-hash slices overlap on at least `min_shared` of the
+    smaller video's distinct slices, from one sparse video x slice co-occurrence product.
+
+    Slices held by more than `max_videos` videos (a brand end card on every spot)
+    are left out, so they neither pair unrelated spots nor densify the product.
+    """
+    rows, keys = [], []
+    for i, hashes in enumerate(frames):
+        slices = _slices(hashes)
+        rows.append(np.full(len(slices), i))
+        keys.append(slices)
+    if not rows: return np.zeros((0, 2), dtype=int)
+    rows, keys = np.concatenate(rows), np.concatenate(keys)
+    incidence = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, keys)),
+                                  shape=(len(frames), 64 // BAND_BITS << BAND_BITS))
+    sizes = np.asarray(incidence.sum(axis=1)).ravel()
+    common = np.asarray(incidence.sum(axis=0)).ravel() > max_videos
+    incidence = incidence @ sparse.diags((~common).astype(np.float32))
+    shared = sparse.triu(incidence @ incidence.T, k=1).tocoo()
+    keep = shared.data >= min_shared * np.minimum(sizes[shared.row], sizes[shared.col])
+    return np.column_stack([shared.row[keep], shared.col[keep]])
+
+def _similarity(fa, fb, video_threshold, audio_threshold, max_bits):
+    # (video, audio) similarity of two fingerprints, or None when they are not near-duplicates;
+    # audio is None when both tracks are silent
+    video = frame_similarity(fa["frames"], fb["frames"], max_bits)
+    if video < video_threshold: return None
+    if not len(fa["audio"]) and not len(fb["audio"]): return video, None
+    audio = audio_similarity(fa["audio"], fb["audio"])
+    return (video, audio) if audio >= audio_threshold else None
+
+def _duplicate_row(video_id, matches):
+    # Links to the canonical with the best weaker-of-the-two similarity
+    (video, audio), canonical = max(matches, key=lambda m: (min(x for x in m[0] if x is not None), m[1]))
+    return {"video_id": video_id, "canonical_video_id": canonical, "video_similarity": round(video, 3),
+            "audio_similarity": "" if audio is None else round(audio, 3)}
+
+def find_duplicates(fingerprints, preferred=(), video_threshold=FINGERPRINT_VIDEO_THRESHOLD,
+                    audio_threshold=FINGERPRINT_AUDIO_THRESHOLD, max_bits=FINGERPRINT_FRAME_MAX_BITS,
+                    min_length_ratio=0.9):
+    """Links near-duplicates to a canonical creative. Returns {video_id: duplicate row}.
+
+    Videos are visited with `preferred` ids (e.g. already analyzed) first, then the
+    longest first; each one joins the most similar canonical it duplicates or
+    becomes a canonical itself. A canonical must be at least `min_length_ratio` as
+    long as its duplicate, so a full spot never inherits a cutdown's analysis.
+    Audio must match too unless both tracks are silent.
+    """
+    ids = [vid for vid, fp in fingerprints.items() if fp and len(fp["frames"])]
+    candidates = candidate_pairs([fingerprints[vid]["frames"] for vid in ids])
+    partners = {vid: [] for vid in ids}
+    for i, j in candidates:
+        partners[ids[i]].append(ids[j])
+        partners[ids[j]].append(ids[i])
+
+    preferred = set(preferred)
+    order = sorted(ids, key=lambda vid: (vid not in preferred, -fingerprints[vid]["duration"], vid))
+    canonicals, duplicates = set(), {}
+    for vid in order:
+        duration = fingerprints[vid]["duration"]
+        matches = [(s, other) for other in partners[vid]
+                   if other in canonicals and fingerprints[other]["duration"] >= min_length_ratio * duration
+                   for s in [_similarity(fingerprints[vid], fingerprints[other], video_threshold, audio_threshold,
+                                         max_bits)] if s is not None]
+        if not matches:
+            canonicals.add(vid)
+            continue
+        duplicates[vid] = _duplicate_row(vid, matches)
+    return duplicates
+
+class DuplicateFilter:
+    """find_duplicates for videos that arrive one at a time (--stream).
+
+    Each download is fingerprinted and matched against the canonicals seen so far.
+    The first video of a group becomes its canonical, so a full spot that arrives
+    after its cutdown is analyzed on its own rather than linked.
+    """
+
+    def __init__(self, index, ffmpeg="ffmpeg", video_threshold=FINGERPRINT_VIDEO_THRESHOLD,
+                 audio_threshold=FINGERPRINT_AUDIO_THRESHOLD, max_bits=FINGERPRINT_FRAME_MAX_BITS,
+                 min_share=FINGERPRINT_CANDIDATE_SHARE, min_length_ratio=0.9):
+        self.index, self.ffmpeg = index, ffmpeg
+        self.thresholds = (video_threshold, audio_threshold, max_bits)
+        self.min_share, self.min_length_ratio = min_share, min_length_ratio
+        self.duplicates = {}
+        self._canonicals = {}
+        self._slices = {}
+        self._lock = threading.Lock()
+
+    def check(self, video_id, video_path):
+        """Duplicate row when the video near-duplicates a canonical seen so far; otherwise it
+        becomes a canonical and None is returned."""
+        fp = self.index.fingerprint(video_id, video_path, self.ffmpeg)
+        if not len(fp["frames"]): return None
+        slices = set(_slices(fp["frames"]).tolist())
+        with self._lock:
+            shared = Counter(other for key in slices for other in self._slices.get(key, ()))
+            matches = [(s, other) for other, n in shared.items()
+                       if n >= self.min_share * min(len(slices), self._canonicals[other][1])
+                       and self._canonicals[other][0]["duration"] >= self.min_length_ratio * fp["duration"]
+                       for s in [_similarity(fp, self._canonicals[other][0], *self.thresholds)] if s is not None]
+            if matches:
+                row = self.duplicates[video_id] = _duplicate_row(video_id, matches)
+                return row
+            self._canonicals[video_id] = (fp, len(slices))
+            for key in slices:
+                self._slices.setdefault(key, []).append(video_id)
+        return None
+
+def write_duplicates(duplicates, output_csv):
+    tmp = Path(output_csv).with_name(Path(output_csv).name + ".tmp")
+    with open(tmp, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=DUPLICATE_COLUMNS)
+        writer.writeheader()
+        writer.writerows(sorted(duplicates.values(), key=lambda r: (r["canonical_video_id"], r["video_id"])))
+    os.replace(tmp, output_csv)
+    return output_csv
+
+def load_duplicates(duplicates_csv):
+    """{video_id: duplicate row} from duplicates.csv ({} when it does not exist)."""
+    if not os.path.exists(duplicates_csv): return {}
+    with open(duplicates_csv, 'r', encoding='utf-8', newline='') as f:
+        return {row["video_id"]: row for row in csv.DictReader(f)}
+
+def duplicate_similarity(row):
+    # The weaker of the two checks; audio is blank when both tracks are silent
+    return min(float(row[k]) for k in ("video_similarity", "audio_similarity") if row.get(k) not in (None, ""))
+
+def split_duplicate_jobs(jobs, duplicates):
+    """Splits (video_path, video_url, output_path) jobs into (to analyze, to inherit).
+
+    A near-duplicate is only inherited when its canonical is among the jobs, so
+    a stale duplicates.csv never leaves a video without an analysis.
+    """
+    ids = {Path(job[2]).stem for job in jobs}
+    analyze, inherit = [], []
+    for job in jobs:
+        row = duplicates.get(Path(job[2]).stem)
+        (inherit if row and row["canonical_video_id"] in ids else analyze).append(job)
+    return analyze, inherit
+
+def inherit_analyses(jobs, duplicates):
+    """Writes each near-duplicate's analysis from its canonical's JSON in the same directory.
+
+    The copy keeps its own URL and records canonical_video_id and
+    duplicate_similarity in its metadata (and so in master_analysis.csv); files are
+    only rewritten when that changes. Returns {str(output_path): data}; jobs whose
+    canonical has no analysis map to None.
+    """
+    results = {}
+    for _, video_url, output_path in jobs:
+        row = duplicates[Path(output_path).stem]
+        try:
+            with open(Path(output_path).with_name(f"{row['canonical_video_id']}.json"), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            print(f"  {Path(output_path).stem}: canonical {row['canonical_video_id']} has no analysis yet")
+            results[str(output_path)] = None
+            continue
+        data.setdefault("metadata", {}).update(url=video_url, analysis_key=None,
+                                               canonical_video_id=row["canonical_video_id"],
+                                               duplicate_similarity=duplicate_similarity(row))
+        try:
+            with open(output_path, 'r', encoding='utf-8') as f:
+                unchanged = json.load(f) == data
+        except (OSError, ValueError):
+            unchanged = False
+        if not unchanged:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=4, ensure_ascii=False)
+        results[str(output_path)] = data
+    if jobs:
+        inherited = sum(v is not None for v in results.values())
+        print(f"  Near-duplicates: {inherited} of {len(jobs)} analyses inherited instead of calling Gemini")
+    return results
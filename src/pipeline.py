@@ -0,0 +1,137 @@
+import os
+import queue
+import shutil
+import threading
+from pathlib import Path
+from .acquisition import download_video, download_with_retry
+from .analysis import GeminiBackend, load_existing_analysis, make_limiters, upload_video, wait_until_active, generate_analysis, release_file
+from .fingerprint import inherit_analyses
+from .config import (DOWNLOAD_WORKERS, DOWNLOAD_HOST_RATE, DOWNLOAD_RETRIES, ANALYSIS_WORKERS, GEMINI_RPM,
+                     GEMINI_TPM, GEMINI_RETRIES, STREAM_QUEUE_SIZE)
+from .throttling import HostRateLimiter
+from .transcoding import transcode_proxy
+from .video_store import VideoStore
+
+_DONE = object()
+
+def _start_stage(name, fn, inbox, outbox, workers, downstream_workers):
+    # Runs `fn` over items from `inbox` on `workers` threads; once all of them exit,
+    # signals every downstream worker with a sentinel.
+    def worker():
+        while True:
+            item = inbox.get()
+            if item is _DONE: return
+            try:
+                result = fn(item)
+            except Exception as e:
+                print(f"  [{name}] error: {e}")
+                continue
+            if result is not None and outbox is not None:
+                outbox.put(result)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, workers))]
+    for t in threads: t.start()
+
+    def close():
+        for t in threads: t.join()
+        if outbox is not None:
+            for _ in range(downstream_workers): outbox.put(_DONE)
+
+    closer = threading.Thread(target=close, daemon=True)
+    closer.start()
+    return closer
+
+def run_streaming_pipeline(video_urls, videos_dir, analysis_dir, api_key=None, backend=None,
+                           cookies_path=None, download_workers=DOWNLOAD_WORKERS, analysis_workers=ANALYSIS_WORKERS,
+                           queue_size=STREAM_QUEUE_SIZE, host_rate=DOWNLOAD_HOST_RATE, rpm=GEMINI_RPM, tpm=GEMINI_TPM,
+                           downloader=download_video, cache=None, transcode=False, registry=None,
+                           duplicate_filter=None):
+    """Streams each video through download -> upload -> analyze into analysis_dir.
+
+    Stages are connected by bounded queues, so a slow stage applies backpressure
+    upstream instead of letting downloads pile up on disk. The master table is
+    left to processing.aggregate_results, which reads the JSONs. With a
+    fingerprint.DuplicateFilter, near-duplicates of a video already in the stream
+    are not uploaded; they inherit its analysis once the stream drains. Returns
+    ({url: path}, {url: status}, {video_id: analysis}).
+    """
+    os.makedirs(analysis_dir, exist_ok=True)
+    download_workers, analysis_workers = max(1, download_workers), max(1, analysis_workers)
+    backend = backend or GeminiBackend(api_key)
+    limiters = make_limiters(rpm, tpm)
+    host_limiter = HostRateLimiter(host_rate)
+    VideoStore.open(videos_dir).clean_partials()
+    if transcode and not shutil.which("ffmpeg"):
+        print("  ffmpeg not found; uploading original files.")
+        transcode = False
+
+    video_paths, statuses, results, held = {}, {}, {}, []
+    url_q = queue.Queue(maxsize=queue_size)
+    upload_q = queue.Queue(maxsize=queue_size)
+    analyze_q = queue.Queue(maxsize=queue_size)
+    collect_q = queue.Queue(maxsize=queue_size)
+
+    def download(url):
+        path, status = download_with_retry(url, videos_dir, host_limiter, cookies_path=cookies_path,
+                                           retries=DOWNLOAD_RETRIES, downloader=downloader)
+        statuses[url] = status
+        print(f"  - {url}: {status}" if path else f"  - {url}: FAILED ({status})")
+        if not path: return None
+        video_paths[url] = path
+        output_path = Path(analysis_dir) / f"{Path(path).stem}.json"
+        if duplicate_filter is not None:
+            row = duplicate_filter.check(Path(path).stem, path)
+            if row:
+                print(f"  - {Path(path).stem}: near-duplicate of {row['canonical_video_id']}, inheriting its analysis")
+                held.append((path, url, output_path))
+                return None
+        upload_path = path
+        if transcode:
+            upload_path, original_bytes, proxy_bytes = transcode_proxy(path)
+            print(f"  - {Path(path).stem}: proxy saves {(original_bytes - proxy_bytes) / (1024 * 1024):.1f} MB")
+        return upload_path, url, output_path
+
+    def upload(job):
+        data = load_existing_analysis(job[0], job[1], job[2], cache=cache)
+        if data is not None: return job, data
+        uploaded_file = upload_video(backend, job[0], retries=GEMINI_RETRIES, registry=registry)
+        try:
+            return job, wait_until_active(backend, uploaded_file, video_path=job[0])
+        except Exception:
+            release_file(backend, uploaded_file, registry, failed=True)
+            raise
+
+    def analyze(item):
+        # Payload is either a live uploaded file or an analysis reused without API calls
+        job, uploaded_file = item
+        video_id = Path(job[2]).stem
+        if isinstance(uploaded_file, dict):
+            return video_id, uploaded_file
+        try:
+            print(f"Analyzing {job[0]}...")
+            return video_id, generate_analysis(backend, uploaded_file, job[0], job[1], job[2], limiters,
+                                               retries=GEMINI_RETRIES, cache=cache)
+        finally:
+            release_file(backend, uploaded_file, registry)
+
+    def collect(item):
+        video_id, data = item
+        results[video_id] = data
+
+    _start_stage("download", download, url_q, upload_q, download_workers, analysis_workers)
+    _start_stage("upload", upload, upload_q, analyze_q, analysis_workers, analysis_workers)
+    _start_stage("analyze", analyze, analyze_q, collect_q, analysis_workers, 1)
+    collector = _start_stage("collect", collect, collect_q, None, 1, 0)
+
+    for url in video_urls:
+        url_q.put(url)
+    for _ in range(download_workers):
+        url_q.put(_DONE)
+    collector.join()
+    if held:
+        for output_path, data in inherit_analyses(held, duplicate_filter.duplicates).items():
+            if data is not None: results[Path(output_path).stem] = data
+
+    video_paths = {url: video_paths[url] for url in video_urls if url in video_paths}
+    statuses = {url: statuses.get(url, "Download Failed") for url in video_urls}
+    return video_paths, statuses, results
@@ -1,124 +1,516 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from scipy import sparse
+import csv
+import hashlib
 import json
 import os
-import re
-from datetime import timedelta
+import shutil
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from .cache import file_sha256
+from .dataset import as_frame
+from .config import (AGGREGATE_WORKERS, AGGREGATE_PARALLEL_MIN_FILES, AGGREGATE_BATCH_ROWS, MASTER_COLUMNS,
+                     DELIVERY_WEIGHT_COLUMNS, DELIVERY_DATE_FORMATS, DELIVERY_CHUNK_ROWS)
 
-def aggregate_json_to_csv(json_dir, output_csv):
-    all_data = []
+def flatten_analysis(video_id, data):
+    # Flatten basics
+    row = {
+        "video_id": video_id,
+        "url": data.get("metadata", {}).get("url", ""),
+        "foco": data.get("foco", ""),
+        "tom": data.get("tom", ""),
+        "cenario": data.get("cenario", ""),
+        "ocasiao_consumo": data.get("ocasiao_consumo", ""),
+        "ritual_sensorial": data.get("ritual_sensorial", ""),
+        "variante_produto": data.get("variante_produto", ""),
+        "gancho_promocional": data.get("gancho_promocional", ""),
+        "analise_visual": data.get("analise_visual", ""),
+        "atencao": data.get("atencao", ""),
+        # Set on near-duplicates whose analysis was inherited (src/fingerprint.py)
+        "canonical_video_id": data.get("metadata", {}).get("canonical_video_id", ""),
+        "duplicate_similarity": data.get("metadata", {}).get("duplicate_similarity", "")
+    }
+    # Flatten ABCD scores if they exist (added to config recently)
+    scores = data.get("abcd_score", {})
+    if scores:
+        for k, v in scores.items():
+            row[f"score_{k}"] = v
+    return row
+
+def append_analysis_rows(rows, output_csv):
+    """Appends flattened rows to the master CSV, keeping its existing header."""
+    if not rows: return
+    exists = os.path.exists(output_csv) and os.path.getsize(output_csv) > 0
+    if exists:
+        with open(output_csv, 'r', encoding='utf-8', newline='') as f:
+            columns = next(csv.reader(f))
+    else:
+        columns = MASTER_COLUMNS
+    with open(output_csv, 'a', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        if not exists: writer.writeheader()
+        writer.writerows(rows)
+
+def _parse_analysis_file(path):
+    fname = os.path.basename(path)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return fname, flatten_analysis(fname.replace(".json", ""), data), None
+    except Exception as e:
+        return fname, None, str(e)
+
+def _parse_analysis_files(paths, workers):
+    if workers > 1 and len(paths) >= AGGREGATE_PARALLEL_MIN_FILES:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            yield from pool.map(_parse_analysis_file, paths, chunksize=64)
+    else:
+        yield from map(_parse_analysis_file, paths)
+
+def _load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_manifest(path, manifest):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+def _is_numeric_column(column):
+    return column.startswith("score_") or column == "duplicate_similarity"
+
+MASTER_SCHEMA = pa.schema([(c, pa.float64() if _is_numeric_column(c) else pa.string()) for c in MASTER_COLUMNS])
+
+def _master_table(rows):
+    # Same cell types a CSV round trip gave: blanks are missing, scores and similarities numeric, the rest text
+    columns = []
+    for c in MASTER_COLUMNS:
+        values = [row.get(c) for row in rows]
+        if _is_numeric_column(c):
+            numbers = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(np.float64)
+            columns.append(pa.array(numbers, type=pa.float64(), from_pandas=True))
+        else:
+            columns.append(pa.array([None if v is None or v == "" or (isinstance(v, float) and np.isnan(v)) else str(v)
+                                     for v in values], type=pa.string()))
+    return pa.Table.from_arrays(columns, schema=MASTER_SCHEMA)
+
+def _write_fragment(path, table):
+    # The "_" prefix keeps half-written fragments out of dataset reads
+    tmp = path.with_name(f"_{path.name}.tmp")
+    pq.write_table(table, tmp)
+    os.replace(tmp, path)
+
+def _compact_fragment(path, video_ids):
+    # Rewrites one fragment without the given rows; the rest of the master is left alone
+    if not path.exists(): return
+    table = pq.read_table(path)
+    table = table.filter(pc.invert(pc.is_in(table['video_id'], value_set=pa.array(sorted(video_ids), pa.string()))))
+    if table.num_rows: _write_fragment(path, table)
+    else: path.unlink()
+
+def _drop_csv_rows(output_csv, video_ids):
+    # Streams the CSV export through a temp file, skipping the given video IDs
+    tmp = f"{output_csv}.tmp"
+    with open(output_csv, 'r', encoding='utf-8', newline='') as src, open(tmp, 'w', encoding='utf-8', newline='') as dst:
+        reader, writer = csv.reader(src), csv.writer(dst)
+        header = next(reader)
+        writer.writerow(header)
+        id_col = header.index("video_id")
+        writer.writerows(row for row in reader if row[id_col] not in video_ids)
+    os.replace(tmp, output_csv)
+
+def _export_fragments(fragments, output_csv):
+    # One fragment in memory at a time
+    for i, path in enumerate(fragments):
+        pq.read_table(path).to_pandas().to_csv(output_csv, mode='w' if i == 0 else 'a', header=i == 0,
+                                               index=False, float_format='%.10g')
+
+def aggregate_results(json_dir, master_dir, export_csv=None, workers=AGGREGATE_WORKERS, batch_rows=AGGREGATE_BATCH_ROWS):
+    """Brings the master_analysis.parquet dataset up to date with the JSON files in json_dir.
+
+    The master is a directory of Parquet fragments. A manifest next to it (mtime,
+    size, sha256 and fragment per file) limits parsing to new or changed files,
+    whose rows are written while parsing as new fragments of up to `batch_rows`
+    rows. Rows of changed or deleted files are compacted out of the fragments that
+    hold them; other fragments are not touched. `export_csv` is kept in step the
+    same way (stale rows streamed out, new rows appended). A master written with
+    other columns than MASTER_COLUMNS is rebuilt. Returns master_dir, or None when
+    there is nothing to aggregate.
+    """
     if not os.path.exists(json_dir): return None
-    
-    for fname in os.listdir(json_dir):
-        if not fname.endswith('.json'): continue
-        path = os.path.join(json_dir, fname)
-        try:
-            with open(path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-            # Flatten basics
-            row = {
-                "video_id": fname.replace(".json", ""),
-                "url": data.get("metadata", {}).get("url", ""),
-                "foco": data.get("foco", ""),
-                "tom": data.get("tom", ""),
-                "cenario": data.get("cenario", ""),
-                "ocasiao_consumo": data.get("ocasiao_consumo", ""),
-                "analise_visual": data.get("analise_visual", ""),
-                "atencao": data.get("atencao", "")
-            }
-            # Flatten ABCD scores if they exist (added to config recently)
-            scores = data.get("abcd_score", {})
-            if scores:
-                for k, v in scores.items():
-                    row[f"score_{k}"] = v
-            
-            all_data.append(row)
-        except Exception as e:
-            print(f"Error reading {fname}: {e}")
-
-    df = pd.DataFrame(all_data)
-    if not df.empty:
-        df.to_csv(output_csv, index=False)
-    return df
-
-def correlate_performance(performance_csv, schedule_csv, analysis_csv, output_csv):
-    if not (os.path.exists(performance_csv) and os.path.exists(schedule_csv) and os.path.exists(analysis_csv)):
-        print("Missing input files for correlation.")
+    master_dir = Path(master_dir)
+    manifest_path = master_dir.with_suffix('.manifest.json')
+    manifest = _load_manifest(manifest_path) if master_dir.is_dir() else None
+    if manifest is not None and manifest.get("columns") != MASTER_COLUMNS:
+        print("  master_analysis columns changed; rebuilding")
+        manifest = None
+    if manifest is None:
+        manifest = {"columns": MASTER_COLUMNS, "next_part": 0, "files": {}}
+        if master_dir.is_dir(): shutil.rmtree(master_dir)
+        elif master_dir.exists(): master_dir.unlink()  # single-file table from an older version
+        if export_csv and os.path.exists(export_csv): os.remove(export_csv)
+    master_dir.mkdir(parents=True, exist_ok=True)
+    files = manifest["files"]
+    # Fragments no manifest entry points to were left by an interrupted run
+    parts = {entry.get('part') for entry in files.values()}
+    for path in master_dir.glob("*.parquet*"):
+        if path.name not in parts: path.unlink()
+
+    current, to_parse = {}, []
+    for entry in os.scandir(json_dir):
+        if not entry.name.endswith('.json') or not entry.is_file(): continue
+        st = entry.stat()
+        prev = files.get(entry.name)
+        if prev and prev['mtime'] == st.st_mtime_ns and prev['size'] == st.st_size:
+            current[entry.name] = prev
+            continue
+        current[entry.name] = {'mtime': st.st_mtime_ns, 'size': st.st_size, 'sha256': file_sha256(entry.path)}
+        if prev and prev['sha256'] == current[entry.name]['sha256']:
+            current[entry.name]['part'] = prev.get('part')
+        else:
+            to_parse.append(entry.path)
+
+    removed = set(files) - set(current)
+    stale = removed | {name for name in map(os.path.basename, to_parse) if name in files}
+    by_part = {}
+    for name in stale:
+        by_part.setdefault(files[name].get('part'), set()).add(name.replace(".json", ""))
+    for part, video_ids in by_part.items():
+        if part: _compact_fragment(master_dir / part, video_ids)
+
+    if export_csv and os.path.exists(export_csv) and (stale or to_parse):
+        # Rows for re-parsed files may already be in the export (e.g. from an interrupted run)
+        _drop_csv_rows(export_csv, {os.path.basename(name).replace(".json", "") for name in stale | set(to_parse)})
+    elif export_csv and not os.path.exists(export_csv):
+        _export_fragments(sorted(master_dir.glob("*.parquet")), export_csv)
+
+    batch = []
+    def flush():
+        part = f"part-{manifest['next_part']:06d}.parquet"
+        manifest['next_part'] += 1
+        _write_fragment(master_dir / part, _master_table([row for _, row in batch]))
+        if export_csv: append_analysis_rows([row for _, row in batch], export_csv)
+        for fname, _ in batch: current[fname]['part'] = part
+        batch.clear()
+    for fname, row, error in _parse_analysis_files(sorted(to_parse), workers):
+        if error:
+            print(f"Error reading {fname}: {error}")
+            current.pop(fname, None)
+            continue
+        batch.append((fname, row))
+        if len(batch) >= batch_rows: flush()
+    if batch: flush()
+
+    manifest['files'] = current
+    _save_manifest(manifest_path, manifest)
+    print(f"  Aggregated {len(to_parse)} new/changed analyses ({len(removed)} removed, {len(current)} total)")
+    return master_dir if any(master_dir.glob("*.parquet")) else None
+
+VIDEO_ID_PATTERN = r'(?:v=|\/)([0-9A-Za-z_-]{11})'
+MIX_STATE_DIRNAME = "mix_state"
+PERMUTATION_BATCH_SIZE = 256
+MIX_COLUMNS = ['mix_emotional_pct', 'mix_rational_pct', 'mix_product_pct', 'mix_brand_pct']
+
+def schedule_flights(df_sched):
+    """One row per (flight, link) with a parseable date range and a valid video ID, in schedule order."""
+    link_cols = [c for c in df_sched.columns if 'Link' in c]
+    start = pd.to_datetime(df_sched['Início'], format="%d/%m/%Y", errors='coerce')
+    end = pd.to_datetime(df_sched['Fim'], format="%d/%m/%Y", errors='coerce')
+
+    links = []
+    for order, c in enumerate(link_cols):
+        col = df_sched[c]
+        col = col[col.map(lambda v: isinstance(v, str))]
+        vids = col.str.extract(VIDEO_ID_PATTERN, expand=False).dropna()
+        links.append(pd.DataFrame({'flight': vids.index, 'order': order, 'video_id': vids.values}))
+    flights = pd.concat(links, ignore_index=True) if links else pd.DataFrame(columns=['flight', 'order', 'video_id'])
+    flights['start'] = start.reindex(flights['flight']).values
+    flights['end'] = end.reindex(flights['flight']).values
+    return flights.dropna(subset=['start', 'end']).sort_values(['flight', 'order'], kind='stable')
+
+def _explode_ranges(start, end):
+    # Date-range explode without a Python loop: repeat each range once per day and add day offsets
+    start = np.asarray(start, dtype='datetime64[D]')
+    end = np.asarray(end, dtype='datetime64[D]')
+    n_days = ((end - start).astype(np.int64) + 1).clip(min=0)
+    rows = np.repeat(np.arange(len(n_days)), n_days)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(n_days) - n_days, n_days)
+    return rows, (start[rows] + offsets.astype('timedelta64[D]')).astype('datetime64[ns]')
+
+def explode_flights(flights):
+    """Distinct (day, video_id) activity pairs; per-day video order follows the schedule."""
+    rows, days = _explode_ranges(flights['start'], flights['end'])
+    pairs = pd.DataFrame({'day': days, 'video_id': flights['video_id'].to_numpy()[rows]})
+    return pairs.drop_duplicates(ignore_index=True)
+
+def expand_schedule(df_sched):
+    return explode_flights(schedule_flights(df_sched))
+
+def creative_indicators(df_analysis):
+    """0/1 tone/focus indicators per video_id, using the same substring rules as the report."""
+    df = df_analysis.drop_duplicates('video_id', keep='last').set_index('video_id')
+    tone = df['tom'].astype(str).str.lower() if 'tom' in df else pd.Series('', index=df.index)
+    focus = df['foco'].astype(str).str.lower() if 'foco' in df else pd.Series('', index=df.index)
+    return pd.DataFrame({
+        'emotional': tone.str.contains('emocional', regex=False),
+        'rational': tone.str.contains('racional', regex=False),
+        'product': focus.str.contains('produto', regex=False),
+        'brand': focus.str.contains('marca', regex=False) | focus.str.contains('brand', regex=False)
+    }, index=df.index).astype(np.int64)
+
+def compute_daily_mix(pairs, df_analysis):
+    indicators = creative_indicators(df_analysis)
+    flags = indicators.reindex(pairs['video_id'].to_numpy(), fill_value=0).to_numpy()
+    codes, days = pd.factorize(pairs['day'])
+    total = np.bincount(codes, minlength=len(days))
+    stats = {c: np.bincount(codes, weights=flags[:, j], minlength=len(days)) for j, c in enumerate(indicators.columns)}
+
+    order = np.argsort(codes, kind='stable')
+    vids = pairs['video_id'].to_numpy(dtype=object)[order]
+    ids = [",".join(chunk) for chunk in np.split(vids, np.cumsum(total)[:-1])] if len(days) else []
+
+    return pd.DataFrame({
+        'day': days,
+        'active_creatives_count': total,
+        'mix_emotional_pct': stats['emotional'] / total * 100,
+        'mix_rational_pct': stats['rational'] / total * 100,
+        'mix_product_pct': stats['product'] / total * 100,
+        'mix_brand_pct': stats['brand'] / total * 100,
+        'active_video_ids': ids
+    })
+
+def _flight_signatures(df_sched):
+    # One content hash + parsed date range per raw schedule row
+    return pd.DataFrame({
+        'signature': pd.util.hash_pandas_object(df_sched, index=False).to_numpy(),
+        'start': pd.to_datetime(df_sched['Início'], format="%d/%m/%Y", errors='coerce').to_numpy(),
+        'end': pd.to_datetime(df_sched['Fim'], format="%d/%m/%Y", errors='coerce').to_numpy()
+    })
+
+def _load_mix_state(state_dir):
+    paths = [state_dir / name for name in ('daily_mix.csv', 'flights.csv', 'indicators.csv')]
+    if not all(p.exists() for p in paths): return None
+    try:
+        mix = pd.read_csv(paths[0], parse_dates=['day'], dtype={'active_video_ids': str})
+        sigs = pd.read_csv(paths[1], parse_dates=['start', 'end'], dtype={'signature': np.uint64})
+        indicators = pd.read_csv(paths[2], dtype={'video_id': str}).set_index('video_id')
+    except Exception as e:
+        print(f"Ignoring unreadable mix state: {e}")
         return None
+    return mix, sigs, indicators
 
-    df_perf = pd.read_csv(performance_csv)
-    df_sched = pd.read_csv(schedule_csv)
-    df_analysis = pd.read_csv(analysis_csv)
+def _save_mix_state(state_dir, mix, sigs, indicators):
+    state_dir.mkdir(parents=True, exist_ok=True)
+    mix.to_csv(state_dir / 'daily_mix.csv', index=False)
+    sigs.to_csv(state_dir / 'flights.csv', index=False)
+    indicators.rename_axis('video_id').to_csv(state_dir / 'indicators.csv')
 
-    # 1. Parse Dates & Clean Data
+def update_daily_mix(df_sched, df_analysis, state_dir):
+    """Daily mix kept on disk and recomputed only for days touched since the last run.
+
+    A day is touched when a schedule row covering it was added, removed or edited,
+    or when the tone/focus classification of a video active on it changed.
+    """
+    state_dir = Path(state_dir)
+    sigs = _flight_signatures(df_sched)
+    indicators = creative_indicators(df_analysis)
+    state = _load_mix_state(state_dir)
+
+    if state is None:
+        df_mix = compute_daily_mix(expand_schedule(df_sched), df_analysis)
+        print(f"  Daily mix: full build ({len(df_mix)} days)")
+    else:
+        prev_mix, prev_sigs, prev_indicators = state
+        cur, prev = Counter(sigs['signature']), Counter(prev_sigs['signature'])
+        changed = list((cur - prev) + (prev - cur))
+        changed_rows = pd.concat([sigs, prev_sigs])
+        changed_rows = changed_rows[changed_rows['signature'].isin(changed)].dropna()
+        _, flight_days = _explode_ranges(changed_rows['start'], changed_rows['end'])
+
+        both = indicators.join(prev_indicators, how='outer', rsuffix='_prev').fillna(-1)
+        prev_cols = [f"{c}_prev" for c in indicators.columns]
+        moved = both.index[(both[indicators.columns].to_numpy() != both[prev_cols].to_numpy()).any(axis=1)]
+        video_days = np.array([], dtype='datetime64[ns]')
+        if len(moved):
+            active = prev_mix[['day']].assign(video_id=prev_mix['active_video_ids'].str.split(',')).explode('video_id')
+            video_days = active.loc[active['video_id'].isin(moved), 'day'].to_numpy(dtype='datetime64[ns]')
+
+        touched = pd.DatetimeIndex(np.unique(np.concatenate([flight_days, video_days])))
+        df_mix = prev_mix
+        if len(touched):
+            overlap = (sigs['start'] <= touched.max()) & (sigs['end'] >= touched.min())
+            pairs = explode_flights(schedule_flights(df_sched[overlap.to_numpy()]))
+            fresh = compute_daily_mix(pairs[pairs['day'].isin(touched)].reset_index(drop=True), df_analysis)
+            df_mix = pd.concat([prev_mix[~prev_mix['day'].isin(touched)], fresh], ignore_index=True)
+            df_mix = df_mix.sort_values('day', kind='stable', ignore_index=True)
+        print(f"  Daily mix: recomputed {len(touched)} touched days ({len(df_mix)} total)")
+        if not len(touched) and not changed and not len(moved):
+            return df_mix
+
+    _save_mix_state(state_dir, df_mix, sigs, indicators)
+    return df_mix
+
+def _day_numbers(pairs_day):
+    return np.asarray(pairs_day, dtype='datetime64[D]').astype(np.int64)
+
+def _weight_matrix(day_numbers, video_codes, weights, n_videos):
+    # Duplicate (day, video) entries are summed by the COO -> CSR conversion
+    if not len(day_numbers):
+        return sparse.csr_matrix((0, n_videos)), pd.DatetimeIndex([])
+    first = int(day_numbers.min())
+    n_days = int(day_numbers.max()) - first + 1
+    matrix = sparse.coo_matrix((weights, (day_numbers - first, video_codes)), shape=(n_days, n_videos)).tocsr()
+    return matrix, pd.date_range(pd.Timestamp(np.datetime64(first, 'D')), periods=n_days, freq='D')
+
+def schedule_weights(pairs):
+    """(day x video CSR matrix, days, video ids) from schedule activity pairs, every active creative weighing 1."""
+    codes, videos = pd.factorize(pairs['video_id'])
+    matrix, days = _weight_matrix(_day_numbers(pairs['day']), codes, np.ones(len(codes)), len(videos))
+    return matrix, days, np.asarray(videos, dtype=object)
+
+def _parse_unique(values, parse):
+    # Delivery files repeat a few thousand dates/links millions of times: parse each distinct value once
+    codes, uniques = pd.factorize(values)
+    parsed = parse(pd.Series(uniques, dtype=object)).reindex(range(len(uniques) + 1))  # code -1 (missing) -> NA
+    return parsed.to_numpy()[codes]
+
+def _parse_days(series):
+    days = pd.to_datetime(series, format=DELIVERY_DATE_FORMATS[0], errors='coerce')
+    for fmt in DELIVERY_DATE_FORMATS[1:]:
+        missing = days.isna()
+        if not missing.any(): break
+        days[missing] = pd.to_datetime(series[missing], format=fmt, errors='coerce')
+    return days
+
+def _parse_video_ids(series):
+    values = series.astype(str).str.strip()
+    extracted = values.str.extract(VIDEO_ID_PATTERN, expand=False)
+    return extracted.fillna(values.where(values.str.fullmatch(r'[0-9A-Za-z_-]{11}')))
+
+def load_delivery(delivery_csv, weight_column=None, chunksize=DELIVERY_CHUNK_ROWS):
+    """Streams a delivery CSV into a sparse day x video weight matrix.
+
+    The file needs a `day` column, a `video_id` (or link/URL) column and a weight
+    column: `weight_column`, else the first of DELIVERY_WEIGHT_COLUMNS present.
+    It is read in chunks, and each chunk is summed per (day, video) before it is
+    kept, so memory follows the number of distinct pairs rather than rows.
+    Returns (CSR matrix, days, video ids) with one row per calendar day.
+    """
+    header = list(pd.read_csv(delivery_csv, nrows=0).columns)
+    weight = weight_column or next((c for c in DELIVERY_WEIGHT_COLUMNS if c in header), None)
+    video = 'video_id' if 'video_id' in header else next(
+        (c for c in header if 'link' in c.lower() or 'url' in c.lower()), None)
+    if 'day' not in header or weight not in header or video is None:
+        raise ValueError(f"{delivery_csv} needs day, video_id/link and {weight_column or DELIVERY_WEIGHT_COLUMNS} columns")
+
+    vocabulary, parts, rows = {}, [], 0
+    for chunk in pd.read_csv(delivery_csv, usecols=['day', video, weight], dtype={'day': str, video: str},
+                             chunksize=chunksize):
+        rows += len(chunk)
+        days = _parse_unique(chunk['day'], _parse_days)
+        vids = _parse_unique(chunk[video], _parse_video_ids)
+        w = pd.to_numeric(chunk[weight], errors='coerce').to_numpy(dtype=np.float64)
+        ok = pd.notna(days) & pd.notna(vids) & (w > 0)
+        codes, uniques = pd.factorize(vids[ok])
+        lookup = np.array([vocabulary.setdefault(u, len(vocabulary)) for u in uniques], dtype=np.int64)
+        part = pd.DataFrame({'day': _day_numbers(days[ok]), 'video': lookup[codes], 'weight': w[ok]})
+        parts.append(part.groupby(['day', 'video'], sort=False)['weight'].sum().reset_index())
+    pairs = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['day', 'video', 'weight'])
+    matrix, days = _weight_matrix(pairs['day'].to_numpy(np.int64), pairs['video'].to_numpy(np.int64),
+                                  pairs['weight'].to_numpy(np.float64), len(vocabulary))
+    print(f"  Delivery: {rows} rows -> {matrix.nnz} creative-days weighted by {weight}")
+    return matrix, days, np.asarray(list(vocabulary), dtype=object)
+
+def scheduled_delivery(delivery, schedule):
+    """Delivery weights restricted to the scheduled flights.
+
+    Both arguments are (day x video matrix, days, video ids), from load_delivery and
+    schedule_weights. Each scheduled creative-day keeps its delivered spend or
+    impressions, or the schedule's weight of 1 when the delivery has none for it;
+    delivery outside the flights is dropped. Returns the same triple on the
+    schedule's days and videos.
+    """
+    d_matrix, d_days, d_videos = delivery
+    s_matrix, s_days, s_videos = schedule
+    pairs = s_matrix.tocoo()
+    weights = np.ones(pairs.nnz)
+    rows = pd.DatetimeIndex(d_days).get_indexer(pd.DatetimeIndex(s_days)[pairs.row])
+    cols = pd.Index(d_videos).get_indexer(s_videos[pairs.col])
+    ok = np.flatnonzero((rows >= 0) & (cols >= 0))
+    delivered = np.asarray(d_matrix[rows[ok], cols[ok]]).ravel() if len(ok) else np.zeros(0)
+    weights[ok[delivered > 0]] = delivered[delivered > 0]
+    matched = int((delivered > 0).sum())
+    print(f"  Delivery: {matched}/{pairs.nnz} scheduled creative-days delivered, "
+          f"{d_matrix.nnz - matched} delivered outside the schedule dropped")
+    matrix = sparse.csr_matrix((weights, (pairs.row, pairs.col)), shape=s_matrix.shape)
+    return matrix, s_days, s_videos
+
+def weighted_daily_mix(weights, df_analysis):
+    """Daily mix with each creative counted by its share of the day's delivery.
+
+    `weights` is (day x video matrix, days, video ids) from load_delivery or
+    schedule_weights; the mix is that matrix times the video x indicator matrix,
+    divided by the day's total weight. Returns the compute_daily_mix columns plus
+    `delivery_weight`, for days with any delivery.
+    """
+    matrix, days, videos = weights
+    indicators = creative_indicators(df_analysis)
+    flags = indicators.reindex(pd.Index(videos).astype(str), fill_value=0).to_numpy(dtype=np.float64)
+    total = np.asarray(matrix.sum(axis=1)).ravel()
+    active = np.flatnonzero(total > 0)
+    matrix, total = matrix[active], total[active]
+    share = (matrix @ flags) / total[:, None] * 100
+    ids = [",".join(videos[matrix.indices[a:b]]) for a, b in zip(matrix.indptr[:-1], matrix.indptr[1:])]
+    mix = pd.DataFrame({'day': days[active], 'active_creatives_count': np.diff(matrix.indptr)})
+    for j, c in enumerate(indicators.columns):
+        mix[f"mix_{c}_pct"] = share[:, j]
+    mix['active_video_ids'] = ids
+    mix['delivery_weight'] = total
+    return mix
+
+def load_performance(performance_csv):
+    df_perf = pd.read_csv(performance_csv)
     df_perf['day'] = pd.to_datetime(df_perf['day'])
-    if 'PerformanceMetric' in df_perf.columns and df_perf['PerformanceMetric'].dtype == 'object':
+    if 'PerformanceMetric' in df_perf.columns and not pd.api.types.is_numeric_dtype(df_perf['PerformanceMetric']):
         df_perf['PerformanceMetric'] = df_perf['PerformanceMetric'].str.rstrip('%').astype(float)
+    return df_perf
 
-    # 2. Build Daily Creative Map
-    daily_creatives = {}
-    
-    def get_vid(url):
-        if not isinstance(url, str): return None
-        m = re.search(r'(?:v=|\/)([0-9A-Za-z_-]{11})', url)
-        return m.group(1) if m else None
+def correlate_performance(performance_csv, schedule_csv, analysis_csv, output_csv, incremental=False, weights=None):
+    # analysis_csv may also be an in-memory DataFrame / AnalysisDataset; weights come from load_delivery
+    analysis_ready = not isinstance(analysis_csv, (str, os.PathLike)) or os.path.exists(analysis_csv)
+    schedule_ready = weights is not None or (schedule_csv and os.path.exists(schedule_csv))
+    if not (os.path.exists(performance_csv) and schedule_ready and analysis_ready):
+        print("Missing input files for correlation.")
+        return None
 
-    # Lookup for analysis attributes
-    creative_lookup = df_analysis.set_index('video_id').to_dict('index')
+    # 1. Parse Dates & Clean Data
+    df_perf = load_performance(performance_csv)
+    df_analysis = as_frame(analysis_csv)
 
-    link_cols = [c for c in df_sched.columns if 'Link' in c]
-    for _, row in df_sched.iterrows():
-        try:
-            start = pd.to_datetime(row['Início'], format="%d/%m/%Y")
-            end = pd.to_datetime(row['Fim'], format="%d/%m/%Y")
-        except: continue
-        
-        ids = []
-        for c in link_cols:
-            vid = get_vid(row.get(c))
-            if vid: ids.append(vid)
-        
-        curr = start
-        while curr <= end:
-            if curr not in daily_creatives: daily_creatives[curr] = set()
-            daily_creatives[curr].update(ids)
-            curr += timedelta(days=1)
-
-    # 3. Calculate Mix Stats
-    mix_rows = []
-    for date, ids in daily_creatives.items():
-        if not ids: continue
-        
-        stats = {'emotional': 0, 'rational': 0, 'product': 0, 'brand': 0, 'total': len(ids)}
-        active_list = list(ids)
-        
-        for vid in ids:
-            attrs = creative_lookup.get(vid, {})
-            tone = str(attrs.get('tom', '')).lower()
-            focus = str(attrs.get('foco', '')).lower()
-            
-            if 'emocional' in tone: stats['emotional'] += 1
-            if 'racional' in tone: stats['rational'] += 1
-            if 'produto' in focus: stats['product'] += 1
-            if 'marca' in focus or 'brand' in focus: stats['brand'] += 1
-            
-        mix_rows.append({
-            'day': date,
-            'active_creatives_count': stats['total'],
-            'mix_emotional_pct': (stats['emotional']/stats['total'])*100,
-            'mix_rational_pct': (stats['rational']/stats['total'])*100,
-            'mix_product_pct': (stats['product']/stats['total'])*100,
-            'mix_brand_pct': (stats['brand']/stats['total'])*100,
-            'active_video_ids': ",".join(active_list)
-        })
-
-    df_mix = pd.DataFrame(mix_rows)
+    # 2-3. Build Daily Creative Map (day x video activity pairs) and Mix Stats
+    if weights is not None:
+        if incremental: print("  Delivery weights given; --incremental does not apply")
+        df_mix = weighted_daily_mix(weights, df_analysis)
+    elif incremental:
+        df_mix = update_daily_mix(pd.read_csv(schedule_csv), df_analysis, Path(output_csv).parent / MIX_STATE_DIRNAME)
+    else:
+        df_mix = compute_daily_mix(expand_schedule(pd.read_csv(schedule_csv)), df_analysis)
+    df_mix['day'] = df_mix['day'].astype(df_perf['day'].dtype)
     final_df = pd.merge(df_perf, df_mix, on='day', how='inner')
     final_df.to_csv(output_csv, index=False)
     return final_df
 
 def get_portfolio_summary(analysis_csv):
-    df = pd.read_csv(analysis_csv)
+    df = as_frame(analysis_csv)
     return {
         "total_videos": len(df),
         "foco_distribution": df['foco'].value_counts(normalize=True).to_dict(),
@@ -127,35 +519,86 @@ def get_portfolio_summary(analysis_csv):
         "top_occasions": df['ocasiao_consumo'].value_counts().head(5).to_dict()
     }
 
-def get_top_bottom_insights(performance_mix_csv, analysis_csv, n=20):
-    df = pd.read_csv(performance_mix_csv)
-    df_meta = pd.read_csv(analysis_csv)
-    
-    df = df.sort_values('PerformanceMetric', ascending=False)
-    top = df.head(n)
-    bot = df.tail(n)
-    
-    # Video Net Score
-    def count_vids(dframe):
-        c = {}
-        for _, r in dframe.iterrows():
-            if pd.isna(r['active_video_ids']): continue
-            for v in r['active_video_ids'].split(','):
-                c[v] = c.get(v, 0) + 1
-        return c
-
-    top_c = count_vids(top)
-    bot_c = count_vids(bot)
-    all_v = set(top_c.keys()) | set(bot_c.keys())
-    
+def incidence_matrix(active_video_ids):
+    """Day x video 0/1 matrix from a series of comma-joined active_video_ids (one entry per day).
+
+    Returns (matrix, video_ids) with videos in first-appearance order.
+    """
+    ids = pd.Series(active_video_ids).reset_index(drop=True)
+    present = ids.notna().to_numpy()
+    values = ids[present].astype(str).tolist()
+    tokens = ",".join(values).split(',') if values else []
+    rows = np.repeat(np.flatnonzero(present), [v.count(',') + 1 for v in values])
+    codes, videos = pd.factorize(np.asarray(tokens, dtype=object))
+    flat = np.bincount(rows * len(videos) + codes, minlength=len(ids) * len(videos))
+    matrix = flat.reshape(len(ids), len(videos)).astype(np.float32)
+    return matrix, np.asarray(videos, dtype=object)
+
+def _rank_weights(order, n, n_days):
+    # +1 for the n best days, -1 for the n worst (a day in both nets to 0)
+    w = np.zeros(order.shape, dtype=np.float32)
+    np.put_along_axis(w, order[..., :n], 1, axis=-1)
+    bottom = np.take_along_axis(w, order[..., max(0, n_days - n):], axis=-1) - 1
+    np.put_along_axis(w, order[..., max(0, n_days - n):], bottom, axis=-1)
+    return w
+
+def permutation_pvalues(matrix, n, observed, n_permutations, batch_size=PERMUTATION_BATCH_SIZE, seed=None):
+    """Two-sided p-values for net scores under random assignment of KPI ranks to days.
+
+    Each batch scores `batch_size` shuffles with one (batch x days) @ (days x videos) product.
+    Without a seed, one is derived from the inputs, so the same data always gets
+    the same p-values (and the report prompts that embed them stay cacheable).
+    """
+    if seed is None:
+        h = hashlib.sha256(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+        h.update(np.ascontiguousarray(observed, dtype=np.float64).tobytes())
+        h.update(f"{matrix.shape}:{n}:{n_permutations}".encode())
+        seed = int.from_bytes(h.digest()[:8], 'little')
+    rng = np.random.default_rng(seed)
+    n_days = matrix.shape[0]
+    extreme = np.zeros(matrix.shape[1], dtype=np.int64)
+    target = np.abs(observed) - 1e-9
+    for done in range(0, n_permutations, batch_size):
+        size = min(batch_size, n_permutations - done)
+        order = np.argsort(rng.random((size, n_days)), axis=1)
+        extreme += (np.abs(_rank_weights(order, n, n_days) @ matrix) >= target).sum(axis=0)
+    return (extreme + 1) / (n_permutations + 1)
+
+def net_scores(kpi, matrix, videos, n=20, n_permutations=0, seed=None):
+    """Video Net Scores (appearances in the top n KPI days minus the bottom n) from a day x video matrix.
+
+    Returns the get_top_bottom_insights result plus `scores`, every video seen in
+    the top or bottom days, best first.
+    """
+    order = np.argsort(-np.asarray(kpi, dtype=np.float64), kind='stable')
+    matrix = matrix[order]
+    position = np.arange(len(order))
+    in_top, in_bottom = position < n, position >= len(order) - n
+    weights = _rank_weights(position, n, len(order))
+    net = weights @ matrix
+    seen = ((in_top | in_bottom).astype(np.float32) @ matrix) > 0
+    pvalues = permutation_pvalues(matrix, n, net, n_permutations, seed=seed) if n_permutations else None
+
     scores = []
-    for v in all_v:
-        net = top_c.get(v,0) - bot_c.get(v,0)
-        scores.append({'video_id': v, 'net_score': net})
-    
+    for j in np.flatnonzero(seen):
+        entry = {'video_id': videos[j], 'net_score': int(net[j])}
+        if pvalues is not None: entry['p_value'] = round(float(pvalues[j]), 4)
+        scores.append(entry)
     scores.sort(key=lambda x: x['net_score'], reverse=True)
-    
-    return {
+
+    result = {
         'top_performers': scores[:5],
-        'bottom_performers': scores[-5:]
+        'bottom_performers': scores[-5:],
+        'scores': scores
     }
+    if pvalues is not None: result['permutations'] = n_permutations
+    return result
+
+def get_top_bottom_insights(performance_mix_csv, analysis_csv, n=20, n_permutations=0, seed=None):
+    df = as_frame(performance_mix_csv)
+
+    df = df.sort_values('PerformanceMetric', ascending=False).reset_index(drop=True)
+    matrix, videos = incidence_matrix(df['active_video_ids'])
+    result = net_scores(df['PerformanceMetric'].to_numpy(), matrix, videos, n, n_permutations, seed)
+    del result['scores']
+    return result
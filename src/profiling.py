@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+
+PROFILE_JSON = "run_profile.json"
+PROFILE_PROM = "run_profile.prom"
+PERCENTILES = (50, 90, 99)
+
+def video_id_from_path(path):
+    # {video_id}.mp4 and {video_id}.proxy.mp4 both map to the video id
+    return Path(path).name.split('.')[0]
+
+class RunProfile:
+    """Thread-safe collector for stage/video timings, API latencies, retries, bytes and tokens.
+
+    One process-wide instance (`run_profile`) is fed from the pipeline's choke points
+    (call_with_backoff, downloads, uploads, generations) and written once per run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.stages = {}
+            self.videos = defaultdict(dict)
+            self.latencies = defaultdict(list)
+            self.errors = defaultdict(int)
+            self.retries = defaultdict(int)
+            self.bytes = defaultdict(int)
+            self.tokens = defaultdict(lambda: defaultdict(int))
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def video(self, video_id, step, seconds):
+        with self._lock:
+            steps = self.videos[video_id]
+            steps[step] = steps.get(step, 0.0) + seconds
+
+    def api_call(self, api, seconds, failed=False):
+        with self._lock:
+            self.latencies[api].append(seconds)
+            if failed: self.errors[api] += 1
+
+    def retry(self, api):
+        with self._lock:
+            self.retries[api] += 1
+
+    def add_bytes(self, direction, amount):
+        with self._lock:
+            self.bytes[direction] += int(amount or 0)
+
+    def add_usage(self, api, response):
+        # usage_metadata as returned by google.generativeai responses
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None: return
+        with self._lock:
+            counts = self.tokens[api]
+            counts["prompt"] += getattr(usage, "prompt_token_count", 0) or 0
+            counts["response"] += getattr(usage, "candidates_token_count", 0) or 0
+            counts["total"] += getattr(usage, "total_token_count", 0) or 0
+
+    def summary(self):
+        with self._lock:
+            apis = {}
+            for api in set(self.latencies) | set(self.retries):
+                values = np.asarray(self.latencies.get(api, []), dtype=float)
+                stats = {"calls": int(values.size), "errors": self.errors.get(api, 0),
+                         "retries": self.retries.get(api, 0)}
+                if values.size:
+                    stats["mean_s"] = round(float(values.mean()), 4)
+                    stats["max_s"] = round(float(values.max()), 4)
+                    for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                        stats[f"p{p}_s"] = round(float(v), 4)
+                apis[api] = stats
+            return {
+                "started_at": self.started,
+                "wall_s": round(time.time() - self.started, 3),
+                "stages_s": {k: round(v, 3) for k, v in self.stages.items()},
+                "bytes": dict(self.bytes),
+                "api": apis,
+                "tokens": {api: dict(c) for api, c in self.tokens.items()},
+                "videos": {vid: {k: round(v, 3) for k, v in steps.items()} for vid, steps in self.videos.items()}
+            }
+
+    def write(self, output_dir, labels=None):
+        """Writes run_profile.json and a Prometheus textfile (run_profile.prom) to output_dir."""
+        summary = self.summary()
+        os.makedirs(output_dir, exist_ok=True)
+        json_path = os.path.join(output_dir, PROFILE_JSON)
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        prom_path = os.path.join(output_dir, PROFILE_PROM)
+        tmp = f"{prom_path}.tmp"  # node_exporter may read the textfile at any time
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(_prometheus(summary, labels or {}))
+        os.replace(tmp, prom_path)
+        return json_path
+
+def _labels(base, **extra):
+    items = {**base, **extra}
+    if not items: return ""
+    escaped = {k: str(v).replace('\\', '\\\\').replace('"', '\\"') for k, v in items.items()}
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped.items()) + "}"
+
+def _prometheus(summary, base):
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        if not samples: return
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(base, **labels)} {value}")
+
+    metric("creative_run_seconds", "gauge", "Wall time of the run.", [({}, summary["wall_s"])])
+    metric("creative_stage_seconds", "gauge", "Wall time per pipeline stage.",
+           [({"stage": s}, v) for s, v in summary["stages_s"].items()])
+    metric("creative_videos_profiled", "gauge", "Videos with recorded timings.", [({}, len(summary["videos"]))])
+    metric("creative_bytes_total", "counter", "Bytes downloaded and uploaded.",
+           [({"direction": d}, v) for d, v in summary["bytes"].items()])
+    metric("creative_api_calls_total", "counter", "API call attempts.",
+           [({"api": a}, s["calls"]) for a, s in summary["api"].items()])
+    metric("creative_api_errors_total", "counter", "Failed API call attempts.",
+           [({"api": a}, s["errors"]) for a, s in summary["api"].items()])
+    metric("creative_api_retries_total", "counter", "Retried API calls.",
+           [({"api": a}, s["retries"]) for a, s in summary["api"].items()])
+    metric("creative_api_latency_seconds", "gauge", "API call latency.",
+           [({"api": a, "quantile": f"0.{p}"}, s[f"p{p}_s"])
+            for a, s in summary["api"].items() for p in PERCENTILES if f"p{p}_s" in s])
+    metric("creative_tokens_total", "counter", "Gemini tokens reported in usage_metadata.",
+           [({"api": a, "kind": k}, v) for a, counts in summary["tokens"].items() for k, v in counts.items()])
+    steps = defaultdict(list)
+    for timings in summary["videos"].values():
+        for step, v in timings.items(): steps[step].append(v)
+    metric("creative_video_step_seconds", "gauge", "Per-video time in each step.",
+           [({"step": s, "quantile": f"0.{p}"}, round(float(np.percentile(v, p)), 3))
+            for s, v in steps.items() for p in PERCENTILES])
+    return "\n".join(lines) + "\n"
+
+run_profile = RunProfile()
@@ -0,0 +1,115 @@
+import json
+import pandas as pd
+from .config import REPORT_TOKEN_BUDGET, REPORT_TEXT_MAX_CHARS, REPORT_TEXT_MIN_CHARS, DRIVER_REPORT_ROWS
+from .processing import MIX_COLUMNS
+
+KPI_COLUMN = "PerformanceMetric"
+DETAIL_FIELDS = ["foco", "tom", "cenario", "ocasiao_consumo", "ritual_sensorial", "variante_produto",
+                 "gancho_promocional", "abcd_score", "atencao", "branding", "conexao", "direcao",
+                 "analise_visual", "transcricao"]
+
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+def compact_json(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+
+def truncate_text(text, max_chars):
+    if not isinstance(text, str) or len(text) <= max_chars: return text
+    cut = text[:max_chars].rsplit(' ', 1)[0] or text[:max_chars]
+    return cut.rstrip(' ,;.') + "…"
+
+def _round(value, digits=3):
+    return None if pd.isna(value) else round(float(value), digits)
+
+def summarize_daily(correlation_data):
+    """Reduces the merged daily KPI x mix table to the aggregates the report needs."""
+    df = pd.DataFrame(correlation_data) if isinstance(correlation_data, dict) else correlation_data
+    if df is None or df.empty or KPI_COLUMN not in df: return {}
+
+    df = df.sort_values('day') if 'day' in df else df
+    kpi = pd.to_numeric(df[KPI_COLUMN], errors='coerce')
+    mix = [c for c in MIX_COLUMNS if c in df]
+    top = kpi >= kpi.quantile(0.75)
+    bottom = kpi <= kpi.quantile(0.25)
+
+    summary = {
+        "days": len(df),
+        "kpi": {stat: _round(getattr(kpi, stat)()) for stat in ("mean", "std", "min", "max")},
+        "correlation_with_kpi": {c: _round(df[c].corr(kpi)) for c in mix},
+        "mix_mean": {c: _round(df[c].mean()) for c in mix},
+        "mix_top_quartile_days": {c: _round(df.loc[top, c].mean()) for c in mix},
+        "mix_bottom_quartile_days": {c: _round(df.loc[bottom, c].mean()) for c in mix}
+    }
+    if 'day' in df:
+        days = pd.to_datetime(df['day'])
+        summary["period"] = [str(days.min().date()), str(days.max().date())]
+        monthly = kpi.groupby(days.dt.to_period('M').astype(str).to_numpy()).mean()
+        summary["kpi_monthly_mean"] = {month: _round(v) for month, v in monthly.items()}
+    if 'active_video_ids' in df:
+        counts = df['active_video_ids'].fillna('').astype(str).str.count(',') + df['active_video_ids'].notna()
+        summary["active_videos_per_day"] = {"mean": _round(counts.mean(), 1), "max": int(counts.max())}
+    return summary
+
+def summarize_drivers(drivers, rows=DRIVER_REPORT_ROWS):
+    """Top rows of the lagged driver table (src.drivers) as plain records."""
+    if drivers is None or len(drivers) == 0: return []
+    return [{"feature": r.feature, "lag_days": int(r.lag_days), "adstock": _round(r.adstock, 2),
+             "correlation": _round(r.correlation), "same_day_correlation": _round(r.same_day_correlation),
+             "videos": int(r.videos)}
+            for r in drivers.head(rows).itertuples()]
+
+def compact_detail(data, max_chars):
+    detail = {"video_id": data.get("video_id")}
+    for field in DETAIL_FIELDS:
+        if field in data: detail[field] = truncate_text(data[field], max_chars)
+    if "secondary_metrics" in data: detail["secondary_metrics"] = data["secondary_metrics"]
+    return detail
+
+def _fit_details(details, budget, max_chars, min_chars):
+    # Halve text fields until the details fit, then drop the least extreme videos
+    chars = max_chars
+    while True:
+        text = compact_json([compact_detail(d, chars) for d in details])
+        if estimate_tokens(text) <= budget or chars <= min_chars: break
+        chars = max(min_chars, chars // 2)
+    while details and estimate_tokens(text) > budget:
+        details = details[:-1]
+        text = compact_json([compact_detail(d, chars) for d in details])
+    return text, len(details), chars
+
+def build_prompt_data(portfolio_summary, correlation_data, insights_data, details, budget=REPORT_TOKEN_BUDGET,
+                      max_chars=REPORT_TEXT_MAX_CHARS, min_chars=REPORT_TEXT_MIN_CHARS, drivers=None):
+    """Serializes the report inputs compactly within an estimated token budget.
+
+    `details` is a list of per-video analyses, or {section: list} to serialize
+    several groups that share what is left of the budget; `drivers` is the lagged
+    driver table, whose top rows get their own section. Videos should be ordered
+    by importance (most extreme net scores first); when the budget is tight their
+    text fields shrink first, then trailing videos are dropped. Returns
+    {section: compact JSON string} and logs tokens per section.
+    """
+    groups = details if isinstance(details, dict) else {"details": details}
+    sections = {
+        "portfolio": compact_json(portfolio_summary),
+        "drivers": compact_json(summarize_daily(correlation_data)),
+        "insights": compact_json(insights_data)
+    }
+    if drivers is not None and len(drivers):
+        sections["attribute_drivers"] = compact_json(summarize_drivers(drivers))
+    remaining = budget - sum(estimate_tokens(s) for s in sections.values())
+    share = max(0, remaining) // max(1, len(groups))
+    trimmed = []
+    for name, group in groups.items():
+        sections[name], kept, chars = _fit_details(list(group), share, max_chars, min_chars)
+        if kept < len(group) or chars < max_chars:
+            trimmed.append(f"{name} {kept}/{len(group)} videos, texts <= {chars} chars")
+
+    total = 0
+    for name, text in sections.items():
+        total += estimate_tokens(text)
+        print(f"  Prompt section {name}: ~{estimate_tokens(text)} tokens")
+    if trimmed:
+        print(f"  Details trimmed to fit budget: {'; '.join(trimmed)}")
+    print(f"  Prompt data: ~{total} tokens (budget {budget})")
+    return sections
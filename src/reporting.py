@@ -1,154 +1,256 @@
 import os
 import json
 import base64
-import google.generativeai as genai
-from .config import GEMINI_MODEL_NAME
-
-def generate_html_report(insights_data, portfolio_summary, correlation_data, video_metrics, analysis_dir, viz_dir, output_file, api_key):
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel(GEMINI_MODEL_NAME)
-    
-    # 1. Load Detailed Analysis
-    top_ids = [x['video_id'] for x in insights_data.get('top_performers', [])]
-    bot_ids = [x['video_id'] for x in insights_data.get('bottom_performers', [])]
-    
-    details = []
-    for vid in set(top_ids + bot_ids):
-        path = os.path.join(analysis_dir, f"{vid}.json")
-        if os.path.exists(path):
-            try:
-                data = json.load(open(path, encoding='utf-8'))
-                data['video_id'] = vid
-                metrics = video_metrics.get(vid, {})
-                data['secondary_metrics'] = {
-                    'views': metrics.get('view_count', 'N/A'),
-                    'likes': metrics.get('like_count', 'N/A'),
-                    'title': metrics.get('title', 'Unknown')
-                }
-                details.append(data)
-            except: continue
-
-    # 2. Load Heatmap Image (Base64)
-    img_path = os.path.join(viz_dir, "heatmap.png")
-    img_b64 = ""
-    if os.path.exists(img_path):
-        with open(img_path, "rb") as f:
-            img_b64 = base64.b64encode(f.read()).decode('utf-8')
-
-    # 3. Construct Robust Prompt with Specific CSS
-    prompt = f"""
-Você é um Consultor Sênior de Estratégia de Marca (nível MBB/Big 4).
-Seu objetivo é criar um RELATÓRIO ESTRATÉGICO PROFUNDO sobre a eficácia dos criativos.
-O relatório deve ser analítico, detalhado e visualmente limpo.
-
---- DADOS DE ENTRADA ---
-1. PANORAMA DO PORTFÓLIO: {json.dumps(portfolio_summary, ensure_ascii=False, indent=2)}
-2. DRIVERS DE PERFORMANCE (Correlação com KPI): {json.dumps(correlation_data, ensure_ascii=False, indent=2)}
-3. COMPARAÇÃO TOP vs BOTTOM: {json.dumps(insights_data, ensure_ascii=False, indent=2)}
-4. DETALHAMENTO DOS VÍDEOS: {json.dumps(details, ensure_ascii=False, indent=2)}
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from .config import (GEMINI_MODEL_NAME, REPORT_TOKEN_BUDGET, REPORT_CACHE_DIR, REPORT_WORKERS, GEMINI_RETRIES,
+                     TEMPLATE_DIR)
+from .report_prompt import build_prompt_data, summarize_daily, summarize_drivers, estimate_tokens
+from .profiling import run_profile
+from .throttling import call_with_backoff
+from .visualization import load_charts
+
+MIX_LABELS = {
+    'mix_emotional_pct': "Tom Emocional",
+    'mix_rational_pct': "Tom Racional",
+    'mix_product_pct': "Foco em Produto",
+    'mix_brand_pct': "Foco em Marca"
+}
+
+NARRATIVE_PREAMBLE = """
+Você é um Consultor Sênior de Estratégia de Marca (nível MBB/Big 4) escrevendo UMA seção de um relatório
+estratégico sobre a eficácia dos criativos. Seja analítico, específico e cite os números dos dados.
 
 --- REGRAS DE ANONIMIZAÇÃO ---
 - NUNCA use nomes de marcas específicas ou nomes de métricas proprietárias. Use "A Marca" e "KPI de Negócio".
 
---- ESTRUTURA HTML E CSS (OBRIGATÓRIO) ---
-Use este CSS no <head> para garantir a formatação Premium:
-<style>
-    :root {{ --brand-primary: #F40009; --dark-gray: #2b2b2b; --light-gray: #f4f4f4; --white: #ffffff; }}
-    body {{ font-family: 'Helvetica Neue', Helvetica, Arial, sans-serif; color: var(--dark-gray); line-height: 1.6; margin: 0; padding: 0; background-color: var(--light-gray); }}
-    .container {{ max-width: 1000px; margin: 0 auto; background: var(--white); padding: 40px; box-shadow: 0 4px 15px rgba(0,0,0,0.1); }}
-    header {{ border-bottom: 3px solid var(--brand-primary); padding-bottom: 20px; margin-bottom: 40px; display: flex; justify-content: space-between; align-items: center; }}
-    .logo {{ font-weight: bold; font-size: 24px; color: var(--brand-primary); text-transform: uppercase; letter-spacing: 2px; }}
-    .confidential {{ font-size: 12px; color: #999; text-transform: uppercase; }}
-    h1 {{ font-size: 32px; margin-bottom: 10px; font-weight: 700; }}
-    h2 {{ font-size: 22px; color: var(--brand-primary); margin-top: 30px; border-left: 4px solid var(--brand-primary); padding-left: 15px; text-transform: uppercase; }}
-    h3 {{ font-size: 18px; color: var(--dark-gray); margin-top: 20px; }}
-    .executive-summary {{ background-color: #fff8f8; padding: 20px; border-radius: 8px; margin-bottom: 30px; }}
-    .grid {{ display: grid; grid-template-columns: 1fr 1fr; gap: 20px; margin-bottom: 30px; }}
-    .stat-card {{ background: var(--light-gray); padding: 20px; border-radius: 8px; text-align: center; }}
-    .stat-value {{ display: block; font-size: 28px; font-weight: bold; color: var(--brand-primary); }}
-    .stat-label {{ font-size: 14px; text-transform: uppercase; color: #666; }}
-    .insight-box {{ background: #fff; border: 1px solid #ddd; padding: 15px; border-radius: 8px; margin-top: 10px; }}
-    .champion {{ border-top: 4px solid #28a745; }}
-    .underperformer {{ border-top: 4px solid #dc3545; }}
-    .badge {{ display: inline-block; padding: 4px 12px; border-radius: 20px; font-size: 12px; font-weight: bold; text-transform: uppercase; margin-bottom: 10px; }}
-    .badge-brand {{ background: #fee2e2; color: #991b1b; }}
-    .badge-product {{ background: #e0f2fe; color: #075985; }}
-    table {{ width: 100%; border-collapse: collapse; margin: 20px 0; background-color: #fff; box-shadow: 0 4px 8px rgba(0,0,0,0.1); border-radius: 8px; overflow: hidden; }}
-    th {{ background-color: var(--brand-primary); color: white; padding: 15px; text-align: left; }}
-    td {{ padding: 15px; border-bottom: 1px solid #eee; font-size: 14px; }}
-    .technical-appendix {{ margin-top: 50px; border-top: 1px solid #ddd; padding-top: 20px; }}
-</style>
-
---- CONTEÚDO DO RELATÓRIO ---
-1. **Header**: Logo "Strategic Insights" e texto "Strictly Confidential".
-2. **Título**: "Relatório Final: Eficácia de Criativos".
-3. **Executive Summary**: Resumo estratégico de alto impacto.
-4. **Grid de Estatísticas**: 4 cartões com dados reais (Mix de Marca, Tom, etc).
-5. **Diagnóstico da Estratégia de Marca**: Análise da distribuição e evolução.
-6. **Champions (Por que funcionam?)**: Análise + Tabela detalhada.
-7. **Underperformers (Onde falharam?)**: Análise + Tabela detalhada.
-8. **Recomendações Estratégicas**: Próximos passos.
-9. **Apêndices**:
-   - Apêndice A: [IMAGEM_HEATMAP_PLACEHOLDER]
-   - Apêndice B: [TECHNICAL_APPENDIX_PLACEHOLDER]
-
-Gere APENAS o código HTML completo.
+--- FORMATO ---
+Responda APENAS com o conteúdo HTML da seção (<p>, <ul>, <li>, <strong>, <h3>), sem <html>, <head>, <style>,
+<h1>/<h2> ou tabelas; o layout, os títulos e as tabelas já são gerados pelo sistema.
 """
 
-    print("Gerando Relatório Premium com Gemini...")
-    response = model.generate_content(prompt)
-    html_content = response.text.strip()
-    
-    if html_content.startswith("```html"):
-        html_content = html_content.replace("```html", "").replace("```", "")
-    
-    # 4. Inject Image
-    if img_b64:
-        image_tag = f'<div style="text-align:center; margin: 30px 0;"><img src="data:image/png;base64,{img_b64}" style="max-width:100%; border-radius: 8px; box-shadow: 0 4px 12px rgba(0,0,0,0.1);"><p style="font-size:12px; color:#666;">Figura 1: Matriz de Correlação - Drivers de KPI de Negócio</p></div>'
-        
-        if "[IMAGEM_HEATMAP_PLACEHOLDER]" in html_content:
-            html_content = html_content.replace("[IMAGEM_HEATMAP_PLACEHOLDER]", image_tag)
-        else:
-            if "</body>" in html_content:
-                html_content = html_content.replace("</body>", f"{image_tag}</body>")
-            else:
-                html_content += image_tag
-
-    # 5. Inject Hardcoded Technical Appendix (Styled to match the report)
-    technical_appendix = """
-    <section class="technical-appendix">
-        <h2>Apêndice B: Metodologia Técnica</h2>
-        <p>Este relatório utiliza uma pipeline automatizada de IA para auditar, analisar e otimizar criativos de vídeo, conectando atributos qualitativos (Framework ABCD) com métricas de negócio.</p>
-        
-        <h3>1. Aquisição & Métricas</h3>
-        <p>Os vídeos são processados e metadados públicos (visualizações, likes) são coletados para fornecer contexto de alcance ("Métricas de Vaidade"), embora o sucesso seja definido pelo impacto no KPI de negócio.</p>
-
-        <h3>2. Análise Multimodal (Gemini AI)</h3>
-        <p>Cada vídeo é processado frame-a-frame por IA para extrair dados estruturados:
-           <ul>
-             <li><strong>ABCD Framework:</strong> Atenção, Branding, Conexão, Direção.</li>
-             <li><strong>Classificação:</strong> Tom (Racional/Emocional) e Foco (Produto/Marca).</li>
-           </ul>
-        </p>
-
-        <h3>3. Cálculo do Mix Criativo (Creative Mix)</h3>
-        <p>Para correlacionar criativos com a performance diária, calculamos o "Mix Diário". Não analisamos anúncios isolados, mas a média ponderada dos atributos ativos no dia.
-           <br><em>Exemplo:</em> Se no Dia X, 80% dos anúncios ativos eram "Emocionais", o dia recebe esse score, que é então correlacionado estatisticamente com o KPI de Negócio para identificar drivers de sucesso.</p>
-
-        <h3>4. Atribuição & Correlação</h3>
-        <p>O sistema cruza a série temporal do Mix Criativo com o KPI para identificar correlações estatísticas e o <strong>Net Score</strong> de cada vídeo (frequência em dias de alta performance vs. baixa performance).</p>
-    </section>
+# section -> (instructions, prompt data sections it needs)
+NARRATIVE_SECTIONS = {
+    "executive_summary": (
+        "Escreva o Executive Summary: um resumo estratégico de alto impacto (2-3 parágrafos) com o veredito "
+        "sobre a estratégia criativa e os principais drivers do KPI de Negócio.",
+        ["portfolio", "drivers", "attribute_drivers", "insights"]),
+    "champions": (
+        "Escreva a análise dos Champions (Por que funcionam?): explique, com base no framework ABCD e nos "
+        "atributos de cada vídeo, o que os criativos de maior Net Score têm em comum.",
+        ["insights", "champions"]),
+    "underperformers": (
+        "Escreva a análise dos Underperformers (Onde falharam?): explique, com base no framework ABCD e nos "
+        "atributos de cada vídeo, o que os criativos de menor Net Score têm em comum.",
+        ["insights", "underperformers"]),
+    "recommendations": (
+        "Escreva as Recomendações Estratégicas: próximos passos concretos e priorizados para o mix criativo, "
+        "com hipóteses a testar.",
+        ["portfolio", "drivers", "attribute_drivers", "insights"]),
+}
+
+DATA_LABELS = {
+    "portfolio": "PANORAMA DO PORTFÓLIO",
+    "drivers": "DRIVERS DE PERFORMANCE (Resumo diário do Mix vs KPI)",
+    "attribute_drivers": "DRIVERS POR ATRIBUTO (correlação com o KPI após lag_days dias, com adstock; maiores |r| primeiro)",
+    "insights": "COMPARAÇÃO TOP vs BOTTOM (Net Score)",
+    "champions": "DETALHAMENTO DOS CHAMPIONS (textos resumidos)",
+    "underperformers": "DETALHAMENTO DOS UNDERPERFORMERS (textos resumidos)"
+}
+
+UNAVAILABLE_SECTION = "<p><em>Seção indisponível nesta execução.</em></p>"
+
+def _load_details(performers, video_metrics, analysis_dir):
+    details = []
+    for entry in performers:
+        vid = entry['video_id']
+        path = os.path.join(analysis_dir, f"{vid}.json")
+        if not os.path.exists(path): continue
+        try:
+            data = json.load(open(path, encoding='utf-8'))
+        except ValueError:
+            continue
+        data['video_id'] = vid
+        metrics = video_metrics.get(vid, {})
+        data['secondary_metrics'] = {
+            'views': metrics.get('view_count', 'N/A'),
+            'likes': metrics.get('like_count', 'N/A'),
+            'title': metrics.get('title', 'Unknown')
+        }
+        details.append(data)
+    return details
+
+def section_prompts(data):
+    prompts = {}
+    for name, (instructions, inputs) in NARRATIVE_SECTIONS.items():
+        blocks = "\n".join(f"{DATA_LABELS[key]}: {data[key]}" for key in inputs if key in data)
+        prompts[name] = f"{NARRATIVE_PREAMBLE}\n--- TAREFA ---\n{instructions}\n\n--- DADOS ---\n{blocks}\n"
+    return prompts
+
+def _section_key(prompt, model_name):
+    return hashlib.sha256(f"{model_name}\n{prompt}".encode('utf-8')).hexdigest()
+
+def _clean_fragment(text):
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    return text.strip()
+
+def generate_narratives(prompts, backend=None, api_key=None, cache_dir=REPORT_CACHE_DIR, workers=REPORT_WORKERS,
+                        model_name=GEMINI_MODEL_NAME, limiters=None):
+    """Generates {section: HTML fragment} concurrently, reusing fragments cached under a hash of their prompt.
+
+    The backend is only created when at least one section misses the cache;
+    `limiters` (rpm, tpm) charges the calls to a shared API budget.
     """
-    
-    if "[TECHNICAL_APPENDIX_PLACEHOLDER]" in html_content:
-        html_content = html_content.replace("[TECHNICAL_APPENDIX_PLACEHOLDER]", technical_appendix)
-    else:
-        if "</body>" in html_content:
-            html_content = html_content.replace("</body>", f"{technical_appendix}</body>")
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    narratives, missing = {}, {}
+    for name, prompt in prompts.items():
+        path = cache_dir / f"{_section_key(prompt, model_name)}.html"
+        if path.exists():
+            narratives[name] = path.read_text(encoding='utf-8')
         else:
-            html_content += technical_appendix
-            
+            missing[name] = (prompt, path)
+    print(f"  Narrative sections: {len(narratives)} cached, {len(missing)} to generate")
+    if not missing: return narratives
+
+    if backend is None:
+        from .analysis import GeminiBackend
+        backend = GeminiBackend(api_key, model_name=model_name)
+
+    def call(prompt):
+        if limiters:
+            limiters[0].acquire()
+            limiters[1].acquire(estimate_tokens(prompt))
+        return backend.generate_content(prompt)
+
+    def generate(prompt, path):
+        response = call_with_backoff(lambda: call(prompt), retries=GEMINI_RETRIES, name="report")
+        run_profile.add_usage("report", response)
+        text = _clean_fragment(response.text)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(text, encoding='utf-8')
+        os.replace(tmp, path)
+        return text
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(missing)))) as pool:
+        futures = {name: pool.submit(generate, prompt, path) for name, (prompt, path) in missing.items()}
+        for name, future in futures.items():
+            try:
+                narratives[name] = future.result()
+            except Exception as e:
+                print(f"  Section {name} failed: {e}")
+                narratives[name] = UNAVAILABLE_SECTION
+    return narratives
+
+def _pct(value, signed=False):
+    if value is None: return "—"
+    return f"{value * 100:+.1f}%" if signed else f"{value * 100:.1f}%"
+
+def _share(pct):
+    # mix_*_pct columns are 0-100; the pct filter expects a 0-1 share
+    return None if pct is None else pct / 100
+
+def _dominant(distribution):
+    if not distribution: return "—", None
+    label = max(distribution, key=distribution.get)
+    return label, distribution[label]
+
+def _table_rows(performers, details):
+    by_id = {d['video_id']: d for d in details}
+    rows = []
+    for entry in performers:
+        data = by_id.get(entry['video_id'], {})
+        scores = data.get('abcd_score') or {}
+        rows.append({
+            'video_id': entry['video_id'],
+            'title': data.get('secondary_metrics', {}).get('title', ''),
+            'net_score': entry.get('net_score'),
+            'p_value': entry.get('p_value'),
+            'foco': data.get('foco', '—'),
+            'tom': data.get('tom', '—'),
+            'abcd': "/".join(str(scores.get(k, '—')) for k in ("attention", "branding", "connection", "direction")),
+            'views': data.get('secondary_metrics', {}).get('views', 'N/A')
+        })
+    return rows
+
+def _chart_markup(path):
+    if path.endswith(".svg"):
+        svg = open(path, encoding='utf-8').read()
+        return svg[svg.find("<svg"):]
+    with open(path, "rb") as f:
+        data = base64.b64encode(f.read()).decode('utf-8')
+    mime = "image/" + os.path.splitext(path)[1].lstrip(".")
+    return f'<img src="data:{mime};base64,{data}" style="max-width:100%;">'
+
+def render_report(context):
+    env = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=select_autoescape(["html", "j2"]))
+    env.filters['pct'] = _pct
+    return env.get_template("report.html.j2").render(**context)
+
+def generate_html_report(insights_data, portfolio_summary, correlation_data, video_metrics, analysis_dir, viz_dir, output_file, api_key,
+                         token_budget=REPORT_TOKEN_BUDGET, backend=None, cache_dir=REPORT_CACHE_DIR, limiters=None,
+                         drivers=None):
+    # 1. Load Detailed Analysis (most extreme net scores first, so a tight budget trims the least telling videos)
+    top = insights_data.get('top_performers', [])
+    bottom = insights_data.get('bottom_performers', [])
+    champions = _load_details(sorted(top, key=lambda x: -x.get('net_score', 0)), video_metrics, analysis_dir)
+    underperformers = _load_details(sorted(bottom, key=lambda x: x.get('net_score', 0)), video_metrics, analysis_dir)
+
+    # 2. Narrative sections only; the layout is rendered locally
+    data = build_prompt_data(portfolio_summary, correlation_data, insights_data,
+                             {"champions": champions, "underperformers": underperformers}, budget=token_budget,
+                             drivers=drivers)
+    print("Gerando seções narrativas com Gemini...")
+    narratives = generate_narratives(section_prompts(data), backend=backend, api_key=api_key, cache_dir=cache_dir,
+                                     limiters=limiters)
+
+    # 3. Charts (SVG inlined, raster formats as base64)
+    charts = [{'caption': caption, 'markup': _chart_markup(path)} for _, caption, path in load_charts(viz_dir)]
+
+    # 4. Render
+    daily = summarize_daily(correlation_data)
+    foco, foco_share = _dominant(portfolio_summary.get('foco_distribution'))
+    tom, tom_share = _dominant(portfolio_summary.get('tom_distribution'))
+    scenario, _ = _dominant(portfolio_summary.get('top_scenarios'))
+    distributions = [(f"Foco: {k}", v) for k, v in portfolio_summary.get('foco_distribution', {}).items()]
+    distributions += [(f"Tom: {k}", v) for k, v in portfolio_summary.get('tom_distribution', {}).items()]
+
+    html_content = render_report({
+        'title': "Relatório Final: Eficácia de Criativos",
+        'narratives': narratives,
+        'stats': [
+            {'label': "Vídeos Analisados", 'value': portfolio_summary.get('total_videos', 0)},
+            {'label': f"Mix de Foco: {foco}", 'value': _pct(foco_share)},
+            {'label': f"Tom Predominante: {tom}", 'value': _pct(tom_share)},
+            {'label': "Cenário Principal", 'value': scenario}
+        ],
+        'drivers': {
+            'days': daily.get('days'),
+            'period': daily.get('period'),
+            'rows': [{'label': MIX_LABELS.get(c, c), 'correlation': corr, 'mean': _share(daily['mix_mean'].get(c)),
+                      'top': _share(daily['mix_top_quartile_days'].get(c)),
+                      'bottom': _share(daily['mix_bottom_quartile_days'].get(c))}
+                     for c, corr in daily.get('correlation_with_kpi', {}).items()]
+        },
+        'attribute_drivers': summarize_drivers(drivers),
+        'distributions': distributions,
+        'groups': [
+            {'name': "champions", 'heading': "Champions (Por que funcionam?)", 'css': "champion",
+             'rows': _table_rows(top, champions)},
+            {'name': "underperformers", 'heading': "Underperformers (Onde falharam?)", 'css': "underperformer",
+             'rows': _table_rows(bottom, underperformers)}
+        ],
+        'has_pvalues': 'permutations' in insights_data,
+        'charts': charts
+    })
+
     with open(output_file, 'w', encoding='utf-8') as f:
         f.write(html_content)
-    
+
     print(f"Relatório Premium gerado em: {output_file}")
+    return UNAVAILABLE_SECTION not in narratives.values()
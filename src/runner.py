@@ -0,0 +1,137 @@
+import csv
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from .acquisition import download_video
+from .analysis import GeminiBackend, make_limiters
+from .cache import AnalysisCache
+from .config import (OUTPUT_DIR, DOWNLOAD_WORKERS, DOWNLOAD_HOST_RATE, ANALYSIS_WORKERS, GEMINI_RPM, GEMINI_TPM,
+                     INSIGHT_PERMUTATIONS)
+from .file_registry import FileRegistry
+from .profiling import run_profile
+from . import stages
+from .stages import read_urls
+from .throttling import HostRateLimiter
+
+def brand_dirs(brand, output_dir=OUTPUT_DIR):
+    brand_dir = Path(output_dir) / brand
+    dirs = {"brand": brand_dir, "videos": brand_dir / "videos", "analysis": brand_dir / "analysis",
+            "viz": brand_dir / "visualizations"}
+    for key in ("videos", "analysis", "viz"):
+        dirs[key].mkdir(parents=True, exist_ok=True)
+    return dirs
+
+def load_manifest(path):
+    """Reads a brand manifest CSV (brand, urls, perf, sched, optional delivery); paths are relative to the manifest."""
+    base = Path(path).parent
+    entries = []
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            brand = (row.get("brand") or "").strip()
+            if not brand or brand.startswith("#"): continue
+            entry = {"brand": brand}
+            for key in ("urls", "perf", "sched", "delivery"):
+                value = (row.get(key) or "").strip()
+                entry[key] = str(base / value) if value else None
+            if not entry["urls"]:
+                raise ValueError(f"Manifest row for {brand} has no urls file")
+            entries.append(entry)
+    return entries
+
+def finish_brand(brand_dir, api_key, perf=None, sched=None, delivery=None, permutations=INSIGHT_PERMUTATIONS,
+                 incremental=False, backend=None, limiters=None, force=False):
+    """Aggregation, correlation, charts and report for one brand whose analyses are on disk.
+
+    Each step is a stage from src.stages and skips itself when its inputs are unchanged.
+    """
+    print("\n[3/5] Aggregating results and calculating correlations...")
+    stages.aggregate(brand_dir, force=force)
+    stages.correlate(brand_dir, perf=perf, sched=sched, delivery=delivery, incremental=incremental, force=force)
+
+    print("\n[4/5] Generating visualizations...")
+    stages.visualize(brand_dir, force=force)
+
+    print("\n[5/5] Synthesizing final report...")
+    return stages.report(brand_dir, api_key=api_key, permutations=permutations, force=force, backend=backend,
+                         limiters=limiters)
+
+def run_brands(entries, api_key=None, backend=None, cookies_path=None, download_workers=DOWNLOAD_WORKERS,
+               analysis_workers=ANALYSIS_WORKERS, host_rate=DOWNLOAD_HOST_RATE, rpm=GEMINI_RPM, tpm=GEMINI_TPM,
+               permutations=INSIGHT_PERMUTATIONS, incremental=False, proxy=False, batch=False,
+               output_dir=OUTPUT_DIR, downloader=download_video, batch_backend=None, force=False):
+    """Runs every manifest brand in one process over shared caches and API budget.
+
+    Each brand goes through stages.acquire, fingerprint and analyze, so stages.json
+    and the skip rules are the single-brand ones. Downloads of all brands share one
+    per-host limiter; analyses share one Gemini backend, file registry, cache and
+    RPM/TPM limiters (report narratives included). A brand's analysis runs while the
+    next brand downloads. The run profile (timings, API usage) is written to
+    output_dir. Returns {brand: report path or None}.
+    """
+    run_profile.reset()
+    brands = {}
+    for entry in entries:
+        dirs = brand_dirs(entry["brand"], output_dir)
+        urls_file = str(Path(entry["urls"]).resolve())
+        brands[entry["brand"]] = {"entry": entry, "dirs": dirs, "urls_file": urls_file}
+    # Brands whose acquire and analyze are fresh go straight to their (self-skipping) output stages
+    pending = {}
+    for name, b in brands.items():
+        paths, state = stages.brand_paths(b["dirs"]["brand"]), stages.StageState(b["dirs"]["brand"])
+        acquired = state.fresh("acquire", stages.stage_signature([b["urls_file"]]), [paths["metrics"]])
+        analyzed = state.fresh("analyze", stages.analysis_signature(paths, b["urls_file"], proxy), [paths["analysis"]])
+        if acquired and analyzed and not force:
+            print(f"--- {name}: downloads and analyses up to date ---")
+        else:
+            pending[name] = b
+    limiters = make_limiters(rpm, tpm)
+    if pending:
+        print(f"--- Running {len(pending)} brands ({sum(len(read_urls(b['urls_file'])) for b in pending.values())} videos) ---")
+        backend = backend or GeminiBackend(api_key)
+        cache = AnalysisCache()
+        registry = FileRegistry(backend)
+        registry.sweep()
+        registry.start_sweeper()
+        limiter = HostRateLimiter(host_rate)
+
+        def analyze(name, brand_dir, urls_file):
+            print(f"\n[2/5] Running Gemini Multimodal Analysis for {name}...")
+            stages.analyze(brand_dir, urls_file, api_key, workers=analysis_workers, proxy=proxy, batch=batch,
+                           force=force, backend=backend, cache=cache, registry=registry, limiters=limiters,
+                           batch_backend=batch_backend)
+
+        # One analysis thread: brand i is analyzed while brand i + 1 downloads
+        with ThreadPoolExecutor(max_workers=1) as analysis_pool:
+            analyses = {}
+            for name, b in pending.items():
+                print(f"\n[1/5] Downloading videos and fetching metrics for {name}...")
+                try:
+                    stages.acquire(b["dirs"]["brand"], b["urls_file"], cookies_path=cookies_path,
+                                   workers=download_workers, force=force, limiter=limiter, downloader=downloader)
+                    stages.fingerprint(b["dirs"]["brand"], b["urls_file"], force=force)
+                except Exception as e:
+                    print(f"  [{name}] acquire failed: {e}")  # analyze still runs over what was downloaded
+                analyses[name] = analysis_pool.submit(analyze, name, b["dirs"]["brand"], b["urls_file"])
+            for name, future in analyses.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"  [{name}] analyze failed: {e}")
+        registry.stop()
+        cache.report()
+        cache.evict()
+
+    # 3-6. Per-brand outputs (each stage skips itself when fresh); a failing brand does not stop the others
+    results = {}
+    for name, b in brands.items():
+        print(f"\n--- Outputs for {name} ---")
+        try:
+            results[name] = str(finish_brand(b["dirs"]["brand"], api_key, perf=b["entry"]["perf"],
+                                             sched=b["entry"]["sched"], delivery=b["entry"].get("delivery"),
+                                             permutations=permutations,
+                                             incremental=incremental, backend=backend, limiters=limiters,
+                                             force=force))
+        except Exception as e:
+            print(f"  {name} failed: {e}")
+            results[name] = None
+    print(f"Run profile: {run_profile.write(output_dir)}")
+    return {entry["brand"]: results.get(entry["brand"]) for entry in entries}
@@ -0,0 +1,340 @@
+"""Local HTTP/JSON query service over one brand's outputs (`orchestrator.py serve`).
+
+master_analysis, the daily mix, metrics, drivers and duplicates are loaded once
+into a BrandIndex: the mix sorted by day with prefix sums (any date range is two
+lookups), a day x video incidence matrix with per-video prefix sums, and a video
+mask per attribute value. Summary, insight and filter queries are answered from
+memory. Every SERVICE_RELOAD_INTERVAL seconds a request checks the outputs' size
+and mtime and rebuilds the index when they changed; concurrent requests keep
+using the previous one meanwhile. Standard library only, bound to localhost by default.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+import numpy as np
+import pandas as pd
+from .config import SERVICE_HOST, SERVICE_PORT, SERVICE_RELOAD_INTERVAL, SERVICE_MAX_ROWS, DRIVER_REPORT_ROWS
+from .dataset import AnalysisDataset, TEXT_COLUMNS
+from .fingerprint import load_duplicates
+from .processing import MIX_COLUMNS, get_portfolio_summary, incidence_matrix, net_scores
+from .stages import StageError, brand_paths, stage_signature
+
+PERIOD_PARAMS = {"start", "end"}
+UNFILTERED_COLUMNS = {"video_id", "url", "duplicate_similarity"}
+
+class QueryError(Exception):
+    """A query cannot be answered: bad parameter (400) or unknown video/path (404)."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def _one(params, name, default=None, cast=str):
+    values = params.get(name)
+    if not values: return default
+    try:
+        return cast(values[-1])
+    except ValueError:
+        raise QueryError(f"invalid {name}: {values[-1]!r}")
+
+def _number(x, digits=4):
+    return None if x is None or not np.isfinite(x) else round(float(x), digits)
+
+def _records(df):
+    # NaN -> null, timestamps -> ISO dates, numpy scalars -> JSON numbers
+    return json.loads(df.to_json(orient="records", date_format="iso", force_ascii=False))
+
+def _sources(brand_dir):
+    p = brand_paths(brand_dir)
+    return [p["master"], p["mix"], p["drivers"], p["metrics"], p["duplicates"]]
+
+class BrandIndex:
+    """One brand's outputs in memory, with the indexes the queries use."""
+
+    def __init__(self, brand_dir):
+        p = brand_paths(brand_dir)
+        if not p["master"].exists():
+            raise StageError("serve needs master_analysis.parquet; run `aggregate` first")
+        self.brand = p["brand"].name
+        self.loaded_at = time.time()
+        self.dataset = AnalysisDataset.load(p["master"], p["mix"])
+        analysis = self.dataset.analysis.drop_duplicates('video_id', keep='last')
+        self.source_rows = analysis.index  # rows of dataset.analysis, for its lazily loaded text columns
+        self.analysis = analysis.astype({c: object for c in analysis.select_dtypes("category")}).reset_index(drop=True)
+        self.video_ids = pd.Index(self.analysis['video_id'].astype(str))
+        self.metrics = json.loads(p["metrics"].read_text(encoding='utf-8')) if p["metrics"].exists() else {}
+        self.drivers = pd.read_csv(p["drivers"]) if p["drivers"].exists() else None
+        self.duplicates = load_duplicates(p["duplicates"])
+
+        # Attribute index: column -> value -> mask over analysis rows
+        self.attributes = {}
+        for column in self.analysis.columns:
+            if column in UNFILTERED_COLUMNS or column.startswith("score_"): continue
+            codes, values = pd.factorize(self.analysis[column].astype("string").str.strip())
+            self.attributes[column] = {str(v): codes == k for k, v in enumerate(values) if v != ""}
+
+        # Date index: mix rows by day with prefix sums of the KPI and mix columns
+        mix = self.dataset.mix
+        if mix is None or mix.empty:
+            mix = pd.DataFrame({"day": pd.to_datetime([]), "PerformanceMetric": [], "active_video_ids": []})
+        self.mix = mix.sort_values("day").reset_index(drop=True)
+        self.days = self.mix["day"].to_numpy(dtype="datetime64[ns]")
+        self.kpi = self.mix["PerformanceMetric"].to_numpy(dtype=np.float64)
+        self.mix_columns = ["PerformanceMetric", "active_creatives_count"] + MIX_COLUMNS + ["delivery_weight"]
+        self.mix_columns = [c for c in self.mix_columns if c in self.mix]
+        values = self.mix[self.mix_columns].to_numpy(dtype=np.float64)
+        self.mix_sums = np.vstack([np.zeros((1, values.shape[1])), np.nancumsum(values, axis=0)])
+        self.mix_counts = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(~np.isnan(values), axis=0)])
+
+        # Video index: day x video incidence, its prefix sums and the analysis row of each column
+        self.matrix, self.mix_videos = incidence_matrix(self.mix["active_video_ids"])
+        self.mix_videos = self.mix_videos.astype(str)
+        self.active_sums = np.vstack([np.zeros((1, self.matrix.shape[1]), np.int32),
+                                      np.cumsum(self.matrix, axis=0, dtype=np.int32)])
+        self.rows_of_columns = self.video_ids.get_indexer(self.mix_videos)
+
+    def period(self, params):
+        """(lo, hi) mix rows between start and end (inclusive ISO dates)."""
+        bounds = []
+        for name, side, default in (("start", "left", 0), ("end", "right", len(self.days))):
+            value = _one(params, name)
+            if value is None:
+                bounds.append(default)
+                continue
+            try:
+                day = np.datetime64(pd.Timestamp(value).normalize(), "ns")
+            except ValueError:
+                raise QueryError(f"invalid {name}: {value!r} (use YYYY-MM-DD)")
+            bounds.append(int(np.searchsorted(self.days, day, side=side)))
+        return bounds[0], max(bounds)
+
+    def days_active(self, lo, hi):
+        """Days each analysis row was active in mix rows lo:hi."""
+        counts = np.zeros(len(self.analysis), dtype=np.int64)
+        known = self.rows_of_columns >= 0
+        counts[self.rows_of_columns[known]] = (self.active_sums[hi] - self.active_sums[lo])[known]
+        return counts
+
+    def video_mask(self, params, reserved=()):
+        """Analysis rows matching every attribute filter (repeat a parameter to OR values),
+        and active in the period when start/end are given."""
+        mask = np.ones(len(self.analysis), dtype=bool)
+        for name, values in params.items():
+            if name in reserved or name in PERIOD_PARAMS: continue
+            if name not in self.attributes:
+                raise QueryError(f"unknown filter {name!r}; filterable: {', '.join(sorted(self.attributes))}")
+            index = self.attributes[name]
+            mask &= np.logical_or.reduce([index.get(v.strip(), np.zeros_like(mask)) for v in values])
+        if PERIOD_PARAMS & set(params):
+            mask &= self.days_active(*self.period(params)) > 0
+        return mask
+
+    def _period_stats(self, lo, hi):
+        sums, counts = self.mix_sums[hi] - self.mix_sums[lo], self.mix_counts[hi] - self.mix_counts[lo]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+        return {
+            "start": str(self.days[lo])[:10] if hi > lo else None,
+            "end": str(self.days[hi - 1])[:10] if hi > lo else None,
+            "days": hi - lo,
+            "means": {c: _number(m) for c, m in zip(self.mix_columns, means)}
+        }
+
+    def health(self, params):
+        return {
+            "brand": self.brand,
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded_at)),
+            "videos": len(self.analysis),
+            "days": len(self.days),
+            "period": self._period_stats(0, len(self.days)),
+            "filters": {name: sorted(index) for name, index in self.attributes.items() if len(index) <= 50},
+            "duplicates": len(self.duplicates),
+            "drivers": 0 if self.drivers is None else len(self.drivers)
+        }
+
+    def summary(self, params):
+        """Portfolio summary of the matching videos plus the KPI/mix means of the period."""
+        mask = self.video_mask(params)
+        return {
+            "filters": {k: v for k, v in params.items() if k not in PERIOD_PARAMS},
+            "portfolio": get_portfolio_summary(self.analysis[mask]),
+            "period": self._period_stats(*self.period(params))
+        }
+
+    def insights(self, params):
+        """Net Scores over the period's top/bottom KPI days, optionally for the matching videos only.
+
+        With attribute filters, `attribute` adds their summed Net Score and the share
+        of active creatives that match on the top vs the bottom days.
+        """
+        reserved = {"n", "permutations", "seed", "limit"}
+        n = _one(params, "n", 20, int)
+        permutations = _one(params, "permutations", 0, int)
+        lo, hi = self.period(params)
+        if n < 1 or permutations < 0: raise QueryError("n must be >= 1 and permutations >= 0")
+        matrix, kpi = self.matrix[lo:hi], self.kpi[lo:hi]
+        filtered = set(params) - reserved - PERIOD_PARAMS
+        columns = np.ones(len(self.mix_videos), dtype=bool)
+        if filtered:
+            rows = self.video_mask({k: v for k, v in params.items() if k in filtered})
+            columns = (self.rows_of_columns >= 0) & rows[np.maximum(self.rows_of_columns, 0)]
+        result = net_scores(kpi, matrix[:, columns], self.mix_videos[columns], n, permutations,
+                            seed=_one(params, "seed", None, int))
+        result["scores"] = result["scores"][:_one(params, "limit", 50, int)]
+        result["period"] = self._period_stats(lo, hi)
+        if filtered:
+            order = np.argsort(-kpi, kind='stable')
+            active = matrix.sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                share = matrix[:, columns].sum(axis=1) / active
+            top, bottom = order[:n], order[max(0, len(order) - n):]
+            weights = np.zeros(len(order))
+            weights[top] += 1
+            weights[bottom] -= 1
+            result["attribute"] = {
+                "filters": {k: params[k] for k in sorted(filtered)},
+                "videos": int(columns.sum()),
+                "net_score": int(weights @ matrix[:, columns].sum(axis=1)),
+                "top_days_share": _number(np.nanmean(share[top])) if len(top) else None,
+                "bottom_days_share": _number(np.nanmean(share[bottom])) if len(bottom) else None
+            }
+        return result
+
+    def videos(self, params):
+        """Matching videos with their attributes, metrics and days active in the period."""
+        reserved = {"limit", "sort"}
+        limit = min(_one(params, "limit", 100, int), SERVICE_MAX_ROWS)
+        mask = self.video_mask(params, reserved)
+        rows = self.analysis[mask].copy()
+        rows["days_active"] = self.days_active(*self.period(params))[mask]
+        for field in ("title", "view_count", "like_count", "comment_count"):
+            rows[field] = [self.metrics.get(vid, {}).get(field) for vid in rows["video_id"].astype(str)]
+        sort = _one(params, "sort", "video_id")
+        if sort.lstrip("-") not in rows:
+            raise QueryError(f"unknown sort column {sort!r}")
+        rows = rows.sort_values(sort.lstrip("-"), ascending=not sort.startswith("-"), kind="stable")
+        return {"total": len(rows), "videos": _records(rows.head(limit))}
+
+    def video(self, video_id):
+        """One video: attributes (with the long texts), metrics, activity and duplicate links."""
+        row = self.video_ids.get_indexer([video_id])[0]
+        column = np.flatnonzero(self.mix_videos == video_id)
+        if row < 0 and not len(column):
+            raise QueryError(f"unknown video {video_id!r}", status=404)
+        body = {"video_id": video_id, "metrics": self.metrics.get(video_id, {})}
+        if row >= 0:
+            attributes = _records(self.analysis.iloc[[row]])[0]
+            for text in TEXT_COLUMNS:
+                value = self.dataset.text(text).loc[self.source_rows[row]]
+                attributes[text] = None if pd.isna(value) else str(value)
+            body["attributes"] = attributes
+        active = np.flatnonzero(self.matrix[:, column[0]]) if len(column) else []
+        body["days_active"] = len(active)
+        body["first_day"] = str(self.days[active[0]])[:10] if len(active) else None
+        body["last_day"] = str(self.days[active[-1]])[:10] if len(active) else None
+        body["canonical"] = self.duplicates.get(video_id)
+        body["duplicates"] = sorted(vid for vid, d in self.duplicates.items() if d["canonical_video_id"] == video_id)
+        return body
+
+    def mix_rows(self, params):
+        """Daily KPI and mix rows of the period (without the active video lists)."""
+        lo, hi = self.period(params)
+        limit = min(_one(params, "limit", SERVICE_MAX_ROWS, int), SERVICE_MAX_ROWS)
+        rows = self.mix.iloc[lo:min(hi, lo + limit)].drop(columns=["active_video_ids"])
+        rows = rows.assign(day=rows["day"].dt.strftime("%Y-%m-%d"))
+        return {"total": hi - lo, "truncated": hi - lo > limit, "days": _records(rows)}
+
+    def driver_rows(self, params):
+        """Ranked attribute drivers, optionally for one attribute or kind (share/score)."""
+        if self.drivers is None: return {"drivers": []}
+        rows = self.drivers
+        for name in ("attribute", "kind"):
+            value = _one(params, name)
+            if value is not None: rows = rows[rows[name] == value]
+        return {"drivers": _records(rows.head(min(_one(params, "limit", DRIVER_REPORT_ROWS, int), SERVICE_MAX_ROWS)))}
+
+ROUTES = {"/health": BrandIndex.health, "/summary": BrandIndex.summary, "/insights": BrandIndex.insights,
+          "/videos": BrandIndex.videos, "/mix": BrandIndex.mix_rows, "/drivers": BrandIndex.driver_rows}
+
+class QueryService:
+    """Holds the current BrandIndex and swaps in a rebuilt one when the brand outputs change."""
+
+    def __init__(self, brand_dir, reload_interval=SERVICE_RELOAD_INTERVAL):
+        self.brand_dir = brand_dir
+        self.reload_interval = reload_interval
+        self.index = BrandIndex(brand_dir)
+        self.signature = stage_signature(_sources(brand_dir))
+        self.checked = time.monotonic()
+        self._lock = threading.Lock()
+
+    def current(self):
+        # One request at a time checks for changes; the others keep the index they have
+        if time.monotonic() - self.checked < self.reload_interval or not self._lock.acquire(blocking=False):
+            return self.index
+        try:
+            self.checked = time.monotonic()
+            signature = stage_signature(_sources(self.brand_dir))
+            if signature != self.signature:
+                start = time.perf_counter()
+                self.index = BrandIndex(self.brand_dir)
+                self.signature = signature
+                print(f"  Reloaded {self.index.brand} outputs in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            print(f"  Reload failed, serving the previous data: {e}")
+        finally:
+            self._lock.release()
+        return self.index
+
+    def query(self, path, params):
+        index = self.current()
+        if path.startswith("/videos/"):
+            return index.video(unquote(path[len("/videos/"):]))
+        if path not in ROUTES:
+            raise QueryError(f"unknown path {path!r}; try {', '.join(ROUTES)} or /videos/<video_id>", status=404)
+        return ROUTES[path](index, params)
+
+class QueryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        start = time.perf_counter()
+        url = urlsplit(self.path)
+        try:
+            status, body = 200, self.server.service.query(url.path.rstrip("/") or "/health", parse_qs(url.query))
+        except QueryError as e:
+            status, body = e.status, {"error": str(e)}
+        except Exception as e:
+            status, body = 500, {"error": f"{type(e).__name__}: {e}"}
+        payload = json.dumps(body, ensure_ascii=False, default=str).encode('utf-8')
+        elapsed = (time.perf_counter() - start) * 1000
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("X-Elapsed-Ms", f"{elapsed:.2f}")
+        self.end_headers()
+        self.wfile.write(payload)
+        print(f"  {self.command} {self.path} -> {status} ({elapsed:.1f} ms)")
+
+    def log_message(self, format, *args):
+        pass  # do_GET prints one line per request with its timing
+
+def make_server(brand_dir, host=SERVICE_HOST, port=SERVICE_PORT, reload_interval=SERVICE_RELOAD_INTERVAL):
+    """ThreadingHTTPServer answering queries for one brand (port 0 picks a free port)."""
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.daemon_threads = True
+    server.service = QueryService(brand_dir, reload_interval)
+    return server
+
+def serve(brand_dir, host=SERVICE_HOST, port=SERVICE_PORT, reload_interval=SERVICE_RELOAD_INTERVAL):
+    """Serves until interrupted (Ctrl+C)."""
+    server = make_server(brand_dir, host, port, reload_interval)
+    index = server.service.index
+    print(f"Serving {index.brand} ({len(index.analysis)} videos, {len(index.days)} days) "
+          f"on http://{server.server_address[0]}:{server.server_address[1]}")
+    print(f"  Endpoints: {', '.join(ROUTES)}, /videos/<video_id>")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
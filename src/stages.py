@@ -0,0 +1,403 @@
+"""Independently runnable pipeline stages that skip themselves when their inputs are unchanged.
+
+Each stage hashes the size and mtime of its input files (plus the parameters that
+shape its output) and compares them with its last complete run, recorded in
+{brand_dir}/stages.json. Heavy dependencies (yt_dlp, google.generativeai, matplotlib,
+jinja2) are imported inside the stage that needs them.
+"""
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from .config import (STAGE_STATE_NAME, DOWNLOAD_WORKERS, ANALYSIS_WORKERS, INSIGHT_PERMUTATIONS,
+                     GEMINI_MODEL_NAME, ANALYSIS_SYSTEM_PROMPT, REPORT_TOKEN_BUDGET, VIDEO_INDEX_NAME,
+                     CHART_MANIFEST_NAME, TEMPLATE_DIR, MASTER_COLUMNS, DRIVER_ATTRIBUTES, DRIVER_MAX_LAG,
+                     DRIVER_ADSTOCK_DECAYS, DUPLICATES_NAME, FINGERPRINT_INDEX_NAME, FINGERPRINT_WORKERS,
+                     FINGERPRINT_FPS, FINGERPRINT_FRAME_MAX_BITS, FINGERPRINT_VIDEO_THRESHOLD,
+                     FINGERPRINT_AUDIO_THRESHOLD)
+from .profiling import run_profile
+from .video_store import VideoStore, get_video_id
+
+STAGES = ["acquire", "fingerprint", "analyze", "aggregate", "correlate", "visualize", "report"]
+
+class StageError(Exception):
+    """A stage cannot run: a required input or setting is missing."""
+
+def read_urls(path):
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+def brand_paths(brand_dir):
+    brand_dir = Path(brand_dir)
+    return {"brand": brand_dir, "videos": brand_dir / "videos", "analysis": brand_dir / "analysis",
+            "viz": brand_dir / "visualizations", "duplicates": brand_dir / DUPLICATES_NAME, "master": brand_dir / "master_analysis.parquet",
+            "master_csv": brand_dir / "master_analysis.csv",
+            "mix": brand_dir / "creative_mix_performance.csv", "drivers": brand_dir / "creative_drivers.csv",
+            "metrics": brand_dir / "metrics.json",
+            "report": brand_dir / "final_report.html"}
+
+def _stat(path, pattern=None):
+    path = Path(path)
+    if path.is_dir():
+        return sorted((e.name, e.stat().st_size, e.stat().st_mtime_ns) for e in os.scandir(path)
+                      if e.is_file() and fnmatch.fnmatch(e.name, pattern or "*"))
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+def stage_signature(inputs, **params):
+    """sha256 over (size, mtime) of each input and the stage parameters.
+
+    `inputs` holds file paths or (directory, glob) pairs; missing inputs hash as
+    absent, so creating them later invalidates the stage.
+    """
+    h = hashlib.sha256()
+    for item in inputs:
+        path, pattern = item if isinstance(item, tuple) else (item, None)
+        h.update(json.dumps([str(path), _stat(path, pattern)]).encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+class StageState:
+    """Signature and parameters of each stage's last run, saved in {brand_dir}/stages.json."""
+
+    def __init__(self, brand_dir):
+        self.path = Path(brand_dir) / STAGE_STATE_NAME
+        try:
+            self.data = json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            self.data = {}
+
+    def params(self, stage):
+        return self.data.get(stage, {}).get("params", {})
+
+    def fresh(self, stage, signature, outputs=()):
+        return self.data.get(stage, {}).get("signature") == signature and all(Path(p).exists() for p in outputs)
+
+    def record(self, stage, signature, **params):
+        # signature=None keeps the parameters (e.g. --urls) but leaves the stage stale
+        self.data[stage] = {"signature": signature, "params": params, "finished_at": time.time()}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self.data, indent=2), encoding='utf-8')
+        os.replace(tmp, self.path)
+
+def _skip(state, stage, signature, outputs, force):
+    if force or not state.fresh(stage, signature, outputs): return False
+    print(f"  {stage}: inputs unchanged, skipping (--force to rerun)")
+    return True
+
+def _urls_file(urls_file, state):
+    urls_file = urls_file or state.params("acquire").get("urls") or state.params("analyze").get("urls")
+    if not urls_file:
+        raise StageError("no --urls given and none recorded for this brand")
+    return str(Path(urls_file).resolve())
+
+def _require(path, stage, producer):
+    if not Path(path).exists():
+        raise StageError(f"{stage} needs {Path(path).name}; run `{producer}` first")
+
+def analysis_signature(p, urls_file, proxy):
+    # What `analyze` records once every URL has an analysis (src.runner records the same). It covers the
+    # analysis JSONs too, so it is taken after they are written and a deleted or edited JSON reruns the stage
+    prompt = hashlib.sha256(ANALYSIS_SYSTEM_PROMPT.encode()).hexdigest()
+    return stage_signature([urls_file, p["videos"] / VIDEO_INDEX_NAME, p["duplicates"], (p["analysis"], "*.json")],
+                           proxy=proxy, model=GEMINI_MODEL_NAME, prompt=prompt)
+
+def _downloaded(p, urls):
+    """{url: path} of the URLs with a complete download."""
+    store = VideoStore.open(p["videos"])
+    video_paths = {}
+    for url in urls:
+        path = store.get(get_video_id(url) or "")
+        if path: video_paths[url] = path
+    return video_paths
+
+def _analyzed_ids(analysis_dir):
+    # Videos with their own Gemini analysis (not one inherited from a near-duplicate)
+    ids = set()
+    for path in Path(analysis_dir).glob("*.json"):
+        try:
+            metadata = json.loads(path.read_text(encoding='utf-8')).get("metadata", {})
+        except ValueError:
+            continue
+        if not metadata.get("canonical_video_id"): ids.add(path.stem)
+    return ids
+
+def acquire(brand_dir, urls_file=None, cookies_path=None, workers=DOWNLOAD_WORKERS, force=False, limiter=None,
+            downloader=None):
+    """Downloads the brand's videos and fetches their metrics. Returns the metrics.json path.
+
+    The stage is only recorded as complete when every URL downloaded, so failed
+    downloads are retried on the next run. `limiter` (a HostRateLimiter) and
+    `downloader` let several brands share one download budget (src.runner).
+    """
+    from .acquisition import download_video, download_videos, fetch_metrics
+    p, state = brand_paths(brand_dir), StageState(brand_dir)
+    urls_file = _urls_file(urls_file, state)
+    signature = stage_signature([urls_file])
+    if _skip(state, "acquire", signature, [p["metrics"]], force): return p["metrics"]
+
+    urls = read_urls(urls_file)
+    with run_profile.stage("metrics"):
+        fetch_metrics(urls, output_file=p["metrics"])
+    with run_profile.stage("download"):
+        video_paths, statuses = download_videos(urls, p["videos"], cookies_path=cookies_path, workers=workers,
+                                                downloader=downloader or download_video, limiter=limiter)
+    for url, status in statuses.items():
+        print(f"  - {url}: {status if url in video_paths else f'FAILED ({status})'}")
+    state.record("acquire", signature if len(video_paths) == len(urls) else None, urls=urls_file)
+    return p["metrics"]
+
+def fingerprint(brand_dir, urls_file=None, workers=FINGERPRINT_WORKERS, force=False):
+    """Fingerprints the downloads and links near-duplicates to a canonical creative. Returns duplicates.csv.
+
+    `analyze` then copies the canonical's analysis to each duplicate instead of
+    calling Gemini. Creatives that already have their own analysis are preferred
+    as canonicals. Without ffmpeg nothing is written and the stage stays stale.
+    """
+    p, state = brand_paths(brand_dir), StageState(brand_dir)
+    urls_file = _urls_file(urls_file, state)
+    signature = stage_signature([urls_file, p["videos"] / VIDEO_INDEX_NAME], fps=FINGERPRINT_FPS,
+                                max_bits=FINGERPRINT_FRAME_MAX_BITS, video=FINGERPRINT_VIDEO_THRESHOLD,
+                                audio=FINGERPRINT_AUDIO_THRESHOLD)
+    if _skip(state, "fingerprint", signature, [p["duplicates"]], force): return p["duplicates"]
+
+    from .fingerprint import FingerprintIndex, find_duplicates, write_duplicates
+    video_paths = {Path(path).stem: path for path in _downloaded(p, read_urls(urls_file)).values()}
+    with run_profile.stage("fingerprint"):
+        fingerprints = FingerprintIndex(p["videos"] / FINGERPRINT_INDEX_NAME).update(video_paths, workers=workers)
+        if fingerprints is None:
+            state.record("fingerprint", None, urls=urls_file)
+            return None
+        duplicates = find_duplicates(fingerprints, preferred=_analyzed_ids(p["analysis"]))
+        write_duplicates(duplicates, p["duplicates"])
+    canonicals = {row["canonical_video_id"] for row in duplicates.values()}
+    print(f"  {len(duplicates)} near-duplicates of {len(canonicals)} creatives among {len(video_paths)} videos")
+    state.record("fingerprint", signature, urls=urls_file)
+    return p["duplicates"]
+
+def analyze(brand_dir, urls_file=None, api_key=None, workers=ANALYSIS_WORKERS, proxy=False, batch=False,
+            force=False, backend=None, cache=None, registry=None, limiters=None, batch_backend=None):
+    """Analyzes the downloaded videos with Gemini. Returns the analysis directory.
+
+    A backend, cache and file registry are created when not given (and then
+    stopped/evicted here); videos that were not downloaded are reported and leave
+    the stage stale.
+    """
+    p, state = brand_paths(brand_dir), StageState(brand_dir)
+    urls_file = _urls_file(urls_file, state)
+    signature = analysis_signature(p, urls_file, proxy)
+    if _skip(state, "analyze", signature, [p["analysis"]], force): return p["analysis"]
+    if backend is None and not api_key:
+        raise StageError("GEMINI_API_KEY not found in environment.")
+
+    from .analysis import GeminiBackend, analyze_videos
+    from .batch import GeminiBatchBackend, run_batch_analysis
+    from .cache import AnalysisCache
+    from .file_registry import FileRegistry
+    from .fingerprint import inherit_analyses, load_duplicates, split_duplicate_jobs
+    urls = read_urls(urls_file)
+    video_paths = _downloaded(p, urls)
+    if len(video_paths) < len(urls):
+        print(f"  {len(urls) - len(video_paths)} videos not downloaded; run `acquire` to retry them")
+
+    upload_paths = video_paths
+    if proxy:
+        from .transcoding import transcode_videos
+        with run_profile.stage("transcode"):
+            upload_paths = transcode_videos(video_paths, report_csv=p["brand"] / "proxy_report.csv")
+
+    owned = registry is None
+    backend = backend or GeminiBackend(api_key)
+    cache = cache or AnalysisCache()
+    if owned:
+        registry = FileRegistry(backend)
+        registry.sweep()
+        registry.start_sweeper()
+    p["analysis"].mkdir(parents=True, exist_ok=True)
+    jobs = [(upload_paths[url], url, p["analysis"] / f"{Path(path).stem}.json") for url, path in video_paths.items()]
+    duplicates = load_duplicates(p["duplicates"])
+    todo, inherited = split_duplicate_jobs(jobs, duplicates)
+    with run_profile.stage("analysis"):
+        if batch:
+            run_batch_analysis(todo, backend, batch_backend or GeminiBatchBackend(api_key), cache=cache,
+                               registry=registry, workers=workers)
+        else:
+            analyze_videos(todo, backend=backend, workers=workers, cache=cache, registry=registry, limiters=limiters)
+        inherit_analyses(inherited, duplicates)
+    if owned:
+        registry.stop()
+        cache.report()
+        cache.evict()
+    complete = len(video_paths) == len(urls) and all(Path(job[2]).exists() for job in jobs)
+    state.record("analyze", analysis_signature(p, urls_file, proxy) if complete else None, urls=urls_file)
+    return p["analysis"]
+
+def stream(brand_dir, urls_file=None, api_key=None, cookies_path=None, download_workers=DOWNLOAD_WORKERS,
+           analysis_workers=ANALYSIS_WORKERS, proxy=False, force=False):
+    """acquire + analyze with download, upload and analysis overlapped per video (--stream).
+
+    With ffmpeg, downloads are fingerprinted as they arrive and near-duplicates of
+    a video already streamed inherit its analysis (see fingerprint.DuplicateFilter);
+    the links are written to duplicates.csv.
+    """
+    p, state = brand_paths(brand_dir), StageState(brand_dir)
+    urls_file = _urls_file(urls_file, state)
+    acquired = stage_signature([urls_file])
+    if (not force and state.fresh("acquire", acquired, [p["metrics"]])
+            and state.fresh("analyze", analysis_signature(p, urls_file, proxy), [p["analysis"]])):
+        print("  acquire/analyze: inputs unchanged, skipping (--force to rerun)")
+        return p["analysis"]
+    if not api_key:
+        raise StageError("GEMINI_API_KEY not found in environment.")
+
+    from concurrent.futures import ThreadPoolExecutor
+    from .acquisition import fetch_metrics
+    from .analysis import GeminiBackend
+    from .cache import AnalysisCache
+    from .file_registry import FileRegistry
+    from .fingerprint import DuplicateFilter, FingerprintIndex, write_duplicates
+    from .pipeline import run_streaming_pipeline
+    urls = read_urls(urls_file)
+    duplicate_filter = None
+    if shutil.which("ffmpeg"):
+        duplicate_filter = DuplicateFilter(FingerprintIndex(p["videos"] / FINGERPRINT_INDEX_NAME))
+    else:
+        print("  ffmpeg not found; skipping near-duplicate detection.")
+    cache, backend = AnalysisCache(), GeminiBackend(api_key)
+    registry = FileRegistry(backend)
+    registry.sweep()
+    registry.start_sweeper()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        metrics_future = pool.submit(fetch_metrics, urls, output_file=p["metrics"])
+        with run_profile.stage("stream"):
+            video_paths, _, _ = run_streaming_pipeline(
+                urls, p["videos"], p["analysis"], backend=backend, registry=registry,
+                cookies_path=cookies_path, download_workers=download_workers, analysis_workers=analysis_workers,
+                cache=cache, transcode=proxy, duplicate_filter=duplicate_filter)
+        metrics_future.result()
+    if duplicate_filter is not None:
+        duplicate_filter.index.save()
+        write_duplicates(duplicate_filter.duplicates, p["duplicates"])
+    registry.stop()
+    cache.report()
+    cache.evict()
+    downloaded = len(video_paths) == len(urls)
+    state.record("acquire", acquired if downloaded else None, urls=urls_file)
+    analyzed = downloaded and all((p["analysis"] / f"{get_video_id(url)}.json").exists() for url in urls)
+    state.record("analyze", analysis_signature(p, urls_file, proxy) if analyzed else None, urls=urls_file)
+    return p["analysis"]
+
+def aggregate(brand_dir, force=False):
+    """Brings master_analysis.parquet (and its CSV export) up to date with the analysis JSONs."""
+    p, state = brand_paths(brand_dir), StageState(brand_dir)
+    signature = stage_signature([(p["analysis"], "*.json")], columns=MASTER_COLUMNS)
+    if _skip(state, "aggregate", signature, [p["master"], p["master_csv"]], force): return p["master"]
+
+    from .processing import aggregate_results
+    with run_profile.stage("aggregate"):
+        master = aggregate_results(p["analysis"], p["master"], export_csv=p["master_csv"])
+    if master: state.record("aggregate", signature)
+    return master
+
+def correlate(brand_dir, perf=None, sched=None, delivery=None, incremental=False, force=False):
+    """Daily creative mix joined to the KPI, plus the lagged driver table (creative_drivers.csv).
+
+    `delivery` (spend/impressions per creative-day) weights the scheduled creatives
+    instead of counting each once; without `sched` it defines the flights itself. Reuses the last --perf/--sched
+    when not given; `delivery` only applies when passed, so dropping it goes back to
+    unweighted counts. Returns the mix CSV path, or None when there is nothing to
+    correlate.
+    """
+    p, state = brand_paths(brand_dir), StageState(brand_dir)
+    previous = state.params("correlate")
+    perf = perf or previous.get("perf")
+    sched = sched or previous.get("sched")
+    if not (perf and (sched or delivery)):
+        print("  correlate: no --perf and --sched/--delivery given or recorded, skipping")
+        return None
+    perf, sched, delivery = (str(Path(f).resolve()) if f else None for f in (perf, sched, delivery))
+    inputs = [f for f in (perf, sched, delivery) if f]
+    signature = stage_signature(inputs + [p["master"]], attributes=DRIVER_ATTRIBUTES,
+                                max_lag=DRIVER_MAX_LAG, decays=DRIVER_ADSTOCK_DECAYS)
+    if _skip(state, "correlate", signature, [p["mix"], p["drivers"]], force): return p["mix"]
+    _require(p["master"], "correlate", "aggregate")
+
+    from .dataset import AnalysisDataset
+    from .drivers import correlate_drivers
+    import pandas as pd
+    from .processing import correlate_performance, expand_schedule, load_delivery, scheduled_delivery, schedule_weights
+    with run_profile.stage("correlate"):
+        weights = load_delivery(delivery) if delivery else None
+        if weights is not None and sched:
+            weights = scheduled_delivery(weights, schedule_weights(expand_schedule(pd.read_csv(sched))))
+        dataset = AnalysisDataset.load(p["master"])
+        mix = dataset.set_mix(correlate_performance(perf, sched, dataset, p["mix"], incremental=incremental,
+                                                    weights=weights), p["mix"])
+    if mix is None: return None
+    with run_profile.stage("drivers"):
+        correlate_drivers(perf, sched, dataset, p["drivers"], weights=weights)
+    state.record("correlate", signature, perf=perf, sched=sched)
+    return p["mix"]
+
+def visualize(brand_dir, force=False):
+    """Charts for the brand's analysis and daily mix. Returns the visualizations directory."""
+    p, state = brand_paths(brand_dir), StageState(brand_dir)
+    signature = stage_signature([p["master"], p["mix"]])
+    if _skip(state, "visualize", signature, [p["viz"] / CHART_MANIFEST_NAME], force): return p["viz"]
+    _require(p["master"], "visualize", "aggregate")
+
+    from .dataset import AnalysisDataset
+    from .visualization import generate_visualizations
+    with run_profile.stage("visualize"):
+        dataset = AnalysisDataset.load(p["master"], p["mix"])
+        generate_visualizations(dataset.mix, p["viz"], analysis=dataset)
+    state.record("visualize", signature)
+    return p["viz"]
+
+def report(brand_dir, api_key=None, permutations=INSIGHT_PERMUTATIONS, force=False, backend=None, limiters=None):
+    """Insights and final_report.html. Returns the report path.
+
+    Narratives come from the prompt-keyed cache when possible; the API key is only
+    needed for sections that miss it. A run with a failed section stays stale.
+    """
+    p, state = brand_paths(brand_dir), StageState(brand_dir)
+    signature = stage_signature([p["master"], p["mix"], p["drivers"], p["metrics"], (p["analysis"], "*.json"),
+                                 p["viz"] / CHART_MANIFEST_NAME, (TEMPLATE_DIR, "*")],
+                                permutations=permutations, model=GEMINI_MODEL_NAME, budget=REPORT_TOKEN_BUDGET)
+    if _skip(state, "report", signature, [p["report"]], force): return p["report"]
+    _require(p["master"], "report", "aggregate")
+
+    import pandas as pd
+    from .dataset import AnalysisDataset
+    from .processing import get_portfolio_summary, get_top_bottom_insights
+    from .reporting import generate_html_report
+    dataset = AnalysisDataset.load(p["master"], p["mix"])
+    metrics = json.loads(p["metrics"].read_text(encoding='utf-8')) if p["metrics"].exists() else {}
+    drivers = pd.read_csv(p["drivers"]) if p["drivers"].exists() else None
+    with run_profile.stage("insights"):
+        portfolio_summary = get_portfolio_summary(dataset)
+        insights = (get_top_bottom_insights(dataset.mix, dataset, n_permutations=permutations)
+                    if dataset.mix is not None else {})
+    with run_profile.stage("report"):
+        complete = generate_html_report(
+            insights_data=insights,
+            portfolio_summary=portfolio_summary,
+            correlation_data=dataset.mix,
+            video_metrics=metrics,
+            analysis_dir=p["analysis"],
+            viz_dir=p["viz"],
+            output_file=p["report"],
+            api_key=api_key,
+            backend=backend,
+            limiters=limiters,
+            drivers=drivers
+        )
+    state.record("report", signature if complete else None, permutations=permutations)
+    return p["report"]
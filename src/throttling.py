@@ -0,0 +1,88 @@
+import random
+import threading
+import time
+from urllib.parse import urlparse
+from .profiling import run_profile
+
+class RateLimiter:
+    """Token bucket allowing `rate` units per `per` seconds (thread-safe)."""
+
+    def __init__(self, rate, per=1.0, burst=None):
+        self.rate = float(rate)
+        self.per = float(per)
+        self.capacity = float(burst if burst is not None else rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate / self.per)
+        self._last = now
+
+    def acquire(self, amount=1):
+        if self.rate <= 0: return
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) * self.per / self.rate
+            time.sleep(wait)
+
+    def consume(self, amount):
+        # Charge usage discovered after the fact; may push the bucket into debt
+        if self.rate <= 0: return
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+
+class HostRateLimiter:
+    """One RateLimiter per URL host, created on first use."""
+
+    def __init__(self, rate, per=1.0):
+        self.rate = rate
+        self.per = per
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url, amount=1):
+        host = urlparse(url).netloc.lower() or "default"
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                limiter = self._limiters[host] = RateLimiter(self.rate, self.per)
+        limiter.acquire(amount)
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def is_transient_error(exc):
+    code = getattr(exc, "code", None)
+    if callable(code):
+        try: code = code()
+        except Exception: code = None
+    code = getattr(code, "value", code)
+    if isinstance(code, int):
+        return code in TRANSIENT_STATUS_CODES
+    msg = str(exc)
+    return any(str(c) in msg for c in TRANSIENT_STATUS_CODES) or "Resource has been exhausted" in msg
+
+def call_with_backoff(fn, retries=5, base=1.0, cap=60.0, is_retryable=is_transient_error, name=None):
+    # `name` records each attempt's latency and every retry in the run profile
+    for attempt in range(retries + 1):
+        start = time.perf_counter()
+        try:
+            result = fn()
+            if name: run_profile.api_call(name, time.perf_counter() - start)
+            return result
+        except Exception as e:
+            if name: run_profile.api_call(name, time.perf_counter() - start, failed=True)
+            if attempt == retries or not is_retryable(e): raise
+            if name: run_profile.retry(name)
+            time.sleep(backoff_delay(attempt, base=base, cap=cap))
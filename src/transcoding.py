@@ -0,0 +1,92 @@
+import csv
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from .config import PROXY_MAX_HEIGHT, PROXY_FPS, PROXY_AUDIO_KBPS, PROXY_CRF, TRANSCODE_WORKERS
+
+def proxy_path(video_path):
+    path = Path(video_path)
+    return path.with_name(f"{path.stem}.proxy.mp4")
+
+def _skip_marker(video_path):
+    # Records that the proxy was not smaller, for the original's size/mtime and the proxy options
+    path = Path(video_path)
+    return path.with_name(f"{path.stem}.proxy.skip")
+
+def transcode_proxy(video_path, max_height=PROXY_MAX_HEIGHT, fps=PROXY_FPS, audio_kbps=PROXY_AUDIO_KBPS,
+                    crf=PROXY_CRF, ffmpeg="ffmpeg"):
+    """Writes a compact analysis proxy next to the original; reuses it while it is newer.
+
+    Returns (path to upload, original bytes, proxy bytes). Falls back to the
+    original when transcoding fails or would not make the file smaller; the
+    latter is remembered in a marker, so ffmpeg does not rerun until the original
+    or the options change.
+    """
+    st = os.stat(video_path)
+    original_bytes = st.st_size
+    target, marker = proxy_path(video_path), _skip_marker(video_path)
+    if target.exists() and target.stat().st_mtime_ns >= st.st_mtime_ns:
+        return str(target), original_bytes, target.stat().st_size
+    stamp = f"{st.st_size} {st.st_mtime_ns} {max_height} {fps} {audio_kbps} {crf}"
+    try:
+        if marker.read_text(encoding='utf-8') == stamp:
+            return str(video_path), original_bytes, original_bytes
+    except OSError:
+        pass
+
+    tmp = target.with_name(target.name + ".part")
+    cmd = [
+        ffmpeg, "-y", "-loglevel", "error", "-i", str(video_path),
+        "-vf", f"scale=-2:'min({max_height},ih)',fps={fps}",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", str(crf),
+        "-c:a", "aac", "-b:a", f"{audio_kbps}k", "-ac", "1",
+        "-movflags", "+faststart", "-f", "mp4", str(tmp)
+    ]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        tmp.unlink(missing_ok=True)
+        detail = e.stderr.decode(errors='ignore').strip() if getattr(e, 'stderr', None) else e
+        print(f"  Proxy failed for {Path(video_path).name}: {detail}")
+        return str(video_path), original_bytes, original_bytes
+
+    if tmp.stat().st_size >= original_bytes:
+        tmp.unlink(missing_ok=True)
+        marker.write_text(stamp, encoding='utf-8')
+        return str(video_path), original_bytes, original_bytes
+    os.replace(tmp, target)
+    marker.unlink(missing_ok=True)
+    return str(target), original_bytes, target.stat().st_size
+
+def transcode_videos(video_paths, report_csv=None, workers=TRANSCODE_WORKERS, **proxy_opts):
+    """Transcodes {url: path} into {url: upload path} with one ffmpeg process per worker."""
+    if not video_paths: return {}
+    if not shutil.which(proxy_opts.get("ffmpeg", "ffmpeg")):
+        print("  ffmpeg not found; uploading original files.")
+        return dict(video_paths)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = dict(zip(video_paths, pool.map(lambda p: transcode_proxy(p, **proxy_opts), video_paths.values())))
+
+    rows = []
+    for url, (path, original_bytes, proxy_bytes) in results.items():
+        saved = original_bytes - proxy_bytes
+        rows.append({
+            "video_id": Path(video_paths[url]).stem,
+            "original_bytes": original_bytes,
+            "proxy_bytes": proxy_bytes,
+            "saved_bytes": saved,
+            "saved_pct": round(100 * saved / original_bytes, 1) if original_bytes else 0.0
+        })
+    total_original = sum(r["original_bytes"] for r in rows)
+    total_saved = sum(r["saved_bytes"] for r in rows)
+    print(f"  Proxies: {total_saved / (1024 * 1024):.1f} MB saved of {total_original / (1024 * 1024):.1f} MB")
+
+    if report_csv:
+        with open(report_csv, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    return {url: path for url, (path, _, _) in results.items()}
@@ -0,0 +1,142 @@
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from .cache import file_sha256
+from .config import VIDEO_INDEX_NAME, VIDEO_PARTIAL_MAX_AGE_HOURS
+
+MEDIA_EXTENSIONS = {"mp4", "webm", "mkv", "mov", "m4v"}
+PARTIAL_PATTERN = re.compile(r"\.(part|ytdl|temp|tmp)(-Frag\d+)?$|\.f\d+\.\w+$")
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_video_id(url):
+    patterns = [
+        r'(?:v=|\/)([0-9A-Za-z_-]{11}).*',
+        r'(?:be\/)([0-9A-Za-z_-]{11}).*'
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, url)
+        if match:
+            return match.group(1)
+    return None
+
+class VideoStore:
+    """Persistent index of complete downloads in one directory: id -> path, size, duration, sha256.
+
+    Lookups are dict hits instead of directory scans, and an entry only counts as
+    cached while its file still exists with the recorded size. Downloads are
+    checked against their sha256 (`verify`) before being reused.
+    """
+
+    def __init__(self, videos_dir):
+        self.videos_dir = Path(videos_dir)
+        self.videos_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.videos_dir / VIDEO_INDEX_NAME
+        self._lock = threading.Lock()
+        self._verified = set()  # ids checksummed by this process
+        self._index = self._load()
+
+    @classmethod
+    def open(cls, videos_dir):
+        # One shared instance per directory so concurrent downloads see the same index
+        key = os.path.abspath(videos_dir)
+        with _stores_lock:
+            if key not in _stores:
+                _stores[key] = cls(videos_dir)
+            return _stores[key]
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return self._adopt_existing()
+
+    def _adopt_existing(self):
+        # First run on a legacy directory: index complete media files once, checksum lazily
+        index = {}
+        for entry in os.scandir(self.videos_dir):
+            stem, _, ext = entry.name.rpartition(".")
+            if entry.is_file() and ext in MEDIA_EXTENSIONS and "." not in stem and entry.stat().st_size > 0:
+                index[stem] = {"path": entry.name, "size": entry.stat().st_size, "duration": None, "sha256": None}
+        self._index = index
+        self._save()
+        return index
+
+    def _save(self):
+        tmp = self.index_path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f)
+        os.replace(tmp, self.index_path)
+
+    def get(self, video_id):
+        """Path of a complete download, or None (stale entries are dropped)."""
+        with self._lock:
+            entry = self._index.get(video_id)
+            if not entry: return None
+            path = self.videos_dir / entry["path"]
+            try:
+                if path.stat().st_size == entry["size"]: return str(path)
+            except OSError:
+                pass
+            del self._index[video_id]
+            self._save()
+            return None
+
+    def add(self, video_id, path, duration=None):
+        path = Path(path)
+        if PARTIAL_PATTERN.search(path.name) or not path.exists() or path.stat().st_size == 0:
+            raise ValueError(f"Incomplete download: {path.name}")
+        entry = {"path": path.name, "size": path.stat().st_size, "duration": duration, "sha256": file_sha256(path)}
+        with self._lock:
+            self._index[video_id] = entry
+            self._verified.add(video_id)
+            self._save()
+        return str(path)
+
+    def find_media(self, video_id):
+        # Fallback for downloads whose final name yt-dlp did not report
+        for ext in MEDIA_EXTENSIONS:
+            path = self.videos_dir / f"{video_id}.{ext}"
+            if path.exists(): return path
+        return None
+
+    def partials(self, video_id):
+        return [p for p in self.videos_dir.glob(f"{video_id}.*") if PARTIAL_PATTERN.search(p.name)]
+
+    def clean_partials(self, video_id=None, max_age_hours=VIDEO_PARTIAL_MAX_AGE_HOURS):
+        """Deletes partial fragments older than max_age_hours; younger ones are left for yt-dlp to resume."""
+        cutoff = time.time() - max_age_hours * 3600
+        pattern = f"{video_id}.*" if video_id else "*"
+        removed = 0
+        for path in self.videos_dir.glob(pattern):
+            if PARTIAL_PATTERN.search(path.name) and path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    def verify(self, video_id):
+        """Full integrity check against the recorded checksum (computed now for adopted files).
+
+        A file that fails is dropped from the index; each id is hashed at most once per process.
+        """
+        path = self.get(video_id)
+        if not path: return False
+        with self._lock:
+            if video_id in self._verified: return True
+            entry = self._index[video_id]
+        digest = file_sha256(path)
+        with self._lock:
+            if entry["sha256"] is None:
+                entry["sha256"] = digest
+                self._save()
+            if digest == entry["sha256"]:
+                self._verified.add(video_id)
+                return True
+            self._index.pop(video_id, None)
+            self._save()
+        return False
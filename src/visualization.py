@@ -1,22 +1,145 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+import hashlib
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from .config import CHART_FORMAT, CHART_WORKERS, CHART_MAX_POINTS, CHART_MANIFEST_NAME
+from .dataset import as_frame, CATEGORICAL_COLUMNS
+from .processing import MIX_COLUMNS
+
+KPI_COLUMN = "PerformanceMetric"
+
+def _pyplot():
+    # Imported on first draw, so reading the chart manifest (report stage) never loads matplotlib
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    plt.rcParams['svg.fonttype'] = 'none'  # keep text as text; much smaller SVGs
+    return plt
+
+def _render_heatmap(df, path):
+    import seaborn as sns
+    plt = _pyplot()
+    fig, ax = plt.subplots(figsize=(8, 6))
+    sns.heatmap(df.corr(), annot=True, fmt=".2f", cmap='coolwarm', vmin=-1, vmax=1, ax=ax)
+    ax.set_title('Correlation Matrix')
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+def _render_mix_timeseries(df, path):
+    df = df.assign(day=pd.to_datetime(df['day'])).sort_values('day').set_index('day')
+    if len(df) > CHART_MAX_POINTS:
+        df = df.resample('W').mean()
+    plt = _pyplot()
+    fig, ax = plt.subplots(figsize=(10, 5))
+    for c in [c for c in MIX_COLUMNS if c in df]:
+        ax.plot(df.index, df[c], linewidth=1, label=c.replace('mix_', '').replace('_pct', ''))
+    ax.set_ylabel('% of active creatives')
+    ax.set_ylim(0, 100)
+    kpi_ax = ax.twinx()
+    kpi_ax.plot(df.index, df[KPI_COLUMN], color='black', linewidth=1.5, label='KPI')
+    kpi_ax.set_ylabel('KPI')
+    lines = ax.get_legend_handles_labels()[0] + kpi_ax.get_legend_handles_labels()[0]
+    ax.legend(lines, [l.get_label() for l in lines], loc='upper left', fontsize=8, ncol=5)
+    ax.set_title('Daily Creative Mix vs KPI')
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+def _render_distributions(df, path):
+    cols = list(df.columns)
+    plt = _pyplot()
+    fig, axes = plt.subplots(1, len(cols), figsize=(4 * len(cols), 4), squeeze=False)
+    for ax, c in zip(axes[0], cols):
+        counts = df[c].astype(str).value_counts().head(8)
+        ax.barh(counts.index[::-1], counts.values[::-1], color='#F40009')
+        ax.set_title(c)
+        ax.tick_params(axis='y', labelsize=8)
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+# name -> (data source, columns, minimum columns present, renderer, caption)
+CHARTS = {
+    "heatmap": ("mix", [KPI_COLUMN] + MIX_COLUMNS, 2, _render_heatmap,
+                "Matriz de Correlação - Drivers de KPI de Negócio"),
+    "mix_timeseries": ("mix", ['day', KPI_COLUMN] + MIX_COLUMNS, 3, _render_mix_timeseries,
+                       "Mix Criativo Diário vs KPI de Negócio"),
+    "attribute_distributions": ("analysis", CATEGORICAL_COLUMNS, 1, _render_distributions,
+                                "Distribuição de Atributos do Portfólio"),
+}
+
+def _chart_inputs(name, sources):
+    source, columns, min_columns, _, _ = CHARTS[name]
+    df = sources.get(source)
+    if df is None: return None
+    cols = [c for c in columns if c in df.columns]
+    if name == "mix_timeseries" and not {'day', KPI_COLUMN} <= set(cols): return None
+    return df[cols] if len(cols) >= min_columns else None
 
-def generate_visualizations(csv_path, output_dir):
-    if not os.path.exists(csv_path): return
+def _input_hash(name, df, fmt):
+    # Data, output format and the renderer's code, so editing a chart re-renders it
+    code = CHARTS[name][3].__code__
+    h = hashlib.sha256(f"{name}|{fmt}|{list(df.columns)}".encode())
+    h.update(code.co_code + repr(code.co_consts).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+def _render(name, df, path):
+    CHARTS[name][3](df, path)
+    return name
+
+def _load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, CHART_MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def generate_visualizations(csv_path, output_dir, analysis=None, workers=CHART_WORKERS, fmt=CHART_FORMAT):
+    """Renders the declared CHARTS into output_dir, skipping those whose input data is unchanged.
+
+    `csv_path` is the daily mix (path or DataFrame); `analysis` the master analysis
+    (path, DataFrame or AnalysisDataset). Charts are drawn in a process pool with the
+    Agg backend. Returns {name: path} for every chart that is up to date.
+    """
     os.makedirs(output_dir, exist_ok=True)
-    
-    df = pd.read_csv(csv_path)
-    cols = ['PerformanceMetric', 'mix_emotional_pct', 'mix_rational_pct' 'mix_product_pct', 'mix_brand_pct']
-    cols = [c for c in cols if c in df.columns]
-    
-    if len(cols) < 2: return
-
-    # Heatmap
-    plt.figure(figsize=(8,6))
-    sns.heatmap(df[cols].corr(), annot=True, cmap='coolwarm', vmin=-1, vmax=1)
-    plt.title('Correlation Matrix')
-    plt.tight_layout()
-    plt.savefig(os.path.join(output_dir, 'heatmap.png'))
-    plt.close()
+    sources = {}
+    for source, value in (("mix", csv_path), ("analysis", analysis)):
+        if value is None or (isinstance(value, (str, os.PathLike)) and not os.path.exists(value)): continue
+        sources[source] = as_frame(value)
+
+    manifest = _load_manifest(output_dir)
+    charts, todo = {}, {}
+    for name in CHARTS:
+        df = _chart_inputs(name, sources)
+        if df is None: continue
+        path = os.path.join(output_dir, f"{name}.{fmt}")
+        digest = _input_hash(name, df, fmt)
+        charts[name] = path
+        if manifest.get(name, {}).get("hash") == digest and os.path.exists(path): continue
+        todo[name] = (df, path, digest)
+
+    if len(todo) > 1 and workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+            for future in [pool.submit(_render, name, df, path) for name, (df, path, _) in todo.items()]:
+                future.result()
+    else:
+        for name, (df, path, _) in todo.items():
+            _render(name, df, path)
+
+    manifest = {name: {"hash": todo[name][2] if name in todo else manifest[name]["hash"],
+                       "file": os.path.basename(path), "caption": CHARTS[name][4]}
+                for name, path in charts.items()}
+    with open(os.path.join(output_dir, CHART_MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    print(f"  Charts: {len(todo)} rendered, {len(charts) - len(todo)} unchanged")
+    return charts
+
+def load_charts(output_dir):
+    """[(name, caption, path)] for the charts last written to output_dir, in declaration order."""
+    manifest = _load_manifest(output_dir)
+    return [(name, manifest[name]["caption"], os.path.join(output_dir, manifest[name]["file"]))
+            for name in CHARTS if name in manifest and os.path.exists(os.path.join(output_dir, manifest[name]["file"]))]